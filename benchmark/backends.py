@@ -0,0 +1,129 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from typing import Dict, List, Sequence
+
+from benchmark.data_gen import DISTRIBUTIONS
+from benchmark.suite import SuiteConfig, build_synthetic_index, generate_workloads, summarize, time_single
+
+
+def time_range(teq_index, queries: List[Dict], config: SuiteConfig, radius: float = 1.0) -> Dict[str, float]:
+    """Latency of plain range queries (query_range over a box of +-radius) around each query location"""
+    root = teq_index.spatial_index
+    boxes = [(q['location'][0] - radius, q['location'][1] - radius,
+              q['location'][0] + radius, q['location'][1] + radius) for q in queries]
+    for _ in range(config.warmup):
+        for box in boxes:
+            root.query_range(box, [])
+    samples = []
+    for _ in range(config.repeats):
+        for box in boxes:
+            start = time.perf_counter_ns()
+            root.query_range(box, [])
+            samples.append(time.perf_counter_ns() - start)
+    return summarize(samples)
+
+
+def compare_backends(config: SuiteConfig, backends: Sequence[str]) -> Dict[str, Dict]:
+    """
+    Build the same synthetic dataset with every backend and measure each one.
+
+    Returns:
+        backend -> build_ms, save_ms, load_ms, resident bytes in memory after load,
+        range-query latency, and single-query latency per query type
+    """
+    from index.teq_index import TEQIndex
+    from queries.power import POWERQueryProcessor
+
+    workloads = generate_workloads(config)
+    report = {}
+    for backend in backends:
+        backend_config = replace(config, backend=backend)
+        directory = tempfile.mkdtemp(prefix=f'uask_{backend}_')
+        try:
+            start = time.perf_counter_ns()
+            teq_index = build_synthetic_index(backend_config)
+            build_ms = (time.perf_counter_ns() - start) / 1e6
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter_ns()
+                teq_index.save_index(directory)
+                save_ms = (time.perf_counter_ns() - start) / 1e6
+                del teq_index
+                start = time.perf_counter_ns()
+                teq_index = TEQIndex.load_index(directory)
+                load_ms = (time.perf_counter_ns() - start) / 1e6
+            disk_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        power = POWERQueryProcessor(teq_index)
+        memory = teq_index.memory_report()
+        first = next(iter(workloads.values()))
+        report[backend] = {
+            'build_ms': build_ms,
+            'save_ms': save_ms,
+            'load_ms': load_ms,
+            'disk_bytes': disk_bytes,
+            'memory_bytes': memory['total_bytes'],
+            'index_bytes': sum(memory['components'][name] for name in
+                               ('quadtree_nodes', 'node_summaries', 'leaf_ids', 'leaf_coords', 'leaf_keywords')),
+            'range': time_range(teq_index, first, config),
+            'single': {name: time_single(power, queries, config) for name, queries in workloads.items()},
+        }
+    return report
+
+
+def print_comparison(report: Dict[str, Dict]) -> None:
+    print("--------------------------------")
+    print(f"{'backend':<10}{'build ms':>10}{'save ms':>10}{'load ms':>10}{'disk MB':>9}{'mem MB':>9}"
+          f"{'index MB':>10}{'range p50':>11}")
+    for backend, row in report.items():
+        print(f"{backend:<10}{row['build_ms']:10.0f}{row['save_ms']:10.0f}{row['load_ms']:10.0f}"
+              f"{row['disk_bytes'] / 2**20:9.1f}{row['memory_bytes'] / 2**20:9.1f}{row['index_bytes'] / 2**20:10.1f}"
+              f"{row['range']['p50_ms']:11.3f}")
+    names = list(next(iter(report.values()))['single'])
+    print(f"{'single p50/p95 ms':<22}" + ''.join(f"{name:>24}" for name in names))
+    for backend, row in report.items():
+        cells = ''.join(f"{row['single'][n]['p50_ms']:>13.3f}/{row['single'][n]['p95_ms']:<10.3f}" for n in names)
+        print(f"{backend:<22}{cells}")
+    print("--------------------------------")
+
+
+def main(argv=None) -> int:
+    """
+    Compare spatial backends on the same synthetic data, e.g.
+
+        python -m benchmark.backends --objects 200000 --distribution clustered
+    """
+    from index.teq_index import SPATIAL_BACKENDS
+
+    parser = argparse.ArgumentParser(description="Build, load, memory and latency per spatial backend")
+    parser.add_argument('--backends', nargs='+', choices=sorted(SPATIAL_BACKENDS), default=sorted(SPATIAL_BACKENDS))
+    parser.add_argument('--seed', type=int, default=SuiteConfig.seed)
+    parser.add_argument('--objects', type=int, default=SuiteConfig.n_objects)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default=SuiteConfig.distribution)
+    parser.add_argument('--queries', type=int, default=SuiteConfig.n_queries)
+    parser.add_argument('--repeats', type=int, default=SuiteConfig.repeats)
+    parser.add_argument('--out', help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    config = SuiteConfig(seed=args.seed, n_objects=args.objects, distribution=args.distribution,
+                         n_queries=args.queries, repeats=args.repeats)
+    report = compare_backends(config, args.backends)
+    print_comparison(report)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -147,3 +147,71 @@ class Benchmark:
             res.append(time_end-time_start)
 
         return res
+
+    @staticmethod
+    def bloom_filter_test(records, bounds, queries, settings=((0, 0), (64, 2), (256, 3), (1024, 4)), search_radius=10):
+        """
+        Measures keyword Bloom filters on internal nodes against the plain range traversal.
+        An index is built from records for every (bloom_bits, bloom_hashes) setting and the
+        queries are answered with get_candidates(use_bloom=True).
+
+        Args:
+            records (list): (obj_id, location, keywords, full_text[, weights]) tuples to index.
+            bounds (tuple): Bounds of the index.
+            queries (list): A list of queries, e.g. from generate_experiment.
+            settings (tuple, optional): (bloom_bits, bloom_hashes) pairs; (0, 0) disables filters.
+            search_radius (float, optional): Search radius passed to get_candidates. Defaults to 10.
+
+        Returns:
+            dict: Per setting, the total query time, filter memory in bytes and the observed
+            false-positive rate (nodes passed by the filter that hold none of the positive keywords).
+        """
+        from index.teq_index import TEQIndex
+        from models.bloom import KeywordBloom
+
+        res = {}
+        print("--------------------------------")
+        print("Bloom filter keyword summaries")
+        for bits, hashes in settings:
+            teq_index = TEQIndex(bounds, expected_objects=len(records), bloom_bits=bits, bloom_hashes=hashes)
+            teq_index.add_batch(records)
+
+            nodes = []
+            stack = [teq_index.spatial_index]
+            while stack:
+                node = stack.pop()
+                nodes.append(node)
+                stack.extend(node.children or ())
+
+            false_positives = negatives = 0
+            if bits:
+                for query in queries:
+                    masks = teq_index.bloom_masks(query["positive_keywords"])
+                    for node in nodes:
+                        if any(kw in node.max_weights for kw in query["positive_keywords"]):
+                            continue
+                        negatives += 1
+                        if KeywordBloom.might_contain_any(node.bloom, masks):
+                            false_positives += 1
+
+            times = []
+            for query in queries:
+                start = time.time()
+                teq_index.get_candidates(query["location"], query["positive_keywords"], query["negative_keywords"],
+                                         search_radius, use_bloom=bool(bits))
+                times.append(time.time() - start)
+
+            res[(bits, hashes)] = {
+                'total_time': np.sum(times),
+                'filter_bytes': len(nodes) * bits // 8,
+                'false_positive_rate': false_positives / negatives if negatives else 0.0
+            }
+            print("--------------------------------")
+            print(f"Bloom bits: {bits}, hashes: {hashes}")
+            print(f"Average Time: {np.mean(times)}")
+            print(f"Total Time: {np.sum(times):.3f}s")
+            print(f"Filter memory: {res[(bits, hashes)]['filter_bytes']:,} bytes over {len(nodes):,} nodes")
+            print(f"False positive rate: {res[(bits, hashes)]['false_positive_rate']:.4f}")
+            print("--------------------------------")
+
+        return res
@@ -0,0 +1,117 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from benchmark.backends import time_range
+from benchmark.data_gen import DISTRIBUTIONS
+from benchmark.suite import SuiteConfig, _run_query, build_synthetic_index, generate_workloads, time_single
+
+LAYOUTS = ('plain', 'compact')
+INDEX_COMPONENTS = ('quadtree_nodes', 'node_summaries', 'leaf_ids', 'leaf_coords', 'leaf_keywords', 'leaf_postings')
+
+
+def _save_and_load(teq_index, directory: str):
+    from index.teq_index import TEQIndex
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        teq_index.save_index(directory)
+        start = time.perf_counter_ns()
+        loaded = TEQIndex.load_index(directory)
+        load_ms = (time.perf_counter_ns() - start) / 1e6
+    disk_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    return loaded, load_ms, disk_bytes
+
+
+def compare_layouts(config: SuiteConfig) -> Dict[str, Dict]:
+    """
+    Build one synthetic quadtree index and measure it loaded from disk as saved plain
+    and as saved compact (packed leaves).
+
+    Returns:
+        layout -> load_ms, disk_bytes, resident memory and index bytes after load,
+        range-query latency, single-query latency per query type, and for the compact
+        layout the share of queries whose top-k ids match the plain layout's
+    """
+    from queries.power import POWERQueryProcessor
+
+    workloads = generate_workloads(config)
+    teq_index = build_synthetic_index(config)
+    report, answers = {}, {}
+    for layout in LAYOUTS:
+        if layout == 'compact':
+            teq_index.compact()
+        directory = tempfile.mkdtemp(prefix=f'uask_{layout}_')
+        try:
+            loaded, load_ms, disk_bytes = _save_and_load(teq_index, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        power = POWERQueryProcessor(loaded)
+        memory = loaded.memory_report()
+        first = next(iter(workloads.values()))
+        answers[layout] = [[row[1] for row in _run_query(power, query)]
+                           for queries in workloads.values() for query in queries]
+        report[layout] = {
+            'load_ms': load_ms,
+            'disk_bytes': disk_bytes,
+            'memory_bytes': memory['total_bytes'],
+            'index_bytes': sum(memory['components'][name] for name in INDEX_COMPONENTS),
+            'range': time_range(loaded, first, config),
+            'single': {name: time_single(power, queries, config) for name, queries in workloads.items()},
+        }
+        del power, loaded
+    same = sum(plain == compact for plain, compact in zip(answers['plain'], answers['compact']))
+    report['compact']['same_top_k'] = same / max(1, len(answers['plain']))
+    return report
+
+
+def print_comparison(report: Dict[str, Dict]) -> None:
+    print("--------------------------------")
+    print(f"{'layout':<10}{'load ms':>10}{'disk MB':>9}{'mem MB':>9}{'index MB':>10}{'range p50':>11}")
+    for layout, row in report.items():
+        print(f"{layout:<10}{row['load_ms']:10.0f}{row['disk_bytes'] / 2**20:9.1f}"
+              f"{row['memory_bytes'] / 2**20:9.1f}{row['index_bytes'] / 2**20:10.1f}{row['range']['p50_ms']:11.3f}")
+    names = list(report['plain']['single'])
+    print(f"{'single p50/p95 ms':<22}" + ''.join(f"{name:>24}" for name in names))
+    for layout, row in report.items():
+        cells = ''.join(f"{row['single'][n]['p50_ms']:>13.3f}/{row['single'][n]['p95_ms']:<10.3f}" for n in names)
+        print(f"{layout:<22}{cells}")
+    print(f"Compact top-k identical to plain for {report['compact']['same_top_k']:.1%} of queries")
+    print("--------------------------------")
+
+
+def main(argv=None) -> int:
+    """
+    Memory against latency of compact (packed-leaf) indexes, e.g.
+
+        python -m benchmark.compact --objects 200000 --distribution clustered
+    """
+    parser = argparse.ArgumentParser(description="Load time, disk and memory size and latency, plain vs compact")
+    parser.add_argument('--seed', type=int, default=SuiteConfig.seed)
+    parser.add_argument('--objects', type=int, default=SuiteConfig.n_objects)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default=SuiteConfig.distribution)
+    parser.add_argument('--queries', type=int, default=SuiteConfig.n_queries)
+    parser.add_argument('--repeats', type=int, default=SuiteConfig.repeats)
+    parser.add_argument('--out', help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    config = SuiteConfig(seed=args.seed, n_objects=args.objects, distribution=args.distribution,
+                         n_queries=args.queries, repeats=args.repeats)
+    report = compare_layouts(config)
+    print_comparison(report)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from benchmark.query_gen import QueryGenerator
+
+DISTRIBUTIONS = ('uniform', 'clustered', 'gaussian_mixture', 'city')
+
+
+class DatasetGenerator:
+    """
+    DatasetGenerator produces synthetic spatial-keyword objects for scale testing without the U-ASK corpus.
+
+    Objects come out in the record shape run_build_index / TEQIndex.add_batch consume,
+    (obj_id, (lat, lon), keywords, full_text, weights), either as chunks of records or as a
+    CSV with the ObjectID, Latitude, Longitude, Keywords, Weights and FullText columns read by
+    utils.dataloader.load_dataset. Generation is chunked and seeded, so 50M objects stream
+    through bounded memory and the same seed always yields the same dataset.
+
+    Attributes:
+        bounds (tuple): (min_lat, min_lon, max_lat, max_lon) every location is clipped to.
+        vocabulary (list): Keywords ordered by popularity rank. The QueryGenerator keywords
+            come first so generated queries hit the popular head of the distribution.
+        zipf_s (float): Zipf exponent of keyword popularity.
+        keyword_range (tuple): Minimum and maximum number of keywords per object.
+        seed (int): Seed of the generator.
+    """
+    def __init__(self, bounds=(-90.0, -180.0, 90.0, 180.0), vocabulary_size=5000, zipf_s=1.1,
+                 keyword_range=(2, 8), n_centres=50, seed=0):
+        self.bounds = bounds
+        self.zipf_s = zipf_s
+        self.keyword_range = keyword_range
+        self.n_centres = n_centres
+        self.seed = seed
+
+        head = list(dict.fromkeys(QueryGenerator().keywords))
+        self.vocabulary = head + [f"kw{i}" for i in range(max(0, vocabulary_size - len(head)))]
+        ranks = np.arange(1, len(self.vocabulary) + 1, dtype=np.float64)
+        popularity = ranks ** -zipf_s
+        self._keyword_p = popularity / popularity.sum()
+
+    def _centres(self, rng, n) -> Tuple[np.ndarray, np.ndarray]:
+        # Centre locations and Zipf-distributed shares of the objects around them
+        lat_min, lon_min, lat_max, lon_max = self.bounds
+        centres = np.column_stack([rng.uniform(lat_min, lat_max, n), rng.uniform(lon_min, lon_max, n)])
+        shares = 1.0 / np.arange(1, n + 1)
+        return centres, shares / shares.sum()
+
+    def _locations(self, rng, n, distribution, centres, shares) -> np.ndarray:
+        lat_min, lon_min, lat_max, lon_max = self.bounds
+        span = min(lat_max - lat_min, lon_max - lon_min)
+        if distribution == 'uniform':
+            locations = np.column_stack([rng.uniform(lat_min, lat_max, n), rng.uniform(lon_min, lon_max, n)])
+        elif distribution == 'clustered':
+            # A few tight clusters over a sparse uniform background
+            which = rng.integers(0, len(centres), n)
+            locations = centres[which] + rng.normal(0.0, span * 0.002, (n, 2))
+            background = rng.random(n) < 0.1
+            locations[background] = np.column_stack([
+                rng.uniform(lat_min, lat_max, background.sum()),
+                rng.uniform(lon_min, lon_max, background.sum())])
+        elif distribution == 'gaussian_mixture':
+            # Components of Zipf-distributed weight and log-uniform spread
+            which = rng.choice(len(centres), n, p=shares)
+            sigma = span * np.exp(np.random.default_rng(self.seed + 1).uniform(np.log(1e-4), np.log(2e-2), len(centres)))
+            locations = centres[which] + rng.normal(0.0, 1.0, (n, 2)) * sigma[which, None]
+        elif distribution == 'city':
+            # Cities of Zipf population, density decaying exponentially from the centre,
+            # with most objects snapped to a street grid and a small rural share
+            which = rng.choice(len(centres), n, p=shares)
+            radius = rng.exponential(span * 0.001 * np.sqrt(shares[which] * len(centres)))
+            angle = rng.uniform(0.0, 2 * np.pi, n)
+            locations = centres[which] + np.column_stack([radius * np.cos(angle), radius * np.sin(angle)])
+            on_grid = rng.random(n) < 0.7
+            locations[on_grid] = np.round(locations[on_grid], 3)
+            rural = rng.random(n) < 0.05
+            locations[rural] = np.column_stack([
+                rng.uniform(lat_min, lat_max, rural.sum()), rng.uniform(lon_min, lon_max, rural.sum())])
+        else:
+            raise ValueError(f"Unknown distribution '{distribution}', expected one of {DISTRIBUTIONS}")
+        np.clip(locations[:, 0], lat_min, lat_max, out=locations[:, 0])
+        np.clip(locations[:, 1], lon_min, lon_max, out=locations[:, 1])
+        return locations
+
+    def iter_chunks(self, n, distribution='city', chunk_size=100000) -> Iterator[List[Tuple]]:
+        """
+        Generates n objects in chunks of records.
+
+        Args:
+            n (int): Number of objects to generate.
+            distribution (str): One of 'uniform', 'clustered', 'gaussian_mixture' or 'city'.
+            chunk_size (int): Records per yielded chunk.
+
+        Yields:
+            list: (obj_id, (lat, lon), keywords, full_text, weights) tuples.
+        """
+        rng = np.random.default_rng(self.seed)
+        centres, shares = self._centres(rng, self.n_centres)
+        vocabulary = np.array(self.vocabulary, dtype=object)
+        lo, hi = self.keyword_range
+        for start in range(0, n, chunk_size):
+            size = min(chunk_size, n - start)
+            locations = self._locations(rng, size, distribution, centres, shares).tolist()
+            counts = rng.integers(lo, hi + 1, size)
+            drawn = vocabulary[rng.choice(len(vocabulary), counts.sum(), p=self._keyword_p)].tolist()
+            weights = np.round(rng.uniform(0.05, 1.0, counts.sum()), 4).tolist()
+            records = []
+            offset = 0
+            for i in range(size):
+                end = offset + counts[i]
+                keyword_weights = dict(zip(drawn[offset:end], weights[offset:end]))
+                keywords = list(keyword_weights)
+                records.append((start + i, tuple(locations[i]), keywords, ' '.join(keywords),
+                                list(keyword_weights.values())))
+                offset = end
+            yield records
+
+    def generate(self, n, distribution='city') -> List[Tuple]:
+        """Generates n objects as a single list of records."""
+        records = []
+        for chunk in self.iter_chunks(n, distribution):
+            records.extend(chunk)
+        return records
+
+    def write_csv(self, path, n, distribution='city', chunk_size=100000):
+        """
+        Streams n objects to a CSV file readable by utils.dataloader.load_dataset.
+
+        Args:
+            path (str): Output file path.
+            n (int): Number of objects to generate.
+            distribution (str): Spatial distribution of the objects.
+            chunk_size (int): Records generated and written at a time.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        start_time = time.time()
+        written = 0
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ObjectID', 'Latitude', 'Longitude', 'Keywords', 'Weights', 'FullText'])
+            for chunk in self.iter_chunks(n, distribution, chunk_size):
+                writer.writerows(
+                    (obj_id, lat, lon, repr(keywords), repr(weights), full_text)
+                    for obj_id, (lat, lon), keywords, full_text, weights in chunk)
+                written += len(chunk)
+                print(f"Written {written:,}/{n:,} objects ({written / (time.time() - start_time):,.0f} records/sec)")
+        print(f"Saved {distribution} dataset of {n:,} objects to {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic spatial-keyword dataset")
+    parser.add_argument('--n', type=int, default=100000, help="Number of objects (1k to 50M)")
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='city')
+    parser.add_argument('--vocabulary', type=int, default=5000, help="Vocabulary size")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of keyword popularity")
+    parser.add_argument('--centres', type=int, default=50, help="Clusters, mixture components or cities")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None,
+                        help="Output CSV (default: preprocessing/synthetic_<distribution>_<n>.csv)")
+    args = parser.parse_args(argv)
+
+    out = args.out or os.path.join('preprocessing', f"synthetic_{args.distribution}_{args.n}.csv")
+    generator = DatasetGenerator(vocabulary_size=args.vocabulary, zipf_s=args.zipf,
+                                 n_centres=args.centres, seed=args.seed)
+    generator.write_csv(out, args.n, args.distribution)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
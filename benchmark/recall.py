@@ -0,0 +1,131 @@
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from benchmark.data_gen import DISTRIBUTIONS
+from benchmark.suite import SuiteConfig, build_synthetic_index, generate_workloads, summarize
+from queries.power import POWERQueryProcessor, QueryBudget
+
+DEFAULT_BUDGETS = (
+    QueryBudget(max_nodes=4),
+    QueryBudget(max_nodes=16),
+    QueryBudget(max_nodes=64),
+    QueryBudget(max_scored=100),
+    QueryBudget(max_scored=1000),
+    QueryBudget(deadline_ms=0.5),
+    QueryBudget(deadline_ms=2.0),
+)
+
+
+def recall_at_k(exact: List[tuple], approximate: List[tuple]) -> float:
+    """
+    Fraction of the exact top-k objects found by the approximate query. Rows are
+    (-score, obj_id, ...) tuples as returned by process_query; objects tied with the
+    exact k-th score count as hits.
+    """
+    if not exact:
+        return 1.0
+    kth_score = -exact[-1][0]
+    exact_ids = {row[1] for row in exact}
+    hits = sum(1 for row in approximate if row[1] in exact_ids or -row[0] >= kth_score)
+    return min(hits, len(exact)) / len(exact)
+
+
+def recall_sweep(power: POWERQueryProcessor, queries: List[Dict],
+                 budgets: Sequence[QueryBudget] = DEFAULT_BUDGETS) -> List[Dict]:
+    """
+    Run every query exactly and under each budget.
+
+    Args:
+        power: Query processor over the index under test
+        queries: Query dicts as produced by QueryGenerator
+        budgets: Budgets to evaluate
+
+    Returns:
+        One dict per budget (the exact engine first) with mean and minimum recall@k, the
+        share of results flagged approximate and latency percentiles
+    """
+    def run(query, budget=None):
+        args = (query['location'], query['positive_keywords'], query['negative_keywords'], query['k'])
+        start = time.perf_counter_ns()
+        if budget is None:
+            rows = power.process_query(*args, lambda_factor=query['lambda_factor'])
+        else:
+            rows = power.process_query_approximate(*args, budget, lambda_factor=query['lambda_factor'])
+        return rows, time.perf_counter_ns() - start
+
+    exact_runs = [run(query) for query in queries]
+    report = [dict(budget='exact', recall_mean=1.0, recall_min=1.0, approximate_share=0.0,
+                   **summarize([elapsed for _, elapsed in exact_runs]))]
+    for budget in budgets:
+        recalls, flagged, samples = [], 0, []
+        for query, (exact, _) in zip(queries, exact_runs):
+            rows, elapsed = run(query, budget)
+            recalls.append(recall_at_k(exact, rows))
+            flagged += rows.approximate
+            samples.append(elapsed)
+        report.append(dict(budget=budget.describe(), recall_mean=float(np.mean(recalls)),
+                           recall_min=float(np.min(recalls)), approximate_share=flagged / len(queries),
+                           **summarize(samples)))
+    return report
+
+
+def print_sweep(report: List[Dict]) -> None:
+    print("--------------------------------")
+    print(f"{'budget':<22}{'recall':>8}{'min':>8}{'approx':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in report:
+        print(f"{row['budget']:<22}{row['recall_mean']:8.3f}{row['recall_min']:8.3f}"
+              f"{row['approximate_share']:8.1%}{row['p50_ms']:10.3f}{row['p95_ms']:10.3f}{row['p99_ms']:10.3f}")
+    print("--------------------------------")
+
+
+def _parse_budget(value: str) -> QueryBudget:
+    # e.g. "nodes=32", "scored=500,deadline_ms=1.5"
+    names = {'nodes': 'max_nodes', 'scored': 'max_scored', 'deadline_ms': 'deadline_ms', 'deadline': 'deadline_ms'}
+    limits = {}
+    for part in value.split(','):
+        name, _, limit = part.partition('=')
+        field = names[name.strip()]
+        limits[field] = float(limit) if field == 'deadline_ms' else int(limit)
+    return QueryBudget(**limits)
+
+
+def main(argv=None) -> int:
+    """
+    Measure recall@k of approximate queries against the exact engine, e.g.
+
+        python -m benchmark.recall --budget nodes=16 --budget scored=500 --budget deadline_ms=1
+    """
+    parser = argparse.ArgumentParser(description="Recall@k of budgeted approximate queries")
+    parser.add_argument('--seed', type=int, default=SuiteConfig.seed)
+    parser.add_argument('--objects', type=int, default=SuiteConfig.n_objects)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default=SuiteConfig.distribution)
+    parser.add_argument('--queries', type=int, default=SuiteConfig.n_queries)
+    parser.add_argument('--k', type=int, default=SuiteConfig.k)
+    parser.add_argument('--budget', action='append', default=[],
+                        help="Budget to evaluate, e.g. nodes=32 or scored=500,deadline_ms=1 (repeatable)")
+    parser.add_argument('--out', help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    config = SuiteConfig(seed=args.seed, n_objects=args.objects, distribution=args.distribution,
+                         n_queries=args.queries, k=args.k)
+    power = POWERQueryProcessor(build_synthetic_index(config))
+    budgets = [_parse_budget(value) for value in args.budget] or DEFAULT_BUDGETS
+    report = {}
+    for name, queries in generate_workloads(config).items():
+        print(f"Query type: {name}")
+        report[name] = recall_sweep(power, queries, budgets)
+        print_sweep(report[name])
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from benchmark.data_gen import DISTRIBUTIONS, DatasetGenerator
+from benchmark.query_gen import QueryGenerator
+from benchmark.workload import PROFILES, WorkloadGenerator
+
+# Query types of the default workload: (positive keywords, negative keywords) per query
+QUERY_TYPES = {
+    'single_keyword': (1, 0),
+    'multi_keyword': (3, 0),
+    'negative_keywords': (2, 2),
+}
+
+MODES = ('single', 'group', 'batch')
+
+# Default regression thresholds, as allowed relative slow-down per metric
+DEFAULT_THRESHOLDS = {'p50_ms': 0.10, 'p95_ms': 0.20, 'p99_ms': 0.30}
+
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass
+class SuiteConfig:
+    """
+    Settings of one benchmark run. Two runs with equal configs use identical data and queries.
+
+    Attributes:
+        seed (int): Seed for the synthetic dataset and the workloads.
+        n_objects (int): Number of objects in the synthetic index.
+        distribution (str): Spatial distribution of the synthetic objects (see DatasetGenerator).
+        n_queries (int): Number of queries per query type.
+        warmup (int): Untimed passes over each workload before measuring.
+        repeats (int): Timed passes over each workload.
+        batch_size (int): Queries per process_batch_queries call in batch mode.
+        cluster_size (int): max_cluster_size passed to the batch processor.
+        k (int): Number of results per query.
+        lambda_factor (float): Weight between spatial and textual relevance.
+        loc_range (list): Latitude and longitude ranges of objects and queries.
+        modes (list): Subset of 'single', 'group' and 'batch' to run.
+        query_types (dict): Query type name -> (positive keywords, negative keywords).
+        profiles (list): WorkloadGenerator profiles to run as extra query types, restricted
+            to loc_range.
+        backend (str): Spatial backend of the synthetic index (see TEQIndex SPATIAL_BACKENDS).
+    """
+    seed: int = 42
+    n_objects: int = 50000
+    distribution: str = 'clustered'
+    n_queries: int = 200
+    warmup: int = 1
+    repeats: int = 3
+    batch_size: int = 50
+    cluster_size: int = 20
+    k: int = 10
+    lambda_factor: float = 0.5
+    loc_range: List[Tuple[float, float]] = field(default_factory=lambda: [(-10.0, 10.0), (-10.0, 10.0)])
+    modes: List[str] = field(default_factory=lambda: list(MODES))
+    query_types: Dict[str, Tuple[int, int]] = field(default_factory=lambda: dict(QUERY_TYPES))
+    profiles: List[str] = field(default_factory=list)
+    backend: str = 'quadtree'
+
+
+def synthetic_records(config: SuiteConfig) -> List[Tuple]:
+    """Seeded synthetic objects over loc_range in the record shape TEQIndex.add_batch consumes"""
+    (lat_min, lat_max), (lon_min, lon_max) = config.loc_range
+    generator = DatasetGenerator(bounds=(lat_min, lon_min, lat_max, lon_max), vocabulary_size=1000,
+                                 n_centres=8, seed=config.seed)
+    return generator.generate(config.n_objects, config.distribution)
+
+
+def build_synthetic_index(config: SuiteConfig):
+    """Build an in-memory TEQIndex over synthetic_records(config)"""
+    from index.teq_index import TEQIndex
+
+    (lat_min, lat_max), (lon_min, lon_max) = config.loc_range
+    teq_index = TEQIndex((lat_min, lon_min, lat_max, lon_max), expected_objects=config.n_objects,
+                         backend=config.backend)
+    teq_index.add_batch(synthetic_records(config))
+    return teq_index
+
+
+def generate_workloads(config: SuiteConfig) -> Dict[str, List[Dict]]:
+    """Seeded query lists per query type"""
+    workloads = {}
+    for offset, (name, (n_pos, n_neg)) in enumerate(sorted(config.query_types.items())):
+        qg = QueryGenerator(seed=config.seed + offset + 1)
+        queries = qg.generate_queries(config.n_queries, n_pos, n_neg, config.k, config.lambda_factor,
+                                      config.loc_range)
+        for query_id, query in enumerate(queries):
+            query['query_id'] = query_id
+        workloads[name] = queries
+    for offset, name in enumerate(config.profiles, start=len(workloads) + 1):
+        profile = replace(PROFILES[name], loc_range=config.loc_range)
+        workloads[f'profile_{name}'] = WorkloadGenerator(profile, seed=config.seed + offset).generate(config.n_queries)
+    return workloads
+
+
+def summarize(samples_ns: List[int], queries_per_sample: int = 1) -> Dict[str, float]:
+    """Latency percentiles in milliseconds, per query, from raw nanosecond samples"""
+    per_query_ms = np.asarray(samples_ns, dtype=np.float64) / 1e6 / queries_per_sample
+    summary = {f'p{p}_ms': float(np.percentile(per_query_ms, p)) for p in PERCENTILES}
+    summary.update({
+        'max_ms': float(per_query_ms.max()),
+        'mean_ms': float(per_query_ms.mean()),
+        'samples': len(samples_ns),
+        'qps': float(1e3 / per_query_ms.mean()) if per_query_ms.mean() > 0 else 0.0,
+    })
+    return summary
+
+
+def _run_query(power, query):
+    return power.process_query(query['location'], query['positive_keywords'], query['negative_keywords'],
+                               query['k'], query['lambda_factor'])
+
+
+def time_single(power, queries: List[Dict], config: SuiteConfig) -> Dict[str, float]:
+    """Latency of each query run on its own"""
+    for _ in range(config.warmup):
+        for query in queries:
+            _run_query(power, query)
+    samples = []
+    for _ in range(config.repeats):
+        for query in queries:
+            start = time.perf_counter_ns()
+            _run_query(power, query)
+            samples.append(time.perf_counter_ns() - start)
+    return summarize(samples)
+
+
+def time_group(power, queries: List[Dict], config: SuiteConfig) -> Dict[str, float]:
+    """Wall time of answering the whole workload sequentially, amortized per query"""
+    for _ in range(config.warmup):
+        for query in queries:
+            _run_query(power, query)
+    samples = []
+    for _ in range(config.repeats):
+        start = time.perf_counter_ns()
+        for query in queries:
+            _run_query(power, query)
+        samples.append(time.perf_counter_ns() - start)
+    return summarize(samples, len(queries))
+
+
+def time_batch(batch_processor, queries: List[Dict], config: SuiteConfig) -> Dict[str, float]:
+    """Latency of process_batch_queries calls over batch_size queries, amortized per query"""
+    batches = [queries[i:i + config.batch_size] for i in range(0, len(queries), config.batch_size)]
+    for _ in range(config.warmup):
+        for batch in batches:
+            batch_processor.process_batch_queries(batch, config.cluster_size)
+    samples = []
+    for _ in range(config.repeats):
+        for batch in batches:
+            start = time.perf_counter_ns()
+            batch_processor.process_batch_queries(batch, config.cluster_size)
+            samples.append((time.perf_counter_ns() - start) / len(batch))
+    return summarize(samples)
+
+
+def collect_stats(power, batch_processor, mode: str, queries: List[Dict], config: SuiteConfig) -> Dict[str, float]:
+    """One untimed, instrumented pass over a workload; per-query mean counters and phase times."""
+    from queries.stats import QueryStats
+
+    stats = QueryStats()
+    if mode == 'batch':
+        for i in range(0, len(queries), config.batch_size):
+            batch_processor.process_batch_queries(queries[i:i + config.batch_size], config.cluster_size, stats=stats)
+    else:
+        for query in queries:
+            power.process_query(query['location'], query['positive_keywords'], query['negative_keywords'],
+                                query['k'], query['lambda_factor'], stats=stats)
+    return QueryStats.aggregate([stats])
+
+
+def run_suite(config: SuiteConfig, teq_index=None) -> Dict:
+    """
+    Run every configured mode over every query type.
+
+    Args:
+        config: Suite settings
+        teq_index: Index to benchmark; a synthetic index is built from config when omitted
+
+    Returns:
+        JSON-serializable dict with the config, environment, results[mode][query_type] and
+        the matching per-query execution counters in stats[mode][query_type]
+    """
+    from queries.batch_query import BatchPOWERQueryProcessor
+    from queries.power import POWERQueryProcessor
+
+    build_ms = None
+    if teq_index is None:
+        start = time.perf_counter_ns()
+        teq_index = build_synthetic_index(config)
+        build_ms = (time.perf_counter_ns() - start) / 1e6
+
+    power = POWERQueryProcessor(teq_index)
+    batch_processor = BatchPOWERQueryProcessor(teq_index, location_threshold=10.0)
+    workloads = generate_workloads(config)
+    timers = {
+        'single': lambda queries: time_single(power, queries, config),
+        'group': lambda queries: time_group(power, queries, config),
+        'batch': lambda queries: time_batch(batch_processor, queries, config),
+    }
+
+    results = {}
+    stats = {}
+    with batch_processor:
+        for mode in config.modes:
+            results[mode] = {name: timers[mode](queries) for name, queries in workloads.items()}
+            # Counters come from a separate pass so instrumentation never skews the timings
+            stats[mode] = {name: collect_stats(power, batch_processor, mode, queries, config)
+                           for name, queries in workloads.items()}
+
+    return {
+        'config': asdict(config),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'build_ms': build_ms,
+        'results': results,
+        'stats': stats,
+    }
+
+
+def compare(report: Dict, baseline: Dict, thresholds: Dict[str, float] = None) -> List[str]:
+    """
+    Compare a report against a baseline report.
+
+    Args:
+        report: Output of run_suite
+        baseline: Earlier output of run_suite
+        thresholds: Metric -> allowed relative increase (0.2 allows 20% slower)
+
+    Returns:
+        Human-readable descriptions of every regression past its threshold
+    """
+    thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+    regressions = []
+    for mode, query_types in report['results'].items():
+        for name, metrics in query_types.items():
+            base = baseline.get('results', {}).get(mode, {}).get(name)
+            if base is None:
+                continue
+            for metric, allowed in thresholds.items():
+                if metric not in metrics or not base.get(metric):
+                    continue
+                change = metrics[metric] / base[metric] - 1
+                if change > allowed:
+                    regressions.append(f"{mode}/{name} {metric}: {base[metric]:.3f}ms -> "
+                                       f"{metrics[metric]:.3f}ms (+{change:.1%}, allowed +{allowed:.0%})")
+    return regressions
+
+
+def print_report(report: Dict) -> None:
+    print("--------------------------------")
+    if report.get('build_ms') is not None:
+        print(f"Synthetic index build: {report['build_ms'] / 1e3:.2f}s")
+    for mode, query_types in report['results'].items():
+        for name, m in query_types.items():
+            print(f"{mode:<7}{name:<20} p50 {m['p50_ms']:8.3f}ms  p95 {m['p95_ms']:8.3f}ms  "
+                  f"p99 {m['p99_ms']:8.3f}ms  max {m['max_ms']:8.3f}ms  {m['qps']:10.1f} q/s")
+            s = report.get('stats', {}).get(mode, {}).get(name)
+            if s:
+                print(f"{'':<27}nodes {s['nodes_visited']:8.1f}  pruned {s['nodes_pruned']:8.1f}  "
+                      f"examined {s['objects_examined']:9.1f}  scored {s['objects_scored']:9.1f}")
+    print("--------------------------------")
+
+
+def _parse_thresholds(values: List[str]) -> Dict[str, float]:
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for value in values:
+        metric, _, allowed = value.partition('=')
+        metric = metric if metric.endswith('_ms') else metric + '_ms'
+        thresholds[metric] = float(allowed)
+    return thresholds
+
+
+def main(argv=None) -> int:
+    """
+    Run the suite from the command line, e.g.
+
+        python -m benchmark.suite --out results.json --save-baseline benchmark/baseline.json
+        python -m benchmark.suite --baseline benchmark/baseline.json --threshold p95=0.25
+
+    Returns 1 when a metric regresses past its threshold.
+    """
+    parser = argparse.ArgumentParser(description="Reproducible U-ASK benchmark suite")
+    parser.add_argument('--seed', type=int, default=SuiteConfig.seed)
+    parser.add_argument('--objects', type=int, default=SuiteConfig.n_objects)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default=SuiteConfig.distribution)
+    parser.add_argument('--queries', type=int, default=SuiteConfig.n_queries)
+    parser.add_argument('--warmup', type=int, default=SuiteConfig.warmup)
+    parser.add_argument('--repeats', type=int, default=SuiteConfig.repeats)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--profiles', nargs='*', choices=sorted(PROFILES), default=[],
+                        help="Workload profiles to add as query types")
+    parser.add_argument('--backend', default=SuiteConfig.backend, help="Spatial backend of the synthetic index")
+    parser.add_argument('--out', help="Write the JSON report to this file")
+    parser.add_argument('--baseline', help="Compare against this JSON report")
+    parser.add_argument('--save-baseline', help="Also write the report as a new baseline")
+    parser.add_argument('--threshold', action='append', default=[],
+                        help="Allowed relative regression, e.g. p95=0.25 (repeatable)")
+    args = parser.parse_args(argv)
+
+    config = SuiteConfig(seed=args.seed, n_objects=args.objects, distribution=args.distribution,
+                         n_queries=args.queries,
+                         warmup=args.warmup, repeats=args.repeats, modes=args.modes, profiles=args.profiles,
+                         backend=args.backend)
+    report = run_suite(config)
+    print_report(report)
+
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != json.loads(json.dumps(report['config'])):
+            print("Warning: baseline was recorded with a different configuration")
+        regressions = compare(report, baseline, _parse_thresholds(args.threshold))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from benchmark.query_gen import QueryGenerator
+
+
+@dataclass
+class WorkloadProfile:
+    """
+    Describes a query mix for WorkloadGenerator.
+
+    Attributes:
+        name (str): Name of the profile.
+        loc_range (list): Latitude and longitude ranges for background queries.
+        n_hotspots (int): Number of spatial hotspots, placed at seeded random positions
+            unless hotspots is given.
+        hotspots (list): Explicit (lat, lon, sigma) hotspots.
+        hotspot_share (float): Fraction of queries issued around a hotspot. Hotspot
+            popularity follows a Zipf law, so a few hotspots draw most of the traffic.
+        vocabulary (list): Query keywords ordered by popularity rank.
+        zipf_s (float): Zipf exponent of keyword popularity.
+        pos_range (tuple): Minimum and maximum number of positive keywords.
+        negative_rate (float): Probability that a query has negative keywords.
+        neg_range (tuple): Minimum and maximum number of negative keywords when it has any.
+        k_values (tuple): Possible k values, drawn with k_weights.
+        k_weights (tuple): Relative frequency of each k value.
+        lambda_beta (tuple): Beta(a, b) parameters of lambda_factor.
+        repeat_ratio (float): Probability that a query repeats an earlier one exactly.
+        arrival (str): 'poisson' for exponential inter-arrival times at rate, or 'bursty'
+            for an on/off process alternating burst_rate and rate.
+        rate (float): Mean queries per second (the idle rate for bursty arrivals).
+        burst_rate (float): Queries per second during a burst.
+        burst_length (float): Mean burst duration in seconds.
+        idle_length (float): Mean time between bursts in seconds.
+    """
+    name: str = 'default'
+    loc_range: List[Tuple[float, float]] = field(default_factory=lambda: [(-90.0, 90.0), (-180.0, 180.0)])
+    n_hotspots: int = 20
+    hotspots: Optional[List[Tuple[float, float, float]]] = None
+    hotspot_share: float = 0.8
+    vocabulary: List[str] = field(default_factory=lambda: list(dict.fromkeys(QueryGenerator().keywords)))
+    zipf_s: float = 1.0
+    pos_range: Tuple[int, int] = (1, 3)
+    negative_rate: float = 0.3
+    neg_range: Tuple[int, int] = (1, 2)
+    k_values: Tuple[int, ...] = (1, 5, 10, 20, 100)
+    k_weights: Tuple[float, ...] = (0.1, 0.3, 0.4, 0.15, 0.05)
+    lambda_beta: Tuple[float, float] = (5.0, 5.0)
+    repeat_ratio: float = 0.2
+    arrival: str = 'poisson'
+    rate: float = 100.0
+    burst_rate: float = 1000.0
+    burst_length: float = 1.0
+    idle_length: float = 5.0
+
+
+PROFILES = {
+    # Close to QueryGenerator.generate_queries: uniform locations and keywords, fixed k and lambda
+    'uniform': WorkloadProfile(name='uniform', n_hotspots=0, hotspot_share=0.0, zipf_s=0.0,
+                               pos_range=(3, 3), negative_rate=1.0, neg_range=(2, 2), k_values=(10,),
+                               k_weights=(1.0,), lambda_beta=(1e6, 1e6), repeat_ratio=0.0),
+    # City traffic: strong hotspots, skewed keywords, frequent repeats
+    'urban': WorkloadProfile(name='urban', n_hotspots=30, hotspot_share=0.9, zipf_s=1.2, repeat_ratio=0.3),
+    # Exclusion-heavy traffic such as "-closed" filters
+    'exclusion': WorkloadProfile(name='exclusion', negative_rate=0.9, neg_range=(1, 3)),
+    # Flash crowds: bursty arrivals concentrated on a few hotspots
+    'bursty': WorkloadProfile(name='bursty', n_hotspots=5, hotspot_share=0.95, arrival='bursty', rate=20.0,
+                              burst_rate=2000.0, burst_length=0.5, idle_length=2.0),
+}
+
+
+class WorkloadGenerator:
+    """
+    WorkloadGenerator produces realistic query mixes from a WorkloadProfile.
+
+    Queries are dicts in the format accepted by POWERQueryProcessor.process_query and
+    BatchPOWERQueryProcessor.process_batch_queries, with an extra 'arrival' timestamp in
+    seconds from the start of the workload.
+
+    Attributes:
+        profile (WorkloadProfile): The query mix to generate.
+        seed (int): Seed of the generator; equal seeds give identical workloads.
+    """
+    def __init__(self, profile='urban', seed=0):
+        self.profile = PROFILES[profile] if isinstance(profile, str) else profile
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        p = self.profile
+        if p.hotspots is not None:
+            self.hotspots = np.asarray(p.hotspots, dtype=np.float64).reshape(-1, 3)
+        elif p.n_hotspots:
+            (lat_min, lat_max), (lon_min, lon_max) = p.loc_range
+            self.hotspots = np.column_stack([
+                self.rng.uniform(lat_min, lat_max, p.n_hotspots),
+                self.rng.uniform(lon_min, lon_max, p.n_hotspots),
+                np.exp(self.rng.uniform(np.log(0.01), np.log(1.0), p.n_hotspots))])
+        else:
+            self.hotspots = np.empty((0, 3))
+        self._hotspot_p = self._zipf(len(self.hotspots), 1.0)
+        self._keyword_p = self._zipf(len(p.vocabulary), p.zipf_s)
+        k_weights = np.asarray(p.k_weights, dtype=np.float64)
+        self._k_p = k_weights / k_weights.sum()
+
+    @staticmethod
+    def _zipf(n, s) -> np.ndarray:
+        if n == 0:
+            return np.empty(0)
+        popularity = np.arange(1, n + 1, dtype=np.float64) ** -s
+        return popularity / popularity.sum()
+
+    def _location(self) -> Tuple[float, float]:
+        p = self.profile
+        (lat_min, lat_max), (lon_min, lon_max) = p.loc_range
+        if len(self.hotspots) and self.rng.random() < p.hotspot_share:
+            lat, lon, sigma = self.hotspots[self.rng.choice(len(self.hotspots), p=self._hotspot_p)]
+            lat, lon = self.rng.normal((lat, lon), sigma)
+        else:
+            lat, lon = self.rng.uniform(lat_min, lat_max), self.rng.uniform(lon_min, lon_max)
+        return (float(min(max(lat, lat_min), lat_max)), float(min(max(lon, lon_min), lon_max)))
+
+    def _keywords(self, n, exclude=()) -> List[str]:
+        # At most every keyword not excluded, drawn without replacement by popularity
+        vocabulary = self.profile.vocabulary
+        candidates = np.array([i for i, keyword in enumerate(vocabulary) if keyword not in exclude], dtype=np.intp)
+        n = min(n, len(candidates))
+        if n <= 0:
+            return []
+        p = self._keyword_p[candidates]
+        chosen = self.rng.choice(candidates, size=n, replace=False, p=p / p.sum())
+        return [vocabulary[i] for i in chosen.tolist()]
+
+    def _arrivals(self, n) -> np.ndarray:
+        p = self.profile
+        if p.arrival == 'poisson':
+            return np.cumsum(self.rng.exponential(1.0 / p.rate, n))
+        if p.arrival != 'bursty':
+            raise ValueError(f"Unknown arrival process '{p.arrival}', expected 'poisson' or 'bursty'")
+        # On/off modulated Poisson process: exponential burst and idle periods
+        times = np.empty(n)
+        now, bursting = 0.0, False
+        period_end = self.rng.exponential(p.idle_length)
+        for i in range(n):
+            while True:
+                gap = self.rng.exponential(1.0 / (p.burst_rate if bursting else p.rate))
+                if now + gap <= period_end:
+                    now += gap
+                    break
+                now = period_end
+                bursting = not bursting
+                period_end = now + self.rng.exponential(p.burst_length if bursting else p.idle_length)
+            times[i] = now
+        return times
+
+    def generate(self, n) -> List[Dict]:
+        """
+        Generates n queries.
+
+        Args:
+            n (int): Number of queries to generate.
+
+        Returns:
+            list: Query dicts with query_id, location, positive_keywords, negative_keywords,
+            k, lambda_factor and arrival.
+        """
+        p = self.profile
+        arrivals = self._arrivals(n)
+        queries = []
+        for query_id in range(n):
+            if queries and self.rng.random() < p.repeat_ratio:
+                source = queries[self.rng.integers(len(queries))]
+                query = {key: source[key] for key in
+                         ('location', 'positive_keywords', 'negative_keywords', 'k', 'lambda_factor')}
+            else:
+                positive = self._keywords(self.rng.integers(p.pos_range[0], p.pos_range[1] + 1))
+                negative = []
+                if self.rng.random() < p.negative_rate:
+                    negative = self._keywords(self.rng.integers(p.neg_range[0], p.neg_range[1] + 1), positive)
+                query = {
+                    'location': self._location(),
+                    'positive_keywords': positive,
+                    'negative_keywords': negative,
+                    'k': int(self.rng.choice(p.k_values, p=self._k_p)),
+                    'lambda_factor': float(self.rng.beta(*p.lambda_beta)),
+                }
+            query['query_id'] = query_id
+            query['arrival'] = float(arrivals[query_id])
+            queries.append(query)
+        return queries
+
+
+def parse_query_line(line, n_neg=0) -> Dict:
+    """
+    Parses one line of the text format written by Benchmark.generate_experiment:
+    ``(lat, lon), kw1,kw2,..., k, lambda_factor``.
+
+    The format joins positive and negative keywords into one list, so the last n_neg
+    keywords are taken as negative keywords.
+    """
+    location_part, _, rest = line.strip().partition(')')
+    location = tuple(float(v) for v in location_part.strip().lstrip('(').split(','))
+    fields = [f.strip() for f in rest.lstrip(',').split(',')]
+    k, lambda_factor = int(fields[-2]), float(fields[-1])
+    keywords = [f for f in fields[:-2] if f]
+    split = len(keywords) - n_neg
+    return {
+        'location': location,
+        'positive_keywords': keywords[:split],
+        'negative_keywords': keywords[split:],
+        'k': k,
+        'lambda_factor': lambda_factor,
+    }
+
+
+def iter_query_log(path, n_neg=0) -> Iterator[Dict]:
+    """
+    Streams queries from a captured query log, either JSONL (one query dict per line, as
+    written by write_query_log) or the text format of benchmark/data/generated_queries.txt.
+    Queries without a query_id are numbered by line.
+    """
+    for query, _, _ in iter_query_log_from(path, n_neg):
+        yield query
+
+
+def iter_query_log_from(path, n_neg=0, offset=0, line_no=0) -> Iterator[Tuple[Dict, int, int]]:
+    """
+    Streams queries like iter_query_log, starting at byte offset (the start of line
+    line_no), and yields (query, offset, line_no) where offset and line_no point just
+    past the query's line, so a reader can stop and later resume from there.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in iter(f.readline, b''):
+            offset += len(raw)
+            line_no += 1
+            line = raw.decode('utf-8')
+            if not line.strip():
+                continue
+            if line.lstrip().startswith('{'):
+                query = json.loads(line)
+                query['location'] = tuple(query['location'])
+            else:
+                query = parse_query_line(line, n_neg)
+            query.setdefault('query_id', line_no - 1)
+            yield query, offset, line_no
+
+
+def load_query_log(path, n_neg=0) -> List[Dict]:
+    """Loads a whole captured query log (see iter_query_log)."""
+    return list(iter_query_log(path, n_neg))
+
+
+def write_query_log(queries, path) -> None:
+    """Writes queries as JSONL, a log that iter_query_log and replay read back exactly."""
+    with open(path, 'w') as f:
+        for query in queries:
+            f.write(json.dumps(query) + "\n")
+
+
+def replay(query_processor, queries, speedup=1.0, honor_arrivals=True) -> Dict:
+    """
+    Replays queries against a POWERQueryProcessor in open loop, issuing each query at its
+    'arrival' time (divided by speedup) so latency includes queueing behind slow queries.
+
+    Args:
+        query_processor (object): Processor with a process_query method.
+        queries (list): Queries, e.g. from WorkloadGenerator.generate or load_query_log.
+        speedup (float, optional): Replay speed relative to the recorded arrivals.
+        honor_arrivals (bool, optional): If False, issue queries back to back (closed loop).
+
+    Returns:
+        dict: Throughput and latency percentiles (service and end-to-end) in milliseconds.
+    """
+    service, response = [], []
+    start = time.perf_counter()
+    for query in queries:
+        due = start + query.get('arrival', 0.0) / speedup if honor_arrivals else time.perf_counter()
+        now = time.perf_counter()
+        if due > now:
+            time.sleep(due - now)
+        issued = time.perf_counter()
+        query_processor.process_query(query['location'], query['positive_keywords'],
+                                      query['negative_keywords'], query['k'], query['lambda_factor'])
+        done = time.perf_counter()
+        service.append((done - issued) * 1e3)
+        response.append((done - max(due, start)) * 1e3)
+    elapsed = time.perf_counter() - start
+
+    def percentiles(values):
+        values = np.asarray(values)
+        return {f'p{p}_ms': float(np.percentile(values, p)) for p in (50, 95, 99)} | {'max_ms': float(values.max())}
+
+    result = {
+        'queries': len(queries),
+        'elapsed_s': elapsed,
+        'throughput_qps': len(queries) / elapsed if elapsed > 0 else 0.0,
+        'service': percentiles(service) if service else {},
+        'response': percentiles(response) if response else {},
+    }
+    print("--------------------------------")
+    print("Workload replay")
+    print(f"Queries: {result['queries']}, elapsed {elapsed:.3f}s, {result['throughput_qps']:.1f} q/s")
+    if service:
+        print(f"Service  p50 {result['service']['p50_ms']:.3f}ms  p99 {result['service']['p99_ms']:.3f}ms")
+        print(f"Response p50 {result['response']['p50_ms']:.3f}ms  p99 {result['response']['p99_ms']:.3f}ms")
+    print("--------------------------------")
+    return result
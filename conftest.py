@@ -0,0 +1 @@
+# Marks the repository root so pytest puts it on sys.path and tests import the packages directly
@@ -0,0 +1,269 @@
+import argparse
+import json
+import mmap
+import sys
+from collections import Counter
+from typing import Dict
+
+# Components in the order they are walked. Python objects reachable from several
+# components (shared keyword dicts, interned strings) are charged to the first one.
+COMPONENTS = ('objects_table', 'object_records', 'object_keywords', 'quadtree_nodes', 'node_summaries',
+              'leaf_ids', 'leaf_coords', 'leaf_keywords', 'leaf_postings', 'keyword_strings', 'texts', 'batch_buffer')
+
+
+class _SizeWalker:
+    """Deep sizeof that charges every Python object once, to the first component reaching it."""
+
+    def __init__(self):
+        self.seen = set()
+        self.components = Counter()
+        # Keyword string value -> first object id, to find duplicated copies of equal strings
+        self.strings: Dict[str, int] = {}
+        self.string_copies = 0
+
+    @staticmethod
+    def _sizeof(obj) -> int:
+        # Array views (the leaves of packed backends) own only their slice of the data
+        if getattr(obj, 'base', None) is not None and hasattr(obj, 'nbytes'):
+            return obj.nbytes
+        return sys.getsizeof(obj)
+
+    def _new(self, obj) -> bool:
+        key = id(obj)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def add(self, component: str, obj) -> int:
+        """Charge obj and everything it references (not yet charged) to component."""
+        size = 0
+        stack = [obj]
+        while stack:
+            item = stack.pop()
+            if not self._new(item):
+                continue
+            size += self._sizeof(item)
+            if isinstance(item, dict):
+                stack.extend(item.keys())
+                stack.extend(item.values())
+            elif isinstance(item, (list, tuple, set, frozenset)) or getattr(item, 'dtype', None) == object:
+                stack.extend(item)
+        self.components[component] += size
+        return size
+
+    def add_shallow(self, component: str, obj) -> int:
+        """Charge only obj itself to component."""
+        size = self._sizeof(obj) if self._new(obj) else 0
+        self.components[component] += size
+        return size
+
+    def add_keywords(self, component: str, keywords: dict) -> int:
+        """Charge a keyword -> weight dict to component and its keys to keyword_strings."""
+        if not self._new(keywords):
+            return 0
+        size = sys.getsizeof(keywords)
+        for keyword, weight in keywords.items():
+            if self._new(weight):
+                size += sys.getsizeof(weight)
+            if self._new(keyword):
+                string_size = sys.getsizeof(keyword)
+                self.components['keyword_strings'] += string_size
+                if keyword in self.strings:
+                    self.string_copies += string_size
+                else:
+                    self.strings[keyword] = id(keyword)
+        self.components[component] += size
+        return size
+
+
+def _text_bytes(texts):
+    """Resident and memory-mapped bytes of a TextStore."""
+    base = texts._base
+    mapped = len(base) if isinstance(base, mmap.mmap) else 0
+    resident = (sys.getsizeof(texts._base) if not mapped else 0) + sys.getsizeof(texts._tail) + \
+        texts._offsets.buffer_info()[1] * texts._offsets.itemsize
+    return resident, mapped
+
+
+def memory_report(teq_index) -> Dict:
+    """
+    Walk an index and account for the memory held by each of its components.
+
+    Args:
+        teq_index: TEQIndex to inspect (built in memory or loaded from disk)
+
+    Returns:
+        Dict with
+            objects: number of indexed objects
+            total_bytes / bytes_per_object: resident size of all components
+            components: bytes per component (see COMPONENTS)
+            texts_mapped_bytes: text data served from a memory map, not counted as resident
+            duplicated: bytes spent on data stored more than once (leaf copies of locations,
+                ids and keyword dicts, repeated copies of equal keyword strings)
+            tree: node and leaf counts, depth histogram and leaf fill factors
+    """
+    walker = _SizeWalker()
+    objects = teq_index.objects
+
+    # Object table: dict shell and id keys, then per-object records and keyword dicts
+    walker.add_shallow('objects_table', objects)
+    for obj_id, obj in objects.items():
+        walker.add('objects_table', obj_id)
+        walker.add_shallow('object_records', obj)
+        for field, value in obj.items():
+            if field == 'keywords' and isinstance(value, dict):
+                walker.add_keywords('object_keywords', value)
+            else:
+                walker.add('object_records', value)
+
+    duplicated = Counter()
+    depth_histogram = Counter()
+    fill_histogram = Counter()
+    node_count = leaf_count = empty_leaves = 0
+    fill_total = 0.0
+    coords_allocated = coords_used = 0
+
+    stack = [(teq_index.spatial_index, 0)]
+    while stack:
+        node, depth = stack.pop()
+        node_count += 1
+        depth_histogram[depth] += 1
+        walker.add_shallow('quadtree_nodes', node)
+        walker.add('quadtree_nodes', node.bounds)
+        walker.add('node_summaries', node.max_weights)
+        if node.common_keywords is not None:
+            walker.add('node_summaries', node.common_keywords)
+        walker.add('node_summaries', node.bloom)
+
+        if node.children is not None:
+            walker.add_shallow('quadtree_nodes', node.children)
+            if getattr(node, 'child_boxes', None) is not None:
+                walker.add_shallow('quadtree_nodes', node.child_boxes)  # Packed R-tree MBRs
+            stack.extend((child, depth + 1) for child in node.children)
+            continue
+
+        leaf_count += 1
+        n = len(node.ids)
+        if n == 0:
+            empty_leaves += 1
+        fill = n / node.capacity if node.capacity else 0.0
+        fill_total += fill
+        fill_histogram[min(int(fill * 10), 10)] += 1
+
+        # Ids and locations repeat what the object table holds
+        before = walker.components['leaf_ids']
+        walker.add('leaf_ids', node.ids)
+        duplicated['leaf_ids'] += walker.components['leaf_ids'] - before
+        packed = node.packed
+        coords = node.coords if packed is None else packed.qcoords
+        if walker._new(coords):
+            walker.components['leaf_coords'] += sys.getsizeof(coords) if coords.base is None else coords.nbytes
+            coords_allocated += coords.nbytes
+            coords_used += n * coords.itemsize * 2
+        duplicated['leaf_coords'] += n * coords.itemsize * 2
+
+        # Keyword dicts are shared with the object table after a build, but are
+        # separate copies after a load (objects and tree are pickled separately)
+        walker.add_shallow('leaf_keywords', node.keywords)
+        for keywords in node.keywords:
+            duplicated['leaf_keyword_copies'] += walker.add_keywords('leaf_keywords', keywords)
+        if node.postings is not None:
+            walker.add('leaf_postings', node.postings)
+        if packed is not None:
+            # Compressed posting lists stand in for the leaf's keyword dicts
+            walker.add_shallow('leaf_postings', packed)
+            for column in (packed.slots, packed.blob, packed.byte_offsets, packed.posting_offsets,
+                           packed.weights, packed.origin, packed.step):
+                walker.add('leaf_postings', column)
+
+    # Packed backends keep sorted columns beside the leaves (their coordinates are
+    # shared with the leaf views counted above)
+    root = teq_index.spatial_index
+    for column, component in (('codes', 'quadtree_nodes'), ('sorted_ids', 'leaf_ids'),
+                              ('sorted_keywords', 'leaf_keywords')):
+        if getattr(root, column, None) is not None:
+            walker.add_shallow(component, getattr(root, column))
+
+    resident, mapped = _text_bytes(teq_index.texts)
+    walker.components['texts'] += resident
+    walker.add('batch_buffer', teq_index._batch_buffer)
+    duplicated['keyword_string_copies'] = walker.string_copies
+
+    components = {name: walker.components.get(name, 0) for name in COMPONENTS}
+    total = sum(components.values())
+    return {
+        'objects': len(objects),
+        'total_bytes': total,
+        'bytes_per_object': total / len(objects) if objects else 0.0,
+        'components': components,
+        'texts_mapped_bytes': mapped,
+        'duplicated': dict(duplicated, total=sum(duplicated.values())),
+        'tree': {
+            'nodes': node_count,
+            'leaves': leaf_count,
+            'empty_leaves': empty_leaves,
+            'max_depth': max(depth_histogram),
+            'depth_histogram': {depth: depth_histogram[depth] for depth in sorted(depth_histogram)},
+            'mean_leaf_fill': fill_total / leaf_count,
+            # Leaves per 10% fill bucket; bucket 10 holds leaves at or over capacity
+            'leaf_fill_histogram': {bucket * 10: fill_histogram[bucket] for bucket in sorted(fill_histogram)},
+            'coords_slack_bytes': coords_allocated - coords_used,
+        },
+    }
+
+
+def _mb(n: float) -> str:
+    return f"{n / 2 ** 20:10.2f} MB"
+
+
+def format_memory_report(report: Dict) -> str:
+    """Render a memory_report() result as a human-readable table."""
+    total = report['total_bytes'] or 1
+    lines = ["--------------------------------",
+             f"Objects: {report['objects']:,}  resident: {_mb(report['total_bytes']).strip()}  "
+             f"({report['bytes_per_object']:.0f} bytes/object)"]
+    for name, size in report['components'].items():
+        if size:
+            lines.append(f"  {name:<18}{_mb(size)}  {size / total:6.1%}")
+    if report['texts_mapped_bytes']:
+        lines.append(f"  {'texts (mmap)':<18}{_mb(report['texts_mapped_bytes'])}  not resident")
+    lines.append("Duplicated data:")
+    for name, size in report['duplicated'].items():
+        lines.append(f"  {name:<22}{_mb(size)}")
+    tree = report['tree']
+    lines.append(f"Quadtree: {tree['nodes']:,} nodes, {tree['leaves']:,} leaves "
+                 f"({tree['empty_leaves']:,} empty), max depth {tree['max_depth']}, "
+                 f"mean leaf fill {tree['mean_leaf_fill']:.1%}, coords slack {_mb(tree['coords_slack_bytes']).strip()}")
+    lines.append("  depth  " + "  ".join(f"{d}:{c}" for d, c in tree['depth_histogram'].items()))
+    lines.append("  fill%  " + "  ".join(f"{b}:{c}" for b, c in tree['leaf_fill_histogram'].items()))
+    lines.append("--------------------------------")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    """
+    Print the memory report of a saved index, e.g.
+
+        python -m index.memory saved_indexes/final --json memory.json
+    """
+    from index.teq_index import TEQIndex
+
+    parser = argparse.ArgumentParser(description="Memory accounting of a saved TEQ index")
+    parser.add_argument('directory', help="Directory of a saved index")
+    parser.add_argument('--no-mmap', action='store_true', help="Read the text store into memory")
+    parser.add_argument('--json', help="Also write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    teq_index = TEQIndex.load_index(args.directory, use_mmap=not args.no_mmap)
+    report = memory_report(teq_index)
+    print(format_memory_report(report))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from index.teq_index import TEQIndex
+
+MANIFEST_FILE = 'shards.json'
+
+Bounds = Tuple[float, float, float, float]
+
+
+def grid_regions(bounds: Bounds, rows: int, cols: int) -> List[Bounds]:
+    """Split (min_lat, min_lon, max_lat, max_lon) into rows x cols equal regions"""
+    lat_min, lon_min, lat_max, lon_max = bounds
+    lat_step = (lat_max - lat_min) / rows
+    lon_step = (lon_max - lon_min) / cols
+    return [(lat_min + r * lat_step, lon_min + c * lon_step,
+             lat_max if r == rows - 1 else lat_min + (r + 1) * lat_step,
+             lon_max if c == cols - 1 else lon_min + (c + 1) * lon_step)
+            for r in range(rows) for c in range(cols)]
+
+
+def shard_name(number: int) -> str:
+    return f"shard_{number:03d}"
+
+
+def _region_of(location, regions: Sequence[Bounds]) -> Optional[int]:
+    # First region holding the point, so points on a shared border go to one shard only
+    x, y = location[0], location[1]
+    for number, (x_min, y_min, x_max, y_max) in enumerate(regions):
+        if x_min <= x <= x_max and y_min <= y <= y_max:
+            return number
+    return None
+
+
+def _extent(locations) -> Optional[List[float]]:
+    # Bounding box of the objects actually stored, used to route queries precisely
+    if not locations:
+        return None
+    xs = [location[0] for location in locations]
+    ys = [location[1] for location in locations]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def load_manifest(directory: str) -> Dict:
+    with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+        return json.load(f)
+
+
+def _save_manifest(directory: str, manifest: Dict) -> None:
+    manifest['updated_at'] = datetime.now().isoformat()
+    tmp_path = os.path.join(directory, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+
+
+def _build_shard(directory: str, entry: Dict, records: List[Tuple], index_kwargs: Dict) -> None:
+    teq_index = TEQIndex(tuple(entry['region']), expected_objects=len(records) or None, **index_kwargs)
+    teq_index.add_batch(records)
+    teq_index.save_index(os.path.join(directory, entry['name']))
+    entry['objects'] = len(teq_index.objects)
+    entry['extent'] = _extent([obj['location'] for obj in teq_index.objects.values()])
+    entry['built_at'] = datetime.now().isoformat()
+
+
+def build_shards(records: Iterable[Tuple], regions: Sequence[Bounds], directory: str, **index_kwargs) -> Dict:
+    """
+    Partition records by region and build and save one TEQIndex per region.
+
+    Every shard is an ordinary saved index in directory/shard_NNN, described by the
+    shards.json manifest (region, extent of its objects and object count) that
+    queries.router.ShardRouter reads. All shards are held in memory while building;
+    to bound memory, build the manifest with empty records and fill each shard with
+    rebuild_shard from a filtered pass over the data.
+
+    Args:
+        records: (obj_id, location, keywords, full_text[, weights]) tuples
+        regions: (min_lat, min_lon, max_lat, max_lon) of each shard, e.g. from grid_regions
+        directory: Root directory of the sharded index
+        index_kwargs: Passed to each shard's TEQIndex (capacity, compress_text, bloom_bits, ...)
+
+    Returns:
+        The manifest
+    """
+    os.makedirs(directory, exist_ok=True)
+    partitions = [[] for _ in regions]
+    dropped = 0
+    for record in records:
+        number = _region_of(record[1], regions)
+        if number is None:
+            dropped += 1
+            continue
+        partitions[number].append(record)
+
+    manifest = {'created_at': datetime.now().isoformat(), 'index_kwargs': index_kwargs, 'shards': []}
+    for number, (region, shard_records) in enumerate(zip(regions, partitions)):
+        entry = {'name': shard_name(number), 'region': list(region)}
+        _build_shard(directory, entry, shard_records, index_kwargs)
+        manifest['shards'].append(entry)
+        print(f"Built {entry['name']}: {entry['objects']:,} objects")
+    if dropped:
+        print(f"Skipped {dropped:,} records outside every region")
+    _save_manifest(directory, manifest)
+    return manifest
+
+
+def rebuild_shard(directory: str, name: str, records: Iterable[Tuple]) -> Dict:
+    """
+    Rebuild one shard from records, leaving the other shards untouched. Records
+    outside the shard's region are ignored, so a full pass over the data can be
+    passed in. Running routers pick up the new shard after ShardRouter.reload_shard(name).
+
+    Returns:
+        The shard's updated manifest entry
+    """
+    manifest = load_manifest(directory)
+    entry = next((shard for shard in manifest['shards'] if shard['name'] == name), None)
+    if entry is None:
+        raise KeyError(f"No shard named '{name}' in {directory}")
+    regions = [tuple(shard['region']) for shard in manifest['shards']]
+    number = manifest['shards'].index(entry)
+    shard_records = [record for record in records if _region_of(record[1], regions) == number]
+    _build_shard(directory, entry, shard_records, manifest.get('index_kwargs', {}))
+    _save_manifest(directory, manifest)
+    return entry
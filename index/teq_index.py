@@ -1,62 +1,236 @@
-from models.quadtree import QuadtreeNode
+from models.quadtree import QuadtreeNode, DEFAULT_CAPACITY
+from models.morton import MortonIndex
+from models.rtree import RTreeIndex
+from models.bloom import KeywordBloom
+from index.text_store import TextStore
+from index.memory import memory_report
 import sys
-from typing import Dict, Set, List, Tuple
+from typing import Dict, Set, List, Optional, Tuple
 from collections import defaultdict
 import pickle
 import os
 import json
+import time
+import numpy as np
 from datetime import datetime
 
 sys.setrecursionlimit(10**6)
 
+# Spatial backends, all serving queries through the QuadtreeNode node protocol
+SPATIAL_BACKENDS = {
+    'quadtree': QuadtreeNode,
+    'morton': MortonIndex,
+    'rtree': RTreeIndex,
+}
+AUTO_BACKEND = 'auto'  # Chosen by choose_backend from the first batch of objects
+
+
+def choose_backend(records: List[Tuple], bounds, capacity: int = DEFAULT_CAPACITY,
+                   candidates=('quadtree', 'rtree'), sample_size: int = 20000, n_queries: int = 100,
+                   repeats: int = 2, seed: int = 0) -> str:
+    """
+    Pick the spatial backend that serves this dataset fastest. Each candidate indexes
+    the same sample of the records (leaf capacity scaled to the sample, so the tree
+    keeps its shape) and is timed on top-k queries for the keywords of sampled objects
+    at their locations, plus range queries around them; the best of repeats runs counts.
+    Args:
+        records: (obj_id, location, keywords, full_text[, weights]) tuples as given to
+                 add_batch, all of the dataset or a representative part of it
+        bounds: Bounds of the index
+        capacity: Leaf capacity the index will be built with
+    Returns:
+        The fastest backend name; 'quadtree' when there are too few objects to tell
+    """
+    from queries.power import POWERQueryProcessor
+
+    if len(records) <= 2 * capacity:
+        return 'quadtree'
+    rng = np.random.default_rng(seed)
+    sample = records
+    if len(records) > sample_size:
+        sample = [records[i] for i in sorted(rng.choice(len(records), sample_size, replace=False).tolist())]
+    sample = [(obj_id, location, keywords, '', *weights) for obj_id, location, keywords, _, *weights in sample]
+    sample_capacity = max(16, round(capacity * len(sample) / len(records)))
+    queries = [sample[i] for i in rng.choice(len(sample), min(n_queries, len(sample)), replace=False).tolist()]
+    queries = [(location, list(keywords)[:2]) for _, location, keywords, *_ in queries if len(keywords)]
+    radius = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) / 100
+
+    timings = {}
+    for name in candidates:
+        teq_index = TEQIndex(bounds, capacity=sample_capacity, backend=name)
+        teq_index.add_batch(sample)
+        processor = POWERQueryProcessor(teq_index)
+        root = teq_index.spatial_index
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for location, keywords in queries:
+                processor.process_query(location, keywords, [], 10)
+                root.range_slices((location[0] - radius, location[1] - radius,
+                                   location[0] + radius, location[1] + radius))
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return min(timings, key=timings.get)
+
+
 class TEQIndex:
     """_summary_
     A class to represent a spatial index using a quadtree structure.
     Attributes
     ----------
     spatial_index : QuadtreeNode
-        The root node of the quadtree used for spatial indexing.
+        The root node of the spatial backend: a QuadtreeNode tree, a MortonIndex
+        (flat arrays sorted by Morton code) when built with backend='morton', or an
+        STR-packed RTreeIndex when built with backend='rtree'.
     objects : dict
-        A dictionary to store objects with their metadata.
+        A dictionary to store objects with their metadata. Keywords are stored as a
+        keyword -> weight mapping (weight 1.0 when no weights are given). Full texts are
+        not kept here; each object holds the slot of its text in ``texts``.
+    texts : TextStore
+        Append-only, offset-addressed store of full texts, memory-mapped after load.
+    load_seconds : float or None
+        Time load_index took to open the index; None for an index built in memory.
     Methods
     -------
-    __init__(bounds):
-        Initializes the TEQIndex with the given bounds.
-    add_object(obj_id, location, keywords, full_text):
+    __init__(bounds, capacity=None, expected_objects=None, compress_text=False, bloom_bits=0, bloom_hashes=3,
+             backend='quadtree', compact=False):
+        Initializes the TEQIndex with the given bounds. The leaf capacity is taken from
+        capacity, or derived from expected_objects when only the dataset size is known.
+        A non-zero bloom_bits keeps a keyword Bloom filter of that size on every quadtree
+        node; bloom_bits and bloom_hashes trade memory against false-positive rate.
+        backend names the spatial structure in SPATIAL_BACKENDS, or is 'auto' to let
+        choose_backend pick one from the first add_batch (add_object raises ValueError
+        until then). compact=True (quadtree backend only) packs the leaves after every
+        batch or add_object and before saving: coordinates as 32-bit fixed point relative
+        to the bounds, keywords as delta and varint encoded posting lists, decoded only
+        while a leaf is scanned.
+    compact():
+        Packs the leaves of an existing (e.g. loaded) index and keeps it compact from then on.
+    add_object(obj_id, location, keywords, full_text, weights=None):
         Adds an object to the spatial index and stores its metadata.
-    get_candidates(location, positive_keywords, negative_keywords, search_radius=10):
+    add_insert_hook(hook), remove_insert_hook(hook):
+        Registers hook(rows), called with the (obj_id, location, keywords) rows of every
+        add_object call and buffered batch once they are queryable.
+    get_text(obj_id):
+        Returns the full text of an object from the text store.
+    materialize(scored):
+        Turns (score, obj_id) pairs into (score, obj_id, location, full_text) results.
+    get_candidates(location, positive_keywords, negative_keywords, search_radius=10, use_bloom=False, stats=None):
         Retrieves candidate objects within a search radius that match positive keywords and do not match negative keywords.
+    bloom_masks(keywords):
+        Returns the Bloom masks of keywords for range traversals, or None when filters are disabled.
+    memory_report():
+        Returns the bytes held by each component of the index, duplicated-data overhead,
+        and the quadtree's node count, depth histogram and leaf fill factors.
     """
      
-    def __init__(self, bounds):
-        self.spatial_index = QuadtreeNode(bounds, capacity=1000)
+    def __init__(self, bounds, capacity: int = None, expected_objects: int = None,
+                 compress_text: bool = False, bloom_bits: int = 0, bloom_hashes: int = 3,
+                 backend: str = 'quadtree', compact: bool = False):
+        if backend not in SPATIAL_BACKENDS and backend != AUTO_BACKEND:
+            raise ValueError(f"Unknown spatial backend '{backend}', "
+                             f"expected one of {sorted(SPATIAL_BACKENDS) + [AUTO_BACKEND]}")
+        if compact and backend != 'quadtree':
+            # Packed backends keep their sorted columns beside the leaves, so packing saves nothing
+            raise ValueError(f"Compact leaves need the quadtree backend, not '{backend}'")
+        if capacity is None:
+            capacity = (QuadtreeNode.suggest_capacity(expected_objects)
+                        if expected_objects else DEFAULT_CAPACITY)
+        bloom_params = KeywordBloom(bloom_bits, bloom_hashes) if bloom_bits else None
+        # An 'auto' index starts as a quadtree and is replaced while still empty
+        self.spatial_index = SPATIAL_BACKENDS.get(backend, QuadtreeNode)(bounds, capacity=capacity,
+                                                                          bloom_params=bloom_params)
         self.objects: Dict = {}
+        self.texts = TextStore(compress=compress_text)
         self._batch_buffer = defaultdict(list)
         self._buffer_size = 10000  # Adjust based on memory availability
+        self.load_seconds = None
+        self.insert_hooks = []
         self.metadata = {
             'created_at': datetime.now().isoformat(),
             'bounds': bounds,
+            'capacity': capacity,
+            'bloom_bits': bloom_bits,
+            'bloom_hashes': bloom_hashes,
+            'backend': backend,
+            'compact': compact,
             'total_objects': 0
         }
 
+    @staticmethod
+    def _keyword_weights(keywords: List[str], weights: List[float] = None) -> Dict[str, float]:
+        """Pair keywords with their weights, keeping the largest weight of a repeated keyword"""
+        if weights is None or len(weights) == 0:
+            return dict.fromkeys(keywords, 1.0)
+        keywords = list(keywords)
+        keyword_weights = {}
+        for keyword, weight in zip(keywords, weights):
+            weight = float(weight)
+            if weight > keyword_weights.get(keyword, float('-inf')):
+                keyword_weights[keyword] = weight
+        # Keywords without a matching weight entry count as 1.0
+        for keyword in keywords[len(weights):]:
+            keyword_weights.setdefault(keyword, 1.0)
+        return keyword_weights
+
+    def _resolve_backend(self, records: List[Tuple]) -> None:
+        """Settle an 'auto' backend from the first objects added"""
+        backend = choose_backend(records, self.metadata['bounds'], self.metadata['capacity'])
+        if backend != 'quadtree':
+            root = self.spatial_index
+            self.spatial_index = SPATIAL_BACKENDS[backend](root.bounds, capacity=root.capacity,
+                                                           bloom_params=root.bloom_params)
+        self.metadata['backend'] = backend
+
     def add_object(self, obj_id: int, location: Tuple[float, float], 
-                  keywords: List[str], full_text: str) -> None:
+                  keywords: List[str], full_text: str, weights: List[float] = None) -> None:
         """Add single object to index"""
+        if self.metadata.get('backend') == AUTO_BACKEND:
+            # One object is too few to time the backends on; choose_backend would always say quadtree
+            raise ValueError("backend='auto' is chosen from the first add_batch; add the first objects "
+                             "with add_batch or pick a backend")
+        keyword_weights = self._keyword_weights(keywords, weights)
         self.objects[obj_id] = {
             'location': location,
-            'keywords': set(keywords),
-            'full_text': full_text
+            'keywords': keyword_weights,
+            'text': self.texts.append(full_text)
         }
-        self.spatial_index.insert(obj_id, location, keywords, full_text)
+        if self.metadata.get('compact'):
+            # Repack the leaf the insert unpacked (or the leaves it split into), so the new
+            # object is scored from packed coordinates now rather than after the next batch
+            leaf = self.spatial_index._find_leaf(location[0], location[1])
+            self.spatial_index.insert(obj_id, location, keyword_weights)
+            leaf.pack_leaves(self.metadata['bounds'])
+        else:
+            self.spatial_index.insert(obj_id, location, keyword_weights)
+        for hook in self.insert_hooks:
+            hook([(obj_id, location, keyword_weights)])
+
+    def add_insert_hook(self, hook) -> None:
+        """Register hook(rows), called with the (obj_id, location, keywords) rows of each insert"""
+        self.insert_hooks.append(hook)
+
+    def remove_insert_hook(self, hook) -> None:
+        self.insert_hooks.remove(hook)
     
     def add_batch(self, batch: List[Tuple]) -> None:
-        """Add multiple objects efficiently"""
+        """
+        Add multiple objects efficiently
+        Args:
+            batch: (obj_id, location, keywords, full_text) or
+                   (obj_id, location, keywords, full_text, weights) tuples
+        """
+        if self.metadata.get('backend') == AUTO_BACKEND and batch:
+            self._resolve_backend(batch)
+
         # Sort batch by location for more efficient insertion
         sorted_batch = sorted(batch, key=lambda x: (x[1][0], x[1][1]))
         
         # Process in smaller chunks for better memory management
-        for obj_id, location, keywords, full_text in sorted_batch:
-            self._batch_buffer[location].append((obj_id, keywords, full_text))
+        for obj_id, location, keywords, full_text, *weights in sorted_batch:
+            # Texts go straight to the store; only their slot is buffered
+            keyword_weights = self._keyword_weights(keywords, weights[0] if weights else None)
+            self._batch_buffer[location].append((obj_id, keyword_weights, self.texts.append(full_text)))
             
             if len(self._batch_buffer) >= self._buffer_size:
                 self._flush_buffer()
@@ -67,22 +241,53 @@ class TEQIndex:
     
     def _flush_buffer(self) -> None:
         """Insert buffered objects into the index"""
+        inserted = [] if self.insert_hooks else None
         for location, objects in self._batch_buffer.items():
-            for obj_id, keywords, full_text in objects:
+            for obj_id, keyword_weights, text_slot in objects:
                 self.objects[obj_id] = {
                     'location': location,
-                    'keywords': set(keywords),
-                    'full_text': full_text
+                    'keywords': keyword_weights,
+                    'text': text_slot
                 }
-                self.spatial_index.insert(obj_id, location, keywords, full_text)
+                self.spatial_index.insert(obj_id, location, keyword_weights)
+                if inserted is not None:
+                    inserted.append((obj_id, location, keyword_weights))
         
         self._batch_buffer.clear()
+        self.spatial_index.flush()
+        if self.metadata.get('compact'):
+            self.spatial_index.pack_leaves(self.metadata['bounds'])
+        if inserted:
+            for hook in self.insert_hooks:
+                hook(inserted)
+
+    def compact(self) -> int:
+        """
+        Pack every leaf of the index (see models.compact.PackedLeaf) and keep packing
+        after later batches and before saving
+        Returns:
+            Number of leaves packed
+        """
+        if type(self.spatial_index) is not QuadtreeNode:
+            raise ValueError(f"Compact leaves need the quadtree backend, not '{self.metadata.get('backend')}'")
+        if self._batch_buffer:
+            self._flush_buffer()
+        self.metadata['compact'] = True
+        return self.spatial_index.pack_leaves(self.metadata['bounds'])
     
     def get_candidates(self, location: Tuple[float, float], 
                       positive_keywords: List[str], 
                       negative_keywords: List[str], 
-                      search_radius: float = 10) -> Set[int]:
-        """Get candidate objects based on location and keywords"""
+                      search_radius: float = 10,
+                      use_bloom: bool = False,
+                      stats=None) -> Set[int]:
+        """
+        Get candidate objects based on location and keywords
+        Args:
+            use_bloom: Skip subtrees whose keyword Bloom filter holds none of the
+                       positive keywords (needs an index built with bloom_bits)
+            stats: Optional queries.stats.QueryStats receiving traversal and candidate counts
+        """
         # Ensure buffer is flushed before querying
         if self._batch_buffer:
             self._flush_buffer()
@@ -91,25 +296,58 @@ class TEQIndex:
         bounds = (x - search_radius, y - search_radius, 
                  x + search_radius, y + search_radius)
         
-        found_objects: List = []
-        self.spatial_index.query_range(bounds, found_objects)
-        
         pos_keywords = set(positive_keywords)
         neg_keywords = set(negative_keywords)
         
-        candidates = {
-            obj_id for obj_id, _, keywords, _ in found_objects 
-            if pos_keywords.intersection(keywords)
-        }
-        
-        if neg_keywords:
-            candidates = {
-                obj_id for obj_id in candidates 
-                if not neg_keywords.intersection(self.objects[obj_id]['keywords'])
-            }
+        # Subtrees whose objects all carry a negative keyword are skipped outright;
+        # the remaining objects are filtered with the keywords stored in the leaves
+        negative_sets = [neg_keywords] if neg_keywords else None
+        positive_masks = self.bloom_masks(pos_keywords) if use_bloom else None
+        candidates = set()
+        for leaf, idx in self.spatial_index.range_slices(bounds, negative_sets=negative_sets,
+                                                         positive_masks=positive_masks, stats=stats):
+            positions = range(len(leaf.ids)) if idx is None else idx.tolist()
+            ids, leaf_keywords = leaf.ids, leaf.scan_keywords()
+            for position in positions:
+                keywords = leaf_keywords[position]
+                if pos_keywords.isdisjoint(keywords):
+                    continue
+                if neg_keywords and not neg_keywords.isdisjoint(keywords):
+                    continue
+                candidates.add(ids[position])
         
+        if stats is not None:
+            stats.candidates += len(candidates)
         return candidates
 
+    def bloom_masks(self, keywords) -> Optional[List[int]]:
+        """Bloom masks of keywords for range traversals, or None if the index has no filters"""
+        params = self.spatial_index.bloom_params
+        if params is None:
+            return None
+        return [params.mask(keyword) for keyword in keywords]
+
+    def get_text(self, obj_id) -> str:
+        """Fetch the full text of an object from the text store"""
+        return self.texts.get(self.objects[obj_id]['text'])
+
+    def materialize(self, scored: List[Tuple]) -> List[Tuple]:
+        """
+        Build final results from ranked (score, obj_id) pairs. Locations and full texts
+        are only looked up here, after top-k selection.
+        Returns:
+            List of (score, obj_id, location, full_text) tuples
+        """
+        results = []
+        for score, obj_id in scored:
+            obj = self.objects[obj_id]
+            results.append((score, obj_id, obj['location'], self.texts.get(obj['text'])))
+        return results
+
+    def memory_report(self) -> Dict:
+        """Account for the memory held by the index (see index.memory.memory_report)"""
+        return memory_report(self)
+
     def save_index(self, directory: str) -> None:
         """
         Save the index to disk
@@ -121,6 +359,9 @@ class TEQIndex:
         # Ensure all buffered items are inserted
         if self._batch_buffer:
             self._flush_buffer()
+        self.spatial_index.flush()
+        if self.metadata.get('compact'):
+            self.spatial_index.pack_leaves(self.metadata['bounds'])
         
         # Update metadata
         self.metadata.update({
@@ -139,34 +380,52 @@ class TEQIndex:
         # Save spatial index
         with open(os.path.join(directory, 'spatial_index.pkl'), 'wb') as f:
             pickle.dump(self.spatial_index, f, protocol=4)
+
+        # Save full texts
+        self.texts.save(directory)
             
         print(f"Index saved to {directory}")
         print(f"Total objects: {self.metadata['total_objects']:,}")
 
     @classmethod
-    def load_index(cls, directory: str) -> 'TEQIndex':
+    def load_index(cls, directory: str, use_mmap: bool = True) -> 'TEQIndex':
         """
         Load index from disk
         Args:
             directory: Directory containing the saved index files
+            use_mmap: Memory-map the full-text store instead of reading it into memory
         Returns:
             TEQIndex: Loaded index
         """
+        start = time.perf_counter()
         # Load metadata
         with open(os.path.join(directory, 'metadata.json'), 'r') as f:
             metadata = json.load(f)
         
         # Create new instance
-        index = cls(bounds=metadata['bounds'])
+        index = cls(bounds=metadata['bounds'], capacity=metadata.get('capacity'))
         index.metadata = metadata
         
         # Load objects
         with open(os.path.join(directory, 'objects.pkl'), 'rb') as f:
             index.objects = pickle.load(f)
+
+        # Open the text store; indexes saved before it existed keep texts inline
+        if TextStore.exists(directory):
+            index.texts = TextStore.open(directory, use_mmap=use_mmap)
+        else:
+            for obj in index.objects.values():
+                obj['text'] = index.texts.append(obj.pop('full_text', ''))
+
+        # Unweighted keyword sets from older indexes count as weight 1.0
+        for obj in index.objects.values():
+            if not isinstance(obj['keywords'], dict):
+                obj['keywords'] = dict.fromkeys(obj['keywords'], 1.0)
         
         # Load spatial index
         with open(os.path.join(directory, 'spatial_index.pkl'), 'rb') as f:
             index.spatial_index = pickle.load(f)
+        index.load_seconds = time.perf_counter() - start
         
         print(f"Index loaded from {directory}")
         print(f"Total objects: {metadata['total_objects']:,}")
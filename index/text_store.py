@@ -0,0 +1,159 @@
+import json
+import mmap
+import os
+import zlib
+from array import array
+from typing import Iterable, List
+
+import numpy as np
+
+
+class TextStore:
+    """
+    Append-only store for object full texts, kept out of the spatial index.
+
+    Texts are encoded as UTF-8 (optionally zlib-compressed) and appended to a single
+    byte buffer. Each text is addressed by its slot number, and slot ``i`` spans
+    ``data[offsets[i]:offsets[i + 1]]``. A saved store is opened with ``mmap`` so the
+    texts stay on disk until a query result actually needs one.
+
+    Attributes
+    ----------
+    compress : bool
+        Whether records are zlib-compressed.
+    Methods
+    -------
+    append(text):
+        Appends a text and returns its slot.
+    get(slot):
+        Returns the text stored at slot.
+    get_many(slots):
+        Returns the texts stored at the given slots.
+    save(directory):
+        Writes the store to ``texts.bin`` / ``text_offsets.npy`` in directory.
+    open(directory, use_mmap=True):
+        Opens a saved store, memory-mapping the text data.
+    """
+    DATA_FILE = 'texts.bin'
+    OFFSETS_FILE = 'text_offsets.npy'
+    META_FILE = 'texts.json'
+
+    def __init__(self, compress: bool = False, compression_level: int = 6):
+        self.compress = compress
+        self.compression_level = compression_level
+        self._base = b''          # Saved data (bytes or mmap), read-only
+        self._tail = bytearray()  # Records appended since the store was opened
+        self._offsets = array('Q', [0])
+        self._file = None
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Encoded size of all records in bytes."""
+        return self._offsets[-1]
+
+    def _encode(self, text) -> bytes:
+        if text is None:
+            text = ''
+        elif isinstance(text, (list, tuple)):
+            text = ' '.join(map(str, text))
+        elif not isinstance(text, str):
+            text = str(text)
+        data = text.encode('utf-8')
+        if self.compress:
+            data = zlib.compress(data, self.compression_level)
+        return data
+
+    def _decode(self, data) -> str:
+        if self.compress:
+            data = zlib.decompress(data)
+        return bytes(data).decode('utf-8')
+
+    def append(self, text) -> int:
+        """Append a text and return its slot"""
+        data = self._encode(text)
+        self._tail += data
+        self._offsets.append(self._offsets[-1] + len(data))
+        return len(self._offsets) - 2
+
+    def extend(self, texts: Iterable) -> List[int]:
+        """Append several texts and return their slots"""
+        return [self.append(text) for text in texts]
+
+    def get(self, slot: int) -> str:
+        """Return the text stored at slot"""
+        start, end = self._offsets[slot], self._offsets[slot + 1]
+        base_size = len(self._base)
+        if start >= base_size:
+            return self._decode(self._tail[start - base_size:end - base_size])
+        return self._decode(self._base[start:end])
+
+    def get_many(self, slots: Iterable[int]) -> List[str]:
+        """Return the texts stored at the given slots"""
+        return [self.get(slot) for slot in slots]
+
+    def save(self, directory: str) -> None:
+        """
+        Save the store to directory
+        Args:
+            directory: Directory to write the store files into
+        """
+        os.makedirs(directory, exist_ok=True)
+        data_path = os.path.join(directory, self.DATA_FILE)
+        # Write to a temporary file first: the current base may be a mapping of data_path
+        tmp_path = data_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._base)
+            f.write(self._tail)
+        os.replace(tmp_path, data_path)
+        np.save(os.path.join(directory, self.OFFSETS_FILE),
+                np.frombuffer(self._offsets, dtype=np.uint64))
+        with open(os.path.join(directory, self.META_FILE), 'w') as f:
+            json.dump({'compress': self.compress,
+                       'compression_level': self.compression_level,
+                       'count': len(self)}, f, indent=2)
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        return os.path.isfile(os.path.join(directory, cls.OFFSETS_FILE))
+
+    @classmethod
+    def open(cls, directory: str, use_mmap: bool = True) -> 'TextStore':
+        """
+        Open a saved store
+        Args:
+            directory: Directory containing the store files
+            use_mmap: Memory-map the text data instead of reading it into memory
+        Returns:
+            TextStore: Opened store; further appends are kept in memory until saved
+        """
+        with open(os.path.join(directory, cls.META_FILE), 'r') as f:
+            meta = json.load(f)
+        store = cls(compress=meta['compress'], compression_level=meta.get('compression_level', 6))
+        store._offsets = array('Q', np.load(os.path.join(directory, cls.OFFSETS_FILE)).tobytes())
+
+        data_path = os.path.join(directory, cls.DATA_FILE)
+        if use_mmap and os.path.getsize(data_path) > 0:
+            store._file = open(data_path, 'rb')
+            store._base = mmap.mmap(store._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(data_path, 'rb') as f:
+                store._base = f.read()
+        return store
+
+    def close(self) -> None:
+        """Release the memory mapping, reading the saved data into memory"""
+        if self._file is not None:
+            data = bytes(self._base)
+            self._base.close()
+            self._file.close()
+            self._base, self._file = data, None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_base'] = bytes(self._base) + bytes(self._tail)
+        state['_tail'] = bytearray()
+        state['_file'] = None
+        return state
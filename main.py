@@ -41,6 +41,7 @@ def main():
         total_query_times_combine[ind].append(total_query_times_batch[ind])
         total_query_times_combine[ind].append(total_query_times_group[ind])
         query_times_for_cluster = Benchmark.variable_cluster_test(batch_processor, queries, cluster_sizes)
+        batch_processor.close()
         print("************************************************")
 
     # Res.plot_line_results(total_query_times_batch, "Batch Queries",y_label="Total Execution Time (s)")
@@ -0,0 +1,86 @@
+from hashlib import blake2b
+from math import ceil, exp, log
+from typing import Dict, Iterable
+
+
+class KeywordBloom:
+    """
+    Parameters and hashing for the fixed-size keyword Bloom filters kept on quadtree nodes.
+
+    A node's filter is a plain Python int used as a bit set, so filters cost ``bits / 8``
+    bytes per node, OR together cheaply and pickle compactly. Keywords are hashed with
+    blake2b (stable across processes, unlike ``hash``) and mapped to ``hashes`` bit
+    positions by double hashing.
+
+    Attributes
+    ----------
+    bits : int
+        Size of every node filter in bits. Larger filters lower the false-positive rate
+        at the cost of memory.
+    hashes : int
+        Number of bit positions set per keyword.
+    Methods
+    -------
+    for_rate(expected_keywords, false_positive_rate):
+        Picks bits and hashes for a target false-positive rate at a given number of
+        distinct keywords per node.
+    mask(keyword):
+        Returns the bit mask of a single keyword.
+    filter_of(keywords):
+        Returns the filter bits of a set of keywords.
+    false_positive_rate(distinct_keywords):
+        Expected false-positive rate of a filter holding that many keywords.
+    """
+
+    def __init__(self, bits: int = 256, hashes: int = 3):
+        if bits <= 0 or hashes <= 0:
+            raise ValueError("Bloom filter bits and hashes must be positive")
+        self.bits = bits
+        self.hashes = hashes
+        self._masks: Dict[str, int] = {}
+
+    @classmethod
+    def for_rate(cls, expected_keywords: int, false_positive_rate: float = 0.01) -> 'KeywordBloom':
+        """Size a filter for expected_keywords distinct keywords at the target rate"""
+        expected_keywords = max(1, expected_keywords)
+        bits = ceil(-expected_keywords * log(false_positive_rate) / (log(2) ** 2))
+        hashes = max(1, round(bits / expected_keywords * log(2)))
+        return cls(bits=bits, hashes=hashes)
+
+    def mask(self, keyword: str) -> int:
+        """Bit mask of a single keyword (cached per keyword)"""
+        mask = self._masks.get(keyword)
+        if mask is None:
+            digest = blake2b(str(keyword).encode('utf-8'), digest_size=16).digest()
+            h1 = int.from_bytes(digest[:8], 'little')
+            h2 = int.from_bytes(digest[8:], 'little') | 1
+            mask = 0
+            for i in range(self.hashes):
+                mask |= 1 << ((h1 + i * h2) % self.bits)
+            self._masks[keyword] = mask
+        return mask
+
+    def filter_of(self, keywords: Iterable[str]) -> int:
+        """Filter bits of a set of keywords"""
+        bits = 0
+        for keyword in keywords:
+            bits |= self.mask(keyword)
+        return bits
+
+    def false_positive_rate(self, distinct_keywords: int) -> float:
+        """Expected false-positive rate of one filter holding distinct_keywords keywords"""
+        return (1 - exp(-self.hashes * distinct_keywords / self.bits)) ** self.hashes
+
+    @staticmethod
+    def might_contain_any(bloom: int, masks: Iterable[int]) -> bool:
+        """True if the filter may hold at least one of the keywords behind masks"""
+        return any(bloom & mask == mask for mask in masks)
+
+    def __getstate__(self):
+        # The mask cache is rebuilt on demand
+        return {'bits': self.bits, 'hashes': self.hashes}
+
+    def __setstate__(self, state):
+        self.bits = state['bits']
+        self.hashes = state['hashes']
+        self._masks = {}
@@ -0,0 +1,220 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+QUANT_MAX = np.float64(2**32 - 1)  # Fixed-point coordinates use the full uint32 range
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+    """LEB128 encoding of non-negative integers: 7 bits per byte, high bit set on all but the last byte"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not values.size:
+        return b''
+    lengths = np.ones(len(values), dtype=np.intp)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for i in range(int(lengths.max())):
+        active = np.flatnonzero(lengths > i)
+        chunk = (values[active] >> np.uint64(7 * i)) & np.uint64(0x7f)
+        more = (lengths[active] > i + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[active] + i] = (chunk | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def varint_decode(data) -> np.ndarray:
+    """Decode a run of LEB128 integers (see varint_encode) into a uint64 array"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not (buf & 0x80).any():
+        return buf.astype(np.uint64)  # Every value fits one byte, the common case for leaf deltas
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for i in range(int(lengths.max())):
+        active = np.flatnonzero(lengths > i)
+        values[active] |= (buf[starts[active] + i] & np.uint8(0x7f)).astype(np.uint64) << np.uint64(7 * i)
+    return values
+
+
+def quantize(coords: np.ndarray, origin: np.ndarray, step: np.ndarray) -> np.ndarray:
+    """(n, 2) float coordinates -> uint32 fixed point, origin + q * step"""
+    cells = np.rint((coords - origin) / step)
+    return np.clip(cells, 0, QUANT_MAX).astype(np.uint32)
+
+
+class PackedPostings:
+    """
+    Keyword -> positions view over a PackedLeaf that decodes a posting list only when
+    it is looked up, so a predicate touching two keywords decodes two lists.
+    """
+    __slots__ = ('leaf',)
+
+    def __init__(self, leaf: 'PackedLeaf'):
+        self.leaf = leaf
+
+    def get(self, keyword: str, default=None) -> Optional[np.ndarray]:
+        slot = self.leaf.slots.get(keyword)
+        return default if slot is None else self.leaf.positions(slot)
+
+    def __getitem__(self, keyword: str) -> np.ndarray:
+        return self.leaf.positions(self.leaf.slots[keyword])
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self.leaf.slots
+
+    def __len__(self) -> int:
+        return len(self.leaf.slots)
+
+    def items(self):
+        return ((keyword, self.leaf.positions(slot)) for keyword, slot in self.leaf.slots.items())
+
+
+class PackedLeaf:
+    """
+    Read-only, compressed copy of a leaf's coordinates and keywords.
+
+    Coordinates are stored as 32-bit fixed point relative to the index bounds, which
+    keeps them within (bounds extent) / 2**33 of the original values. Keywords are
+    stored as one posting list per keyword: the sorted positions of the objects carrying
+    it, delta encoded as varints in one shared byte string, with the weights of each
+    posting in a float32 array aligned with the postings (None when all weights are 1.0).
+
+    Attributes
+    ----------
+    qcoords : numpy.ndarray
+        (n, 2) uint32 fixed-point coordinates.
+    origin, step : numpy.ndarray
+        Fixed-point frame: location = origin + qcoords * step.
+    slots : dict
+        Keyword -> posting list number.
+    blob : bytes
+        Varint-encoded position deltas of every posting list, back to back.
+    byte_offsets, posting_offsets : numpy.ndarray
+        Start of each posting list in blob (bytes) and in weights (postings); one extra
+        trailing entry marks the end.
+    weights : numpy.ndarray or None
+        float32 weight of every posting.
+    Methods
+    -------
+    encode(coords, keywords, bounds):
+        Packs a leaf's coordinate rows and keyword -> weight dicts.
+    coords(idx=None):
+        Decoded float64 coordinates of all objects, or of the positions in idx.
+    positions(slot):
+        Decoded posting list number slot as sorted int32 positions.
+    match(positive_keywords, negative_keywords=(), idx=None, any_positive=True):
+        Positions passing a keyword filter and their textual scores, decoding only the
+        posting lists of the given keywords.
+    postings():
+        A PackedPostings view decoding posting lists on lookup.
+    keywords():
+        Decoded keyword -> weight dict of every object.
+    """
+    __slots__ = ('qcoords', 'origin', 'step', 'slots', 'blob', 'byte_offsets', 'posting_offsets', 'weights')
+
+    @classmethod
+    def encode(cls, coords: np.ndarray, keywords: Sequence[Dict[str, float]], bounds) -> 'PackedLeaf':
+        leaf = cls()
+        origin = np.array(bounds[:2], dtype=np.float64)
+        leaf.origin = origin
+        leaf.step = np.maximum(np.array(bounds[2:], dtype=np.float64) - origin, 1e-12) / QUANT_MAX
+        leaf.qcoords = quantize(np.asarray(coords, dtype=np.float64).reshape(-1, 2), leaf.origin, leaf.step)
+
+        lists: Dict[str, List[int]] = {}
+        weights: Dict[str, List[float]] = {}
+        for position, object_keywords in enumerate(keywords):
+            for keyword, weight in object_keywords.items():
+                lists.setdefault(keyword, []).append(position)
+                weights.setdefault(keyword, []).append(weight)
+        leaf.slots = {keyword: slot for slot, keyword in enumerate(lists)}
+        chunks, byte_offsets, posting_offsets = [], [0], [0]
+        for positions in lists.values():
+            deltas = np.diff(np.array(positions, dtype=np.int64), prepend=0)
+            chunks.append(varint_encode(deltas))
+            byte_offsets.append(byte_offsets[-1] + len(chunks[-1]))
+            posting_offsets.append(posting_offsets[-1] + len(positions))
+        leaf.blob = b''.join(chunks)
+        leaf.byte_offsets = np.array(byte_offsets, dtype=np.uint32)
+        leaf.posting_offsets = np.array(posting_offsets, dtype=np.uint32)
+        flat = np.array([weight for values in weights.values() for weight in values], dtype=np.float32)
+        leaf.weights = None if (flat == 1.0).all() else flat
+        return leaf
+
+    def __len__(self) -> int:
+        return len(self.qcoords)
+
+    def coords(self, idx=None) -> np.ndarray:
+        qcoords = self.qcoords if idx is None else self.qcoords[idx]
+        return self.origin + qcoords * self.step
+
+    def positions(self, slot: int) -> np.ndarray:
+        start, end = int(self.byte_offsets[slot]), int(self.byte_offsets[slot + 1])
+        return np.cumsum(varint_decode(self.blob[start:end])).astype(np.int32)
+
+    def match(self, positive_keywords: Sequence[str], negative_keywords=(), idx=None,
+              any_positive: bool = True):
+        """
+        Filter and score the leaf from the posting lists of the query keywords alone
+        Args:
+            idx: Positions to consider (None for the whole leaf)
+            any_positive: Keep only objects carrying a positive keyword
+        Returns:
+            (positions, textual scores): sorted positions carrying no negative keyword,
+            with the summed weights of their positive keywords
+        """
+        n = len(self.qcoords)
+        textual = np.zeros(n)
+        keep = np.zeros(n, dtype=bool) if any_positive else np.ones(n, dtype=bool)
+        for keyword in positive_keywords:
+            slot = self.slots.get(keyword)
+            if slot is None:
+                continue
+            positions = self.positions(slot)
+            if self.weights is None:
+                textual[positions] += 1.0
+            else:
+                textual[positions] += self.weights[self.posting_offsets[slot]:self.posting_offsets[slot + 1]]
+            if any_positive:
+                keep[positions] = True
+        for keyword in negative_keywords:
+            slot = self.slots.get(keyword)
+            if slot is not None:
+                keep[self.positions(slot)] = False
+        if idx is not None:
+            inside = np.zeros(n, dtype=bool)
+            inside[idx] = True
+            keep &= inside
+        positions = np.flatnonzero(keep)
+        return positions, textual[positions]
+
+    def postings(self) -> PackedPostings:
+        return PackedPostings(self)
+
+    def keywords(self) -> List[Dict[str, float]]:
+        decoded = [{} for _ in range(len(self.qcoords))]
+        counts = np.diff(self.posting_offsets.astype(np.int64))
+        # Undo the deltas of all lists at once: a running sum restarted at every list
+        deltas = varint_decode(self.blob).astype(np.int64)
+        totals = np.cumsum(deltas)
+        restart = np.repeat(np.concatenate(([0], totals))[self.posting_offsets[:-1].astype(np.int64)], counts)
+        positions = (totals - restart).tolist()
+        weights = [1.0] * len(positions) if self.weights is None else self.weights.tolist()
+        i = 0
+        for keyword, count in zip(self.slots, counts.tolist()):
+            for position, weight in zip(positions[i:i + count], weights[i:i + count]):
+                decoded[position][keyword] = weight
+            i += count
+        return decoded
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
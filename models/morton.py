@@ -0,0 +1,212 @@
+from math import floor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from models.bloom import KeywordBloom
+from models.quadtree import QuadtreeNode, DEFAULT_CAPACITY
+from models.sorted_arrays import SORTED_ARRAY_SLOTS, SortedArrayIndex, SortedArrayNode
+
+MORTON_BITS = 24  # Grid cells per axis: 2**24, about 2e-5 degrees of longitude
+
+
+def _spread(cells: np.ndarray) -> np.ndarray:
+    # Insert a zero bit between the bits of 32-bit cells (uint64 in, uint64 out)
+    v = cells.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v
+
+
+def grid_cells(coords: np.ndarray, bounds, bits: int = MORTON_BITS) -> np.ndarray:
+    """Cell (column, row) of each (n, 2) location on a 2**bits grid over bounds, clipped to it"""
+    scale = float(1 << bits)
+    lows = np.array(bounds[:2], dtype=np.float64)
+    spans = np.maximum(np.array(bounds[2:], dtype=np.float64) - lows, 1e-12)
+    cells = np.floor((np.asarray(coords, dtype=np.float64).reshape(-1, 2) - lows) / spans * scale)
+    return np.clip(cells, 0, scale - 1).astype(np.uint64)
+
+
+def morton_codes(coords: np.ndarray, bounds, bits: int = MORTON_BITS) -> np.ndarray:
+    """Morton (Z-order) codes of (n, 2) locations on a 2**bits grid over bounds"""
+    cells = grid_cells(coords, bounds, bits)
+    return _spread(cells[:, 0]) | (_spread(cells[:, 1]) << np.uint64(1))
+
+
+class MortonNode(SortedArrayNode):
+    """
+    Node of the implicit quadtree over a MortonIndex: the objects whose Morton codes
+    share a prefix, i.e. the contiguous range [lo, hi) of the sorted arrays (see
+    SortedArrayNode); its bounds are the bounding box of its objects. Empty quadrants
+    get no node.
+    """
+    __slots__ = ()
+
+
+class MortonIndex(SortedArrayIndex, MortonNode):
+    """
+    Spatial backend storing objects in flat arrays sorted by Morton (Z-order) code,
+    as an alternative to the pointer-based QuadtreeNode tree.
+
+    Codes interleave the bits of each object's cell on a 2**bits x 2**bits grid over
+    the index bounds, so every quadtree cell is one contiguous interval of the sorted
+    arrays. The index is its own root node: its children are the implicit quadtree
+    over the sorted arrays (each node a Morton prefix, found with np.searchsorted)
+    plus, between rebuilds, a delta leaf of unsorted recent inserts (see
+    SortedArrayIndex). Every query processor therefore works unchanged through the
+    QuadtreeNode node protocol.
+
+    Attributes
+    ----------
+    codes : numpy.ndarray
+        Sorted uint64 Morton codes.
+    sorted_ids, sorted_coords, sorted_keywords : numpy.ndarray
+        Object ids, (n, 2) locations and keyword dicts aligned with codes.
+    delta : QuadtreeNode
+        Leaf holding objects inserted since the last rebuild.
+    Methods
+    -------
+    insert(obj_id, location, keywords):
+        Adds an object to the delta leaf, rebuilding the sorted arrays once the delta
+        grows past half their size (amortized O(log n) per insert).
+    flush():
+        Merges the delta leaf into the sorted arrays.
+    morton_ranges(bounds):
+        (lo, hi, exact) position ranges of the sorted arrays covering bounds.
+    range_positions(bounds):
+        Sorted-array positions of the objects inside bounds.
+    query_range(bounds, found_objects, negative_sets=None, positive_masks=None, stats=None):
+        As QuadtreeNode.query_range; without keyword pruning the box is answered from
+        Morton intervals instead of a tree walk.
+    """
+    __slots__ = ('bits', 'codes') + SORTED_ARRAY_SLOTS
+
+    def __init__(self, bounds: Tuple[float, float, float, float], capacity: int = DEFAULT_CAPACITY,
+                 bloom_params: Optional[KeywordBloom] = None, bits: int = MORTON_BITS):
+        super().__init__(bounds, capacity, bloom_params)
+        self.bits = bits
+        self.codes = np.empty(0, dtype=np.uint64)
+
+    def cells(self, coords: np.ndarray) -> np.ndarray:
+        """Grid cell (column, row) of each location, clipped to the index bounds"""
+        return grid_cells(coords, self.bounds, self.bits)
+
+    def encode(self, coords: np.ndarray) -> np.ndarray:
+        """Morton codes of (n, 2) locations"""
+        return morton_codes(coords, self.bounds, self.bits)
+
+    def _order(self, coords: np.ndarray, n_new: int) -> np.ndarray:
+        codes = np.concatenate([self.codes, self.encode(coords[len(coords) - n_new:])])
+        order = np.argsort(codes, kind='stable')
+        self.codes = codes[order]
+        return order
+
+    def _rebuild_tree(self) -> None:
+        top = self._build(0, len(self.codes), 0, 0) if len(self.codes) else None
+        self.children = [top] if top is not None else []
+        if self.delta.ids:
+            self.children.append(self.delta)
+        self.ids, self.keywords = [], []
+        self._rebuild_summary()
+
+    def _build(self, lo: int, hi: int, level: int, prefix: int) -> MortonNode:
+        node = MortonNode.__new__(MortonNode)
+        QuadtreeNode.__init__(node, None, self.capacity, self.bloom_params)
+        node.lo, node.hi = lo, hi
+        coords = self.sorted_coords[lo:hi]
+        node.bounds = (float(coords[:, 0].min()), float(coords[:, 1].min()),
+                       float(coords[:, 0].max()), float(coords[:, 1].max()))
+        if hi - lo <= self.capacity or level == self.bits:
+            self._attach(node)
+            node._rebuild_summary()
+            return node
+        # Quadrant q of this cell holds the codes prefix * 4 + q followed by any suffix
+        shift = 2 * (self.bits - level - 1)
+        splits = [(prefix * 4 + q) << shift for q in range(1, 4)]
+        bounds = [lo] + (np.searchsorted(self.codes[lo:hi], np.array(splits, dtype=np.uint64)) + lo).tolist() + [hi]
+        node.children = [self._build(bounds[q], bounds[q + 1], level + 1, prefix * 4 + q)
+                         for q in range(4) if bounds[q] < bounds[q + 1]]
+        node._rebuild_summary()
+        return node
+
+    def morton_ranges(self, bounds) -> List[Tuple[int, int, bool]]:
+        """
+        Decompose bounds into Morton intervals and locate them with np.searchsorted.
+        Returns (lo, hi, exact) position ranges in code order; exact ranges lie wholly
+        inside bounds, the others hold the objects of cells cut by its edges.
+        """
+        if not len(self.codes):
+            return []
+        if bounds[2] < self.bounds[0] or bounds[0] > self.bounds[2] or \
+                bounds[3] < self.bounds[1] or bounds[1] > self.bounds[3]:
+            return []
+        # Same arithmetic as cells(), so box edges and objects quantize consistently
+        scale = float(1 << self.bits)
+        x_span = max(self.bounds[2] - self.bounds[0], 1e-12)
+        y_span = max(self.bounds[3] - self.bounds[1], 1e-12)
+        cx0, cx1 = (int(min(max(floor((v - self.bounds[0]) / x_span * scale), 0), scale - 1))
+                    for v in (bounds[0], bounds[2]))
+        cy0, cy1 = (int(min(max(floor((v - self.bounds[1]) / y_span * scale), 0), scale - 1))
+                    for v in (bounds[1], bounds[3]))
+        bits = self.bits
+        # Descend until cells are about a quarter of the box, then stop splitting edge cells
+        span = max(cx1 - cx0, cy1 - cy0) + 1
+        stop = min(bits, max(0, bits - span.bit_length() + 2))
+        intervals = []  # [first code, end code, exact]
+        stack = [(0, 0, 0, 0)]
+        while stack:
+            level, qx, qy, prefix = stack.pop()
+            size = 1 << (bits - level)
+            x0, y0 = qx * size, qy * size
+            x1, y1 = x0 + size - 1, y0 + size - 1
+            if x1 < cx0 or x0 > cx1 or y1 < cy0 or y0 > cy1:
+                continue
+            # Cells strictly between the edge cells hold only points inside bounds
+            exact = x0 > cx0 and x1 < cx1 and y0 > cy0 and y1 < cy1
+            if exact or level == stop:
+                shift = 2 * (bits - level)
+                start, end = prefix << shift, (prefix + 1) << shift
+                if intervals and intervals[-1][1] == start and intervals[-1][2] == exact:
+                    intervals[-1][1] = end
+                else:
+                    intervals.append([start, end, exact])
+                continue
+            for q in (3, 2, 1, 0):  # Popped in code order
+                stack.append((level + 1, 2 * qx + (q & 1), 2 * qy + (q >> 1), prefix * 4 + q))
+        edges = np.searchsorted(self.codes, np.array([v for iv in intervals for v in iv[:2]], dtype=np.uint64))
+        return [(int(edges[2 * i]), int(edges[2 * i + 1]), iv[2])
+                for i, iv in enumerate(intervals) if edges[2 * i] < edges[2 * i + 1]]
+
+    def range_positions(self, bounds) -> np.ndarray:
+        """Positions in the sorted arrays of the objects inside bounds"""
+        ranges = self.morton_ranges(bounds)
+        if not ranges:
+            return np.empty(0, dtype=np.intp)
+        lo, hi, exact = (np.array(column) for column in zip(*ranges))
+        lengths = hi - lo
+        # Concatenated aranges of all ranges in one pass, then mask only the edge ranges
+        positions = np.arange(lengths.sum()) + np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+        coords = self.sorted_coords[positions]
+        mask = np.repeat(exact.astype(bool), lengths)
+        mask |= ((coords[:, 0] >= bounds[0]) & (coords[:, 0] <= bounds[2]) &
+                 (coords[:, 1] >= bounds[1]) & (coords[:, 1] <= bounds[3]))
+        return positions[mask]
+
+    def query_range(self, bounds, found_objects, negative_sets=None, positive_masks=None, stats=None):
+        if negative_sets or positive_masks:
+            return super().query_range(bounds, found_objects, negative_sets, positive_masks, stats)
+        positions = self.range_positions(bounds)
+        found_objects.extend(zip(self.sorted_ids[positions].tolist(),
+                                 map(tuple, self.sorted_coords[positions].tolist()),
+                                 self.sorted_keywords[positions].tolist()))
+        idx = self.delta.leaf_positions(bounds) if self.delta.ids else np.empty(0, dtype=np.intp)
+        if idx is None:
+            idx = np.arange(len(self.delta.ids))
+        delta = self.delta
+        found_objects.extend((delta.ids[i], tuple(delta.coords[i].tolist()), delta.keywords[i])
+                             for i in idx.tolist())
+        if stats is not None:
+            stats.objects_examined += len(positions) + len(idx)
@@ -1,8 +1,20 @@
 import sys
-from typing import List, Tuple, Optional
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple, Optional
+
+import numpy as np
+
+from models.bloom import KeywordBloom
+from models.compact import PackedLeaf
 
 sys.setrecursionlimit(10**6)
 
+DEFAULT_CAPACITY = 1000
+MIN_CAPACITY = 256
+MAX_CAPACITY = 8192
+MIN_NODE_SIZE = 0.0001  # Nodes narrower than this are never split
+
+
 class QuadtreeNode:
     """
     A class representing a node in a quadtree structure.
@@ -11,96 +23,433 @@ class QuadtreeNode:
     bounds : tuple
         A tuple representing the bounds of the node in the format (x_min, y_min, x_max, y_max).
     capacity : int
-        The maximum number of objects a node can hold before it needs to subdivide.
-    objects : list
-        A list storing objects in the format (obj_id, location, keywords, full_text).
+        The maximum number of objects a leaf can hold before it needs to subdivide.
+        Leaves created by a lopsided split (every object landing in one quadrant)
+        double their capacity, so dense clusters produce a few fat leaves instead
+        of long chains of near-empty nodes.
+    ids : list
+        Object ids stored in the leaf, aligned with ``coords``.
+    coords : numpy.ndarray
+        Contiguous ``(n, 2)`` float array of object locations. Only the first
+        ``len(ids)`` rows are valid; the buffer grows geometrically on insert.
+    keywords : list
+        Keyword -> weight mapping of each stored object, aligned with ``ids``.
+    max_weights : dict
+        Maximum weight of every keyword found in the subtree, an upper bound on the
+        textual relevance any object below this node can reach.
+    common_keywords : set or None
+        Keywords carried by every object in the subtree (None while it is empty). A
+        query whose negative keywords intersect this set can skip the whole subtree.
+    bloom : int
+        Fixed-size Bloom filter (an int bit set) of the keywords in the subtree, used to
+        skip subtrees holding none of a query's positive keywords. 0 when disabled.
+    bloom_params : KeywordBloom or None
+        Filter size and hashing shared by every node of the tree; None disables filters.
+    postings : dict or None
+        Keyword -> sorted int32 array of positions in a leaf, built on first use by
+        keyword_postings() and dropped when the leaf changes. Not pickled.
+    packed : PackedLeaf or None
+        Compressed coordinates and keyword posting lists of a packed leaf, whose coords
+        and keywords are then empty. Read them through scan_coords() and scan_keywords(),
+        which decode packed leaves on the fly; an insert unpacks the leaf again.
     children : list or None
         A list of child QuadtreeNode objects if the node has been subdivided, otherwise None.
     Methods:
     --------
-    __init__(bounds, capacity=4):
-        Initializes a QuadtreeNode with given bounds and capacity.
+    __init__(bounds, capacity=1000, bloom_params=None):
+        Initializes a QuadtreeNode with given bounds and capacity, optionally keeping
+        keyword Bloom filters sized by bloom_params.
+    suggest_capacity(expected_objects):
+        Picks a leaf capacity from the expected number of objects.
     subdivide():
         Subdivides the current node into four child nodes.
-    insert(obj_id, location, keywords, full_text):
+    insert(obj_id, location, keywords):
         Inserts an object into the quadtree. Returns True if the object is inserted, otherwise False.
-    query_range(bounds, found_objects):
-        Queries the quadtree for objects within a given range and appends them to found_objects.
+    flush():
+        Completes pending inserts (a no-op here; packed backends such as MortonIndex rebuild).
+    min_distance(x, y):
+        Returns the minimum Euclidean distance from (x, y) to the node's bounds.
+    leaf_positions(bounds):
+        Returns positions of the leaf's objects inside bounds (None if all of them are).
+    range_slices(bounds, negative_sets=None, positive_masks=None, stats=None):
+        Returns (leaf, index_array) pairs for the leaves overlapping bounds. The index
+        array is None when the whole leaf lies inside bounds. Subtrees excluded by every
+        set of negative keywords in negative_sets are skipped, as are subtrees whose Bloom
+        filter rules out all keywords behind positive_masks. Traversal counters are added to
+        stats (a queries.stats.QueryStats) when one is given.
+    excluded_by(negative_sets):
+        Checks whether every object below the node carries a keyword from each set.
+    keyword_postings(cache=True):
+        Returns the leaf's keyword posting lists, used by boolean keyword predicates.
+    scan_coords(idx=None), scan_keywords():
+        Returns the leaf's coordinates (of the positions in idx) and keyword dicts,
+        decoded when the leaf is packed.
+    pack_leaves(bounds=None):
+        Packs every leaf of the subtree (see models.compact.PackedLeaf) with coordinates
+        quantized relative to bounds, by default the node's own.
+    query_range(bounds, found_objects, negative_sets=None, positive_masks=None, stats=None):
+        Queries the quadtree for objects within a given range and appends them to found_objects
+        as (obj_id, location, keywords) tuples.
     """
-    __slots__ = ('bounds', 'capacity', 'objects', 'children')  # Optimize memory usage
-    
-    def __init__(self, bounds: Tuple[float, float, float, float], capacity: int = 1000):
+    __slots__ = ('bounds', 'capacity', 'ids', 'coords', 'keywords', 'max_weights', 'common_keywords',
+                 'bloom', 'bloom_params', 'postings', 'packed', 'children')  # Optimize memory usage
+
+    def __init__(self, bounds: Tuple[float, float, float, float], capacity: int = DEFAULT_CAPACITY,
+                 bloom_params: Optional[KeywordBloom] = None):
         self.bounds = bounds  # (x_min, y_min, x_max, y_max)
-        self.capacity = capacity  # Increased capacity to reduce tree depth
-        self.objects: List[Tuple] = []
+        self.capacity = capacity
+        self.ids: List = []
+        self.coords = np.empty((0, 2), dtype=np.float64)
+        self.keywords: List = []
+        self.max_weights: Dict[str, float] = {}
+        self.common_keywords: Optional[Set[str]] = None
+        self.bloom = 0
+        self.bloom_params = bloom_params
+        self.postings: Optional[Dict[str, np.ndarray]] = None
+        self.packed: Optional[PackedLeaf] = None
         self.children: Optional[List['QuadtreeNode']] = None
-    
+
+    @staticmethod
+    def suggest_capacity(expected_objects: int) -> int:
+        """
+        Pick a leaf capacity for an index expected to hold ``expected_objects``.
+        Leaves are scanned with a single vectorized mask, so larger datasets can
+        afford fatter leaves (and a shallower tree); the capacity grows with the
+        square root of the object count.
+        """
+        if not expected_objects:
+            return DEFAULT_CAPACITY
+        return int(min(MAX_CAPACITY, max(MIN_CAPACITY, round(expected_objects ** 0.5))))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def objects(self) -> List[Tuple]:
+        """Objects of this leaf as (obj_id, location, keywords) tuples."""
+        return list(zip(self.ids, map(tuple, self.scan_coords().tolist()), self.scan_keywords()))
+
     def subdivide(self):
         # Calculate midpoints
         x_min, y_min, x_max, y_max = self.bounds
         mid_x = (x_min + x_max) / 2
         mid_y = (y_min + y_max) / 2
-        
+
         # Create children only when needed
+        params = self.bloom_params
         self.children = [
-            QuadtreeNode((x_min, y_min, mid_x, mid_y), self.capacity),
-            QuadtreeNode((mid_x, y_min, x_max, mid_y), self.capacity),
-            QuadtreeNode((x_min, mid_y, mid_x, y_max), self.capacity),
-            QuadtreeNode((mid_x, mid_y, x_max, y_max), self.capacity)
+            QuadtreeNode((x_min, y_min, mid_x, mid_y), self.capacity, params),
+            QuadtreeNode((mid_x, y_min, x_max, mid_y), self.capacity, params),
+            QuadtreeNode((x_min, mid_y, mid_x, y_max), self.capacity, params),
+            QuadtreeNode((mid_x, mid_y, x_max, y_max), self.capacity, params)
         ]
-        
-        # Redistribute existing objects to children
-        for obj in self.objects:
-            for child in self.children:
-                if child.insert(obj[0], obj[1], obj[2], obj[3]):
-                    break
-        self.objects.clear()  # Clear objects after redistribution
-    
-    def insert(self, obj_id, location, keywords, full_text):
-        if not (self.bounds[0] <= location[0] <= self.bounds[2] and 
-                self.bounds[1] <= location[1] <= self.bounds[3]):
-            return False
 
-        # If we have children, insert into appropriate child
-        if self.children is not None:
-            for child in self.children:
-                if child.insert(obj_id, location, keywords, full_text):
-                    return True
-            return False
+        # Redistribute existing objects to children in one pass. Points on a
+        # midline go to the lower/left child, as with sequential insertion.
+        n = len(self.ids)
+        coords = self.coords[:n]
+        quadrant = (coords[:, 0] > mid_x).astype(np.intp) + 2 * (coords[:, 1] > mid_y)
+        for q, child in enumerate(self.children):
+            idx = np.flatnonzero(quadrant == q)
+            if idx.size == 0:
+                continue
+            child.coords = coords[idx]
+            positions = idx.tolist()
+            child.ids = [self.ids[i] for i in positions]
+            child.keywords = [self.keywords[i] for i in positions]
+            child._rebuild_summary()
+            if idx.size > self.capacity:
+                # Everything landed in one quadrant: the region is dense, so let
+                # the child hold more before splitting again.
+                child.capacity = max(self.capacity, min(self.capacity * 2, MAX_CAPACITY))
+                child._maybe_subdivide()
+
+        # Clear objects after redistribution
+        self.postings = None
+        self.ids = []
+        self.coords = np.empty((0, 2), dtype=np.float64)
+        self.keywords = []
 
-        # No children, add to current node
-        self.objects.append((obj_id, location, keywords, full_text))
-        
+    def _maybe_subdivide(self):
         # Only subdivide if we exceed capacity and the bounds are large enough
-        if len(self.objects) > self.capacity:
+        if len(self.ids) > self.capacity:
             # Check if subdivision is meaningful (prevent infinite subdivision)
             x_min, y_min, x_max, y_max = self.bounds
-            if (x_max - x_min) > 0.0001 and (y_max - y_min) > 0.0001:
+            if (x_max - x_min) > MIN_NODE_SIZE and (y_max - y_min) > MIN_NODE_SIZE:
                 self.subdivide()
-            
+
+    def _add_summary(self, keywords, bloom: int = 0):
+        # Fold one object's keywords (and their Bloom bits) into this node's keyword summary
+        self.bloom |= bloom
+        max_weights = self.max_weights
+        for keyword, weight in keywords.items():
+            if weight > max_weights.get(keyword, float('-inf')):
+                max_weights[keyword] = weight
+        if self.common_keywords is None:
+            self.common_keywords = set(keywords)
+        elif self.common_keywords:
+            self.common_keywords.intersection_update(keywords)
+
+    def _merge_summary(self, child: 'QuadtreeNode'):
+        # Fold a child's keyword summary into this node's
+        if child.common_keywords is None:
+            return  # Empty subtree
+        self.bloom |= child.bloom
+        max_weights = self.max_weights
+        for keyword, weight in child.max_weights.items():
+            if weight > max_weights.get(keyword, float('-inf')):
+                max_weights[keyword] = weight
+        if self.common_keywords is None:
+            self.common_keywords = set(child.common_keywords)
+        else:
+            self.common_keywords &= child.common_keywords
+
+    def _rebuild_summary(self):
+        # Recompute the keyword summary from this node's objects and children
+        self.max_weights = {}
+        self.common_keywords = None
+        self.bloom = 0
+        params = self.bloom_params
+        for keywords in self.keywords:
+            self._add_summary(keywords, params.filter_of(keywords) if params is not None else 0)
+        for child in self.children or ():
+            self._merge_summary(child)
+
+    def excluded_by(self, negative_sets) -> bool:
+        """
+        True when every object below this node carries a keyword from each set in
+        negative_sets, so no query owning one of those sets can use the subtree.
+        """
+        common = self.common_keywords
+        if common is None:
+            return True  # Empty subtree
+        if not common or not negative_sets:
+            return False
+        return all(not common.isdisjoint(negative) for negative in negative_sets)
+
+    def keyword_postings(self, cache: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Keyword -> sorted positions of the leaf's objects carrying it. Kept on the leaf
+        unless cache is False; packed leaves decode lists on lookup and keep nothing.
+        """
+        if self.packed is not None:
+            return self.packed.postings()
+        if self.postings is None:
+            lists = defaultdict(list)
+            for position, keywords in enumerate(self.keywords):
+                for keyword in keywords:
+                    lists[keyword].append(position)
+            postings = {keyword: np.array(positions, dtype=np.int32) for keyword, positions in lists.items()}
+            if not cache:
+                return postings
+            self.postings = postings
+        return self.postings
+
+    def scan_coords(self, idx=None) -> np.ndarray:
+        """Coordinates of the leaf's objects, or of the positions in idx"""
+        if self.packed is not None:
+            return self.packed.coords(idx)
+        return self.coords[:len(self.ids)] if idx is None else self.coords[idx]
+
+    def scan_keywords(self) -> List:
+        """Keyword -> weight dicts of the leaf's objects, decoded on every call when packed"""
+        return self.keywords if self.packed is None else self.packed.keywords()
+
+    def pack(self, bounds) -> bool:
+        """Replace a leaf's coordinates and keywords with a PackedLeaf; False if nothing to pack"""
+        if self.children is not None or self.packed is not None or not self.ids:
+            return False
+        self.packed = PackedLeaf.encode(self.coords[:len(self.ids)], self.keywords, bounds)
+        self.coords = np.empty((0, 2), dtype=np.float64)
+        self.keywords = []
+        self.postings = None
+        return True
+
+    def unpack(self) -> None:
+        """Restore plain coordinates and keyword dicts so the leaf can change"""
+        if self.packed is not None:
+            self.coords = self.packed.coords()
+            self.keywords = self.packed.keywords()
+            self.packed = None
+
+    def pack_leaves(self, bounds=None) -> int:
+        """Pack every unpacked leaf below this node; returns how many were packed"""
+        bounds = self.bounds if bounds is None else bounds
+        packed = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.children is not None:
+                stack.extend(node.children)
+            else:
+                packed += node.pack(bounds)
+        return packed
+
+    def _find_leaf(self, x: float, y: float, keywords=None) -> 'QuadtreeNode':
+        # Descend to the leaf covering (x, y), folding keywords into each node passed
+        bloom = 0
+        if keywords is not None and self.bloom_params is not None:
+            bloom = self.bloom_params.filter_of(keywords)
+        node = self
+        while True:
+            if keywords is not None:
+                node._add_summary(keywords, bloom)
+            if node.children is None:
+                return node
+            # children[0] spans the lower-left quadrant, so its max corner is the midpoint
+            mid_x, mid_y = node.children[0].bounds[2], node.children[0].bounds[3]
+            node = node.children[(x > mid_x) + 2 * (y > mid_y)]
+
+    def insert(self, obj_id, location, keywords):
+        x, y = location[0], location[1]
+        if not (self.bounds[0] <= x <= self.bounds[2] and
+                self.bounds[1] <= y <= self.bounds[3]):
+            return False
+
+        leaf = self._find_leaf(x, y, keywords)
+        leaf.unpack()
+        n = len(leaf.ids)
+        if n == len(leaf.coords):
+            grown = np.empty((max(16, 2 * n), 2), dtype=np.float64)
+            grown[:n] = leaf.coords[:n]
+            leaf.coords = grown
+        leaf.coords[n, 0] = x
+        leaf.coords[n, 1] = y
+        leaf.ids.append(obj_id)
+        leaf.keywords.append(keywords)
+        leaf.postings = None
+
+        leaf._maybe_subdivide()
         return True
 
-    def query_range(self, bounds, found_objects):
-        # Quick boundary check
-        if not self._bounds_intersect(bounds):
-            return
+    def flush(self) -> None:
+        """Finish a run of inserts; the quadtree inserts in place, so nothing is pending"""
 
-        # Add objects from current node
-        found_objects.extend(obj for obj in self.objects 
-                           if self._point_in_bounds(obj[1], bounds))
+    def range_slices(self, bounds, out: Optional[List] = None,
+                     negative_sets: Optional[List[Set[str]]] = None,
+                     positive_masks: Optional[List[int]] = None,
+                     stats=None) -> List[Tuple['QuadtreeNode', Optional[np.ndarray]]]:
+        """
+        Collect the leaves overlapping bounds as (leaf, idx) pairs, where idx holds the
+        positions of the leaf's objects inside bounds, or is None when the whole leaf
+        lies inside bounds and needs no per-point test. When negative_sets is given,
+        subtrees whose objects all carry a keyword from every one of those sets are
+        skipped without visiting their objects. When positive_masks (Bloom masks from
+        bloom_params.mask) is given, subtrees whose filter rules out every one of those
+        keywords are skipped; false positives only cost a wasted visit.
+        """
+        if out is None:
+            out = []
+        found_before = len(out)
+        visited = pruned = 0
+        stack = [(self, False)]
+        while stack:
+            node, inside = stack.pop()
+            visited += 1
+            if negative_sets and node.excluded_by(negative_sets):
+                pruned += 1
+                continue
+            if positive_masks and not KeywordBloom.might_contain_any(node.bloom, positive_masks):
+                pruned += 1
+                continue
+            if not inside:
+                # Quick boundary check
+                if not node._bounds_intersect(bounds):
+                    pruned += 1
+                    continue
+                inside = node._bounds_within(bounds)
+
+            if node.children is not None:
+                # Reversed so children are visited in quadrant order
+                stack.extend((child, inside) for child in reversed(node.children))
+                continue
+
+            if not len(node.ids):
+                continue
+            if inside:
+                out.append((node, None))
+                continue
+            idx = node.leaf_positions(bounds)
+            if idx is None or idx.size:
+                out.append((node, idx))
+
+        if stats is not None:
+            stats.nodes_visited += visited
+            stats.nodes_pruned += pruned
+            stats.leaves_scanned += len(out) - found_before
+            stats.objects_examined += sum(len(leaf.ids) if idx is None else idx.size
+                                          for leaf, idx in out[found_before:])
+        return out
+
+    def leaf_positions(self, bounds) -> Optional[np.ndarray]:
+        """
+        Positions of this leaf's objects that fall inside bounds, found with a single
+        boolean mask. Returns None when the whole leaf lies inside bounds.
+        """
+        if self._bounds_within(bounds):
+            return None
+        coords = self.scan_coords()
+        mask = ((coords[:, 0] >= bounds[0]) & (coords[:, 0] <= bounds[2]) &
+                (coords[:, 1] >= bounds[1]) & (coords[:, 1] <= bounds[3]))
+        return np.flatnonzero(mask)
+
+    def min_distance(self, x: float, y: float) -> float:
+        """Minimum Euclidean distance from (x, y) to any point of the node's bounds"""
+        dx = max(self.bounds[0] - x, 0.0, x - self.bounds[2])
+        dy = max(self.bounds[1] - y, 0.0, y - self.bounds[3])
+        return (dx * dx + dy * dy) ** 0.5
+
+    def query_range(self, bounds, found_objects, negative_sets=None, positive_masks=None, stats=None):
+        for leaf, idx in self.range_slices(bounds, negative_sets=negative_sets,
+                                           positive_masks=positive_masks, stats=stats):
+            if idx is None:
+                found_objects.extend(zip(leaf.ids, map(tuple, leaf.scan_coords().tolist()),
+                                         leaf.scan_keywords()))
+            else:
+                ids, keywords = leaf.ids, leaf.scan_keywords()
+                found_objects.extend((ids[i], loc, keywords[i])
+                                     for i, loc in zip(idx.tolist(), map(tuple, leaf.scan_coords(idx).tolist())))
 
-        # Recurse into children if they exist
-        if self.children is not None:
-            for child in self.children:
-                child.query_range(bounds, found_objects)
-    
     def _bounds_intersect(self, bounds) -> bool:
-        return not (bounds[2] < self.bounds[0] or 
-                   bounds[0] > self.bounds[2] or 
-                   bounds[3] < self.bounds[1] or 
+        return not (bounds[2] < self.bounds[0] or
+                   bounds[0] > self.bounds[2] or
+                   bounds[3] < self.bounds[1] or
                    bounds[1] > self.bounds[3])
-    
+
+    def _bounds_within(self, bounds) -> bool:
+        return (bounds[0] <= self.bounds[0] and self.bounds[2] <= bounds[2] and
+                bounds[1] <= self.bounds[1] and self.bounds[3] <= bounds[3])
+
     @staticmethod
     def _point_in_bounds(point, bounds) -> bool:
-        return (bounds[0] <= point[0] <= bounds[2] and 
-                bounds[1] <= point[1] <= bounds[3])
\ No newline at end of file
+        return (bounds[0] <= point[0] <= bounds[2] and
+                bounds[1] <= point[1] <= bounds[3])
+
+    def __getstate__(self):
+        # Drop the unused tail of the coordinate buffer before pickling
+        state = {slot: getattr(self, slot) for slot in self.__slots__}
+        state['coords'] = np.ascontiguousarray(self.coords[:len(self.ids)])
+        state['postings'] = None  # Rebuilt on demand
+        return state
+
+    def __setstate__(self, state):
+        # Indexes pickled before array-packed leaves store (None, slots) with an
+        # 'objects' list of (obj_id, location, keywords, full_text) tuples; full
+        # texts now live in the index's text store and are dropped here
+        if isinstance(state, tuple):
+            state = state[1]
+        legacy_objects = state.pop('objects', None)
+        for slot in self.__slots__:
+            setattr(self, slot, state.get(slot))
+        if self.bloom is None:
+            self.bloom = 0  # Pickled before Bloom filters existed
+        if legacy_objects is not None:
+            self.ids = [obj[0] for obj in legacy_objects]
+            self.coords = np.array([obj[1] for obj in legacy_objects], dtype=np.float64).reshape(-1, 2)
+            self.keywords = [obj[2] for obj in legacy_objects]
+        if any(slot not in state for slot in ('max_weights', 'common_keywords')):
+            # Older pickles lack keyword summaries; children are restored first, so
+            # rebuilding here works bottom-up. Unweighted keyword sets count as 1.0.
+            self.keywords = [kw if isinstance(kw, dict) else dict.fromkeys(kw, 1.0)
+                             for kw in self.keywords]
+            self._rebuild_summary()
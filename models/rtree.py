@@ -0,0 +1,251 @@
+import heapq
+from itertools import count
+from math import ceil, sqrt
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from models.bloom import KeywordBloom
+from models.quadtree import QuadtreeNode, DEFAULT_CAPACITY
+from models.sorted_arrays import SORTED_ARRAY_SLOTS, SortedArrayIndex, SortedArrayNode
+
+RTREE_FANOUT = 16  # Children per inner node
+# Leaves are packed to this fraction of the capacity. Quadtree leaves end up about a
+# third full, and the best-first top-k search prunes leaf by leaf, so full leaves
+# would make every visited leaf cost three times as many scored objects.
+RTREE_LEAF_FILL = 0.25
+_ALL_TRUE = np.uint32(0x01010101)  # Four True bytes read as one uint32
+
+
+def str_order(points: np.ndarray, capacity: int) -> np.ndarray:
+    """
+    Sort-Tile-Recursive order of (n, 2) points: sorted by x into ceil(sqrt(P)) vertical
+    slices of whole pages (P = pages of capacity points), each slice sorted by y. Every
+    run of capacity consecutive positions is then one spatially compact page.
+    """
+    n = len(points)
+    order = np.argsort(points[:, 0], kind='stable')
+    pages = ceil(n / capacity)
+    per_slice = ceil(sqrt(pages)) * capacity
+    for start in range(0, n, per_slice):
+        part = order[start:start + per_slice]
+        order[start:start + per_slice] = part[np.argsort(points[part, 1], kind='stable')]
+    return order
+
+
+def pack_boxes(bounds) -> np.ndarray:
+    """(x_min, y_min, x_max, y_max) rows packed as (x_min, y_min, -x_max, -y_max)"""
+    boxes = np.array(bounds, dtype=np.float64).reshape(-1, 4)
+    boxes[:, 2:] *= -1
+    return boxes
+
+
+def _all_rows(flags: np.ndarray) -> np.ndarray:
+    # Rows of a C-contiguous (m, 4) bool array whose four flags are all True
+    return flags.view(np.uint32)[:, 0] == _ALL_TRUE
+
+
+class RTreeNode(SortedArrayNode):
+    """
+    Node of a packed RTreeIndex. Its bounds are the minimum bounding rectangle (MBR)
+    of the objects below it, and an inner node keeps its children's MBRs packed in one
+    (m, 4) array with the maxima negated, (x_min, y_min, -x_max, -y_max): a child
+    intersects a box when its row is <= (x_max, y_max, -x_min, -y_min) and lies
+    inside it when its row is >= (x_min, y_min, -x_max, -y_max), so one traversal
+    step tests every child with a single comparison. A leaf is the range [lo, hi) of
+    the index's STR-ordered arrays (see SortedArrayNode).
+    """
+    __slots__ = ('child_boxes',)
+
+    def _set_children(self, children: List[QuadtreeNode]) -> None:
+        self.children = children
+        self.child_boxes = pack_boxes([child.bounds for child in children])
+
+    def range_slices(self, bounds, out: Optional[List] = None, negative_sets=None, positive_masks=None,
+                     stats=None) -> List[Tuple[QuadtreeNode, Optional[np.ndarray]]]:
+        """As QuadtreeNode.range_slices, testing each node's children against bounds at once"""
+        if out is None:
+            out = []
+        found_before = len(out)
+        visited = pruned = 0
+        x_min, y_min, x_max, y_max = bounds
+        intersect_limit = np.array([x_max, y_max, -x_min, -y_min])
+        within_limit = np.array([x_min, y_min, -x_max, -y_max])
+        stack = [(self, False)]
+        while stack:
+            node, inside = stack.pop()
+            visited += 1
+            if negative_sets and node.excluded_by(negative_sets):
+                pruned += 1
+                continue
+            if positive_masks and not KeywordBloom.might_contain_any(node.bloom, positive_masks):
+                pruned += 1
+                continue
+
+            if node.children is not None:
+                if inside:
+                    stack.extend((child, True) for child in reversed(node.children))
+                    continue
+                boxes = node.child_boxes
+                hits = _all_rows(boxes <= intersect_limit).nonzero()[0].tolist()
+                # Children rejected by their MBR count as visited and pruned, as in the quadtree
+                visited += len(boxes) - len(hits)
+                pruned += len(boxes) - len(hits)
+                if hits:
+                    within = _all_rows(boxes >= within_limit).tolist()
+                    children = node.children
+                    stack.extend((children[i], within[i]) for i in reversed(hits))
+                continue
+
+            if not len(node.ids):
+                continue
+            if inside:
+                out.append((node, None))
+                continue
+            idx = node.leaf_positions(bounds)
+            if idx is None or idx.size:
+                out.append((node, idx))
+
+        if stats is not None:
+            stats.nodes_visited += visited
+            stats.nodes_pruned += pruned
+            stats.leaves_scanned += len(out) - found_before
+            stats.objects_examined += sum(len(leaf.ids) if idx is None else idx.size
+                                          for leaf, idx in out[found_before:])
+        return out
+
+    def nearest(self, x: float, y: float, k: int = 1, negative_sets=None) -> List[Tuple[float, object, Tuple]]:
+        """
+        Best-first k nearest neighbours of (x, y): nodes and objects share one heap keyed
+        by distance, so the search stops once k objects have been popped. Subtrees and
+        objects excluded by negative_sets (keyword sets, as in range_slices) are skipped.
+        Returns:
+            (distance, obj_id, location) tuples, nearest first
+        """
+        tie = count()
+        heap = [(0.0, next(tie), self, None)]
+        found = []
+        while heap and len(found) < k:
+            distance, _, node, obj = heapq.heappop(heap)
+            if node is None:
+                found.append((distance, obj[0], obj[1]))
+                continue
+            if negative_sets and node.excluded_by(negative_sets):
+                continue
+            if node.children is not None:
+                if not node.children:
+                    continue
+                boxes = node.child_boxes
+                dx = np.maximum(np.maximum(boxes[:, 0] - x, x + boxes[:, 2]), 0.0)
+                dy = np.maximum(np.maximum(boxes[:, 1] - y, y + boxes[:, 3]), 0.0)
+                for child, d in zip(node.children, np.sqrt(dx * dx + dy * dy).tolist()):
+                    heapq.heappush(heap, (d, next(tie), child, None))
+                continue
+            n = len(node.ids)
+            if not n:
+                continue
+            coords = node.coords[:n]
+            distances = np.hypot(coords[:, 0] - x, coords[:, 1] - y)
+            positions = np.argsort(distances, kind='stable').tolist()
+            if negative_sets:
+                keywords = node.keywords
+                positions = [i for i in positions
+                             if all(negative.isdisjoint(keywords[i]) for negative in negative_sets)]
+            # Only the leaf's k nearest can still make the answer
+            for i in positions[:k]:
+                heapq.heappush(heap, (float(distances[i]), next(tie), None,
+                                      (node.ids[i], tuple(coords[i].tolist()))))
+        return found
+
+
+class RTreeIndex(SortedArrayIndex, RTreeNode):
+    """
+    Spatial backend bulk-loaded as a Sort-Tile-Recursive (STR) packed R-tree, for
+    skewed data where midpoint quadtree splits go deep inside dense clusters and leave
+    many empty quadrants elsewhere.
+
+    Objects are stored in flat arrays in STR order and cut into leaves of leaf_size
+    (capacity * RTREE_LEAF_FILL) objects; leaves are then grouped fanout at a time, again in STR order of
+    their centres, until one level fits under the root. Every node's bounds are the MBR
+    of its objects, so empty space is never visited, and all leaves sit at the same
+    depth. The index is its own root node and serves queries through the QuadtreeNode
+    node protocol (keyword summaries, Bloom filters and min_distance on MBRs), so every
+    query processor works unchanged. Between rebuilds, recent inserts wait in a delta
+    leaf (see SortedArrayIndex).
+
+    Attributes
+    ----------
+    fanout : int
+        Children per inner node.
+    leaf_size : int
+        Objects per packed leaf.
+    sorted_ids, sorted_coords, sorted_keywords : numpy.ndarray
+        Object ids, (n, 2) locations and keyword dicts in STR order.
+    delta : QuadtreeNode
+        Leaf holding objects inserted since the last rebuild.
+    Methods
+    -------
+    insert(obj_id, location, keywords):
+        Adds an object to the delta leaf, re-packing the tree once the delta grows past
+        half its size.
+    flush():
+        Merges the delta leaf into the packed tree.
+    range_slices(bounds, negative_sets=None, positive_masks=None, stats=None):
+        As QuadtreeNode.range_slices, over packed child MBRs.
+    nearest(x, y, k=1, negative_sets=None):
+        Best-first k nearest neighbours.
+    """
+    __slots__ = ('fanout', 'leaf_size') + SORTED_ARRAY_SLOTS
+
+    def __init__(self, bounds: Tuple[float, float, float, float], capacity: int = DEFAULT_CAPACITY,
+                 bloom_params: Optional[KeywordBloom] = None, fanout: int = RTREE_FANOUT):
+        super().__init__(bounds, capacity, bloom_params)
+        self.fanout = fanout
+        self.leaf_size = max(1, int(capacity * RTREE_LEAF_FILL))
+
+    def _order(self, coords: np.ndarray, n_new: int) -> np.ndarray:
+        return str_order(coords, self.leaf_size)
+
+    def _rebuild_tree(self) -> None:
+        n = len(self.sorted_ids)
+        level = [self._leaf(lo, min(lo + self.leaf_size, n)) for lo in range(0, n, self.leaf_size)]
+        while len(level) > self.fanout:
+            level = self._pack(level)
+        self._set_children(level + ([self.delta] if self.delta.ids else []))
+        self.ids, self.keywords = [], []
+        self._rebuild_summary()
+
+    def _new_node(self) -> RTreeNode:
+        node = RTreeNode.__new__(RTreeNode)
+        QuadtreeNode.__init__(node, None, self.capacity, self.bloom_params)
+        node.lo = node.hi = None
+        node.child_boxes = None
+        return node
+
+    def _leaf(self, lo: int, hi: int) -> RTreeNode:
+        leaf = self._new_node()
+        leaf.lo, leaf.hi = lo, hi
+        self._attach(leaf)
+        coords = leaf.coords
+        leaf.bounds = (float(coords[:, 0].min()), float(coords[:, 1].min()),
+                       float(coords[:, 0].max()), float(coords[:, 1].max()))
+        leaf._rebuild_summary()
+        return leaf
+
+    def _pack(self, nodes: List[RTreeNode]) -> List[RTreeNode]:
+        # One level up: STR over the node centres, fanout nodes per parent
+        mbrs = np.array([node.bounds for node in nodes], dtype=np.float64)
+        centres = np.column_stack([(mbrs[:, 0] + mbrs[:, 2]) / 2, (mbrs[:, 1] + mbrs[:, 3]) / 2])
+        order = str_order(centres, self.fanout)
+        parents = []
+        for start in range(0, len(nodes), self.fanout):
+            group = order[start:start + self.fanout]
+            parent = self._new_node()
+            parent.children = [nodes[i] for i in group.tolist()]
+            boxes = mbrs[group]
+            parent.child_boxes = pack_boxes(boxes)
+            parent.bounds = (float(boxes[:, 0].min()), float(boxes[:, 1].min()),
+                             float(boxes[:, 2].max()), float(boxes[:, 3].max()))
+            parent._rebuild_summary()
+            parents.append(parent)
+        return parents
@@ -0,0 +1,133 @@
+import sys
+from typing import List, Tuple
+
+import numpy as np
+
+from models.quadtree import QuadtreeNode
+
+# Slots of the flat arrays behind a SortedArrayIndex, declared by each concrete index class
+SORTED_ARRAY_SLOTS = ('sorted_ids', 'sorted_coords', 'sorted_keywords', 'delta')
+
+
+class SortedArrayNode(QuadtreeNode):
+    """
+    Node over a SortedArrayIndex: the contiguous range [lo, hi) of its sorted arrays. A
+    leaf's coords are a view of the index's coordinate array and its ids and keywords
+    are list slices of the matching columns.
+    """
+    __slots__ = ('lo', 'hi')
+
+    def _set_children(self, children: List[QuadtreeNode]) -> None:
+        self.children = children
+
+    def __getstate__(self):
+        # Leaf columns are slices of the index arrays; the index re-attaches them on load
+        slots = [slot for cls in type(self).__mro__ for slot in cls.__dict__.get('__slots__', ())]
+        state = {slot: getattr(self, slot) for slot in slots}
+        state.update(ids=None, coords=None, keywords=None, postings=None)
+        return state
+
+    def __setstate__(self, state):
+        self.packed = None  # Pickled before packed leaves existed
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+
+class SortedArrayIndex:
+    """
+    Insert, merge and persistence logic shared by the spatial backends that keep their
+    objects in flat arrays sorted by a spatial order (MortonIndex, RTreeIndex).
+
+    The index is its own root node. Its children are the nodes built over the sorted
+    arrays by _rebuild_tree plus, between rebuilds, a delta leaf of unsorted recent
+    inserts. A subclass supplies _order, the permutation that sorts the merged arrays,
+    and _rebuild_tree, and declares SORTED_ARRAY_SLOTS among its slots.
+
+    Methods
+    -------
+    insert(obj_id, location, keywords):
+        Adds an object to the delta leaf, merging it into the sorted arrays once it
+        grows past half their size (amortized O(log n) per insert).
+    flush():
+        Merges the delta leaf into the sorted arrays and rebuilds the nodes.
+    """
+    __slots__ = ()
+
+    def __init__(self, bounds: Tuple[float, float, float, float], capacity: int, bloom_params=None):
+        super().__init__(tuple(bounds), capacity, bloom_params)
+        self.lo = self.hi = 0
+        self.sorted_ids = np.empty(0, dtype=object)
+        self.sorted_coords = np.empty((0, 2), dtype=np.float64)
+        self.sorted_keywords = np.empty(0, dtype=object)
+        self.delta = QuadtreeNode(self.bounds, sys.maxsize, bloom_params)
+        self._set_children([])
+
+    def __len__(self) -> int:
+        return len(self.sorted_ids) + len(self.delta.ids)
+
+    def insert(self, obj_id, location, keywords):
+        x, y = location[0], location[1]
+        if not (self.bounds[0] <= x <= self.bounds[2] and self.bounds[1] <= y <= self.bounds[3]):
+            return False
+        delta = self.delta
+        delta.insert(obj_id, location, keywords)
+        self._add_summary(keywords, delta.bloom_params.filter_of(keywords) if delta.bloom_params else 0)
+        if len(delta.ids) == 1:
+            self._set_children(self.children + [delta])
+        if len(delta.ids) > max(self.capacity, len(self.sorted_ids) // 2):
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        """Merge the delta leaf into the sorted arrays and rebuild the nodes"""
+        delta = self.delta
+        n = len(delta.ids)
+        if n == 0:
+            return
+        ids = np.empty(n, dtype=object)
+        ids[:] = delta.ids
+        keywords = np.empty(n, dtype=object)
+        keywords[:] = delta.keywords
+        coords = np.concatenate([self.sorted_coords, delta.coords[:n]])
+        ids = np.concatenate([self.sorted_ids, ids])
+        keywords = np.concatenate([self.sorted_keywords, keywords])
+        order = self._order(coords, n)
+        self.sorted_coords, self.sorted_ids, self.sorted_keywords = coords[order], ids[order], keywords[order]
+        self.delta = QuadtreeNode(self.bounds, sys.maxsize, self.bloom_params)
+        self._rebuild_tree()
+
+    def _order(self, coords: np.ndarray, n_new: int) -> np.ndarray:
+        """Permutation sorting the merged arrays, whose last n_new rows are the delta"""
+        raise NotImplementedError
+
+    def _rebuild_tree(self) -> None:
+        raise NotImplementedError
+
+    def _attach(self, leaf: SortedArrayNode) -> None:
+        # Coordinates stay a view; ids and keywords become lists, which scan faster per item
+        leaf.ids = self.sorted_ids[leaf.lo:leaf.hi].tolist()
+        leaf.coords = self.sorted_coords[leaf.lo:leaf.hi]
+        leaf.keywords = self.sorted_keywords[leaf.lo:leaf.hi].tolist()
+
+    def __getstate__(self):
+        # Sorted arrays plus the node skeleton; leaf views are re-attached on load
+        state = super().__getstate__()
+        state['children'] = None
+        state['top'] = [child for child in self.children if child is not self.delta]
+        return state
+
+    def __setstate__(self, state):
+        top = state.pop('top')
+        if not isinstance(top, list):
+            top = [] if top is None else [top]  # MortonIndex pickles kept a single top node
+        super().__setstate__(state)
+        self.ids, self.keywords = [], []
+        self.coords = np.empty((0, 2), dtype=np.float64)
+        self._set_children(top + ([self.delta] if self.delta.ids else []))
+        stack = list(top)
+        while stack:
+            node = stack.pop()
+            if node.children is None:
+                self._attach(node)
+            else:
+                stack.extend(node.children)
@@ -1,12 +1,23 @@
-from typing import List, Dict, Tuple, Set, Any, Hashable
+from typing import List, Dict, Tuple, Set, Hashable, Optional
 from dataclasses import dataclass
 import numpy as np
 from scipy.cluster.hierarchy import fcluster, linkage
+from models.morton import morton_codes
 from queries.power import POWERQueryProcessor
+from queries.predicate import Predicate, compile_predicate
+from queries.stats import PhaseTimer, QueryStats
+from time import perf_counter_ns
 from collections import Counter, defaultdict
 from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 import heapq
-import json
+
+# Clusters with fewer (candidate, query) pairs are scored by the per-query Python loop
+MIN_THREADED_PAIRS = 50000
+# (candidate, query) pairs scored per block by one thread of the threaded scoring mode
+SCORE_BLOCK_PAIRS = 1 << 18
+EMPTY_POSITIONS = np.empty(0, dtype=np.int32)
+_MISSING = object()
 
 @dataclass
 class SpatialQuery:
@@ -20,6 +31,8 @@ class SpatialQuery:
         negative_keywords (List[str]): List of keywords that should not be present in the results.
         k (int): Number of top results to return.
         lambda_factor (float): Weight factor between spatial and textual relevance.
+        predicate (Predicate): Optional boolean keyword predicate replacing the keyword
+            lists as filter; positive_keywords then holds its non-negated keywords.
     """
     query_id: int
     location: Tuple[float, float]
@@ -27,23 +40,93 @@ class SpatialQuery:
     negative_keywords: List[str]
     k: int
     lambda_factor: float
+    predicate: Optional[Predicate] = None
     
     def __post_init__(self):
         # Convert to sets for faster lookups
         self.positive_set = set(self.positive_keywords)
         self.negative_set = set(self.negative_keywords)
 
+class LeafSlice:
+    """
+    Batch-scoped view of one leaf: the object records of its positions and the posting
+    lists of the keywords looked up so far, each decoded once. Has the get() of a
+    postings mapping, so predicate plans evaluate against it directly.
+    """
+    __slots__ = ('leaf', 'objects', 'postings', 'lists')
+
+    def __init__(self, leaf, objects_table: Dict):
+        self.leaf = leaf
+        self.objects = [objects_table.get(obj_id) for obj_id in leaf.ids]
+        self.postings = None  # The leaf's postings, built for this batch only
+        self.lists: Dict[str, Optional[np.ndarray]] = {}
+
+    def get(self, keyword: str, default=None) -> Optional[np.ndarray]:
+        posting = self.lists.get(keyword, _MISSING)
+        if posting is _MISSING:
+            if self.postings is None:
+                self.postings = self.leaf.keyword_postings(cache=False)
+            posting = self.lists[keyword] = self.postings.get(keyword)
+        return default if posting is None else posting
+
+    def matches(self, positive_keywords, negative_keywords, idx: Optional[np.ndarray]) -> np.ndarray:
+        """Sorted positions (restricted to idx) carrying a positive keyword and no negative one"""
+        lists = [posting for posting in map(self.get, positive_keywords) if posting is not None]
+        if not lists:
+            return EMPTY_POSITIONS
+        positions = lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+        for posting in map(self.get, negative_keywords):
+            if posting is not None:
+                positions = np.setdiff1d(positions, posting, assume_unique=True)
+        if idx is not None:
+            positions = np.intersect1d(positions, idx, assume_unique=True)
+        return positions
+
+
 class BatchPOWERQueryProcessor(POWERQueryProcessor):
     """
     Extension of POWERQueryProcessor for batch processing of queries
     using Grouped Query Batching (GQB) approach - optimized for performance
+
+    With score_threads > 1, large clusters are scored in a threaded mode: the shared
+    candidates become column arrays (locations, and keyword weights and presence over
+    the cluster's keywords), and blocks of candidates are scored against all queries
+    at once with NumPy kernels, which release the GIL, on a pool of score_threads
+    threads. Each block keeps its own top-k per query and the blocks' top-k lists are
+    merged, so one huge cluster, which a process pool cannot split, uses every core.
+    close() (or leaving a with block) shuts the pool down; it is recreated if the
+    processor scores another threaded cluster.
+
+    Within one process_batch_queries call, clusters run in Z-order of their centres,
+    so neighbouring clusters follow each other, and share a cache of LeafSlice
+    entries (leaf_slices): each leaf's object records are looked up and each of its
+    posting lists decoded at most once per batch, and a cluster filters its candidates
+    from posting lists instead of rescanning the leaf's objects. The cache is dropped
+    when the batch ends.
     """
-    def __init__(self, teq_index, location_threshold: float = 10.0, keyword_similarity_threshold: float = 0.5):
-        super().__init__(teq_index)
+    def __init__(self, teq_index, location_threshold: float = 10.0, keyword_similarity_threshold: float = 0.5,
+                 use_bloom: bool = False, metrics=None, score_threads: int = 1):
+        super().__init__(teq_index, metrics)
         self.location_threshold = location_threshold
         self.keyword_similarity_threshold = keyword_similarity_threshold
-        # Cache for object keywords to avoid repeated dictionary lookups
-        self.keyword_cache = {}
+        # Skip subtrees whose keyword Bloom filter holds none of a cluster's positive keywords
+        self.use_bloom = use_bloom
+        self.score_threads = score_threads
+        self._score_pool = None  # Created on the first threaded cluster
+        # id(leaf) -> LeafSlice of the batch being processed, emptied after every batch
+        self.leaf_slices: Dict[int, LeafSlice] = {}
+
+    def close(self) -> None:
+        """Shut down the scoring thread pool"""
+        if self._score_pool is not None:
+            self._score_pool.shutdown()
+            self._score_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def _calculate_keyword_similarity(self, set1: Set[str], set2: Set[str]) -> float:
         """Calculate Jaccard similarity between two keyword sets (optimized)"""
@@ -257,76 +340,70 @@ class BatchPOWERQueryProcessor(POWERQueryProcessor):
         
         return (bounds, list(unified_positive_keywords), list(common_negative_keywords))
 
-    def _get_hashable_key(self, obj_id: Any) -> str:
-        """
-        Convert any object ID to a hashable string representation
-        This is a more robust solution that handles nested unhashable types
-        """
-        try:
-            # If already hashable, use its string representation
-            hash(obj_id)
-            return str(obj_id)
-        except TypeError:
-            # For unhashable types, use JSON serialization to get a string
-            try:
-                return json.dumps(obj_id, sort_keys=True)
-            except (TypeError, ValueError):
-                # If JSON serialization fails, use string representation with type
-                return f"{type(obj_id).__name__}_{id(obj_id)}"
-
-    def _process_cluster(self, queries: List[SpatialQuery]) -> Dict[int, List[Tuple]]:
+    def _leaf_slice(self, leaf) -> LeafSlice:
+        # The batch's cached slice of leaf, created on first use
+        entry = self.leaf_slices.get(id(leaf))
+        if entry is None:
+            entry = self.leaf_slices[id(leaf)] = LeafSlice(leaf, self.teq_index.objects)
+        return entry
+
+    def _process_cluster(self, queries: List[SpatialQuery], stats=None) -> Dict[int, List[Tuple]]:
         """Process all queries in a cluster efficiently (optimized)"""
         # Fast path for single query
         if len(queries) == 1:
             query = queries[0]
-            results = {}
-            results[query.query_id] = self.process_query(
+            rows = self._process_query(
                 query.location,
                 query.positive_keywords,
                 query.negative_keywords,
                 query.k,
-                query.lambda_factor
+                query.lambda_factor,
+                stats=stats,
+                predicate=query.predicate
             )
-            return results
+            # process_query ranks by negated score; batch results carry the score itself
+            return {query.query_id: [(-row[0],) + tuple(row[1:]) for row in rows]}
+        
+        if any(query.predicate is not None for query in queries):
+            return self._process_predicate_cluster(queries, stats)
+        
+        timer = PhaseTimer(stats, self.hooks) if stats is not None else None
         
         # Get unified query parameters
         bounds, unified_positive_keywords, unified_negative_keywords = self._get_unified_query_parameters(queries)
         unified_positive_set = set(unified_positive_keywords)
         unified_negative_set = set(unified_negative_keywords)
         
-        # Get all candidates in the expanded area
-        found_objects = []
-        self.teq_index.spatial_index.query_range(bounds, found_objects)
+        # Get all candidates in the expanded area. A subtree can be skipped when,
+        # for every query in the cluster, all its objects carry one of that query's
+        # negative keywords.
+        negative_sets = [query.negative_set for query in queries]
+        if not all(negative_sets):
+            negative_sets = None
+        positive_masks = self.teq_index.bloom_masks(unified_positive_set) if self.use_bloom else None
+        slices = self.teq_index.spatial_index.range_slices(bounds, negative_sets=negative_sets,
+                                                           positive_masks=positive_masks, stats=stats)
+        if timer is not None:
+            timer.lap('range_query')
         
-        # Efficient pre-filtering using sets
+        # Pre-filter each leaf from the posting lists of the unified keywords
         candidates = {}
-        for obj_id in found_objects:
-            # Create a string key for the cache
-            cache_key = self._get_hashable_key(obj_id)
-            
-            # Get object and cache its keywords
-            if cache_key not in self.keyword_cache:
-                try:
-                    obj = self.teq_index.objects[obj_id]
-                    self.keyword_cache[cache_key] = {
-                        'obj': obj,
-                        'keywords': set(obj['keywords'])
-                    }
-                except (KeyError, TypeError) as e:
-                    # Skip this object if we can't access it
-                    continue
-                    
-            cached_data = self.keyword_cache[cache_key]
-            obj = cached_data['obj']
-            obj_keywords = cached_data['keywords']
-            
-            # Skip objects with unified negative keywords
-            if any(kw in obj_keywords for kw in unified_negative_set):
-                continue
-                
-            # Include objects with at least one unified positive keyword
-            if any(kw in obj_keywords for kw in unified_positive_set):
-                candidates[obj_id] = obj
+        cached_before = len(self.leaf_slices)
+        for leaf, idx in slices:
+            entry = self._leaf_slice(leaf)
+            ids, objects = leaf.ids, entry.objects
+            for position in entry.matches(unified_positive_set, unified_negative_set, idx).tolist():
+                obj = objects[position]
+                if obj is not None:
+                    candidates[ids[position]] = obj
+        
+        if timer is not None:
+            cache_misses = len(self.leaf_slices) - cached_before
+            stats.candidates += len(candidates)
+            stats.cache_hits += len(slices) - cache_misses
+            stats.cache_misses += cache_misses
+            stats.queries += len(queries)
+            timer.lap('prefilter')
         
         # Early exit if no candidates found
         if not candidates:
@@ -334,44 +411,205 @@ class BatchPOWERQueryProcessor(POWERQueryProcessor):
         
         # Process each query using shared candidates
         results = {}
-        for query in queries:
-            # Use a heap for efficient top-k tracking
-            top_k_heap = []
+        scored = heap_ops = 0
+        if self.score_threads > 1 and len(candidates) * len(queries) >= MIN_THREADED_PAIRS:
+            results, scored = self._score_cluster_threaded(queries, candidates)
+        else:
+            for query in queries:
+                # Use a heap for efficient top-k tracking
+                top_k_heap = []
             
-            # Query-specific filtering
-            for obj_id, obj in candidates.items():
-                # Get cached keywords using cache key
-                cache_key = self._get_hashable_key(obj_id)
+                # Query-specific filtering
+                for obj_id, obj in candidates.items():
+                    obj_keywords = obj['keywords']
                 
-                # Skip if not in cache (should not happen, but just in case)
-                if cache_key not in self.keyword_cache:
-                    continue
-                    
-                obj_keywords = self.keyword_cache[cache_key]['keywords']
+                    # Skip objects with query-specific negative keywords
+                    if any(kw in obj_keywords for kw in query.negative_set):
+                        continue
                 
-                # Skip objects with query-specific negative keywords
-                if any(kw in obj_keywords for kw in query.negative_set):
+                    # Only include if it has at least one of the query's positive keywords
+                    if any(kw in obj_keywords for kw in query.positive_set):
+                        spatial_score = 1 - self.compute_distance(query.location, obj['location']) / 100
+                        textual_score = self.keyword_relevance(obj_keywords, query.positive_keywords)
+                        combined_score = query.lambda_factor * spatial_score + (1 - query.lambda_factor) * textual_score
+                        scored += 1
+                    
+                        # Use a min-heap to keep track of top-k results efficiently
+                        if len(top_k_heap) < query.k:
+                            heapq.heappush(top_k_heap, (combined_score, obj_id))
+                            heap_ops += 1
+                        elif combined_score > top_k_heap[0][0]:
+                            heapq.heappushpop(top_k_heap, (combined_score, obj_id))
+                            heap_ops += 1
+            
+                # Convert heap to sorted list of results
+                results[query.query_id] = sorted(top_k_heap, key=lambda x: -x[0])
+        
+        if timer is not None:
+            stats.objects_scored += scored
+            stats.heap_ops += heap_ops
+            timer.lap('scoring')
+        
+        # Fetch texts for the winners only
+        for query_id, top_k_results in results.items():
+            results[query_id] = self.teq_index.materialize(top_k_results)
+        
+        if timer is not None:
+            stats.results += sum(len(rows) for rows in results.values())
+            timer.lap('materialize')
+        return results
+
+    def _score_block(self, block: slice, coords: np.ndarray, weights: np.ndarray, presence: np.ndarray,
+                     columns: Tuple[np.ndarray, ...], k_max: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        # Scores of one block of candidates against every query: (candidate, query) arrays
+        x, y, lambdas, positive_counts, positive_hits, negative_hits = columns
+        dx = coords[block, 0, None] - x
+        dy = coords[block, 1, None] - y
+        spatial = 1 - np.sqrt(dx * dx + dy * dy) / 100
+        textual = weights[block] @ positive_counts
+        scores = lambdas * spatial + (1 - lambdas) * textual
+        valid = (presence[block] @ positive_hits) > 0
+        if negative_hits is not None:
+            valid &= (presence[block] @ negative_hits) == 0
+        scores[~valid] = -np.inf
+        # The block's own top-k per query (column); the merge picks the final top-k
+        if len(scores) <= k_max:
+            rows = np.broadcast_to(np.arange(len(scores))[:, None], scores.shape)
+        else:
+            rows = np.argpartition(-scores, k_max - 1, axis=0)[:k_max]
+            scores = np.take_along_axis(scores, rows, axis=0)
+        return rows + block.start, scores, int(np.count_nonzero(valid))
+
+    def _score_cluster_threaded(self, queries: List[SpatialQuery], candidates: Dict) -> Tuple[Dict, int]:
+        """
+        Score the shared candidates of a cluster against all of its queries with NumPy
+        kernels on the scoring thread pool (see the class docstring).
+        Returns:
+            query_id -> (score, obj_id) pairs best first, and the number of
+            (candidate, query) pairs that passed the keyword filters
+        """
+        ids = list(candidates)
+        coords = np.array([obj['location'] for obj in candidates.values()], dtype=np.float64).reshape(-1, 2)
+
+        # Keyword columns over the keywords the cluster's queries mention
+        vocabulary = {}
+        for query in queries:
+            for keyword in chain(query.positive_keywords, query.negative_keywords):
+                vocabulary.setdefault(keyword, len(vocabulary))
+        weights = np.zeros((len(ids), len(vocabulary)), dtype=np.float64)
+        presence = np.zeros((len(ids), len(vocabulary)), dtype=np.float32)
+        for row, obj in enumerate(candidates.values()):
+            for keyword, weight in obj['keywords'].items():
+                column = vocabulary.get(keyword)
+                if column is not None:
+                    weights[row, column] = weight
+                    presence[row, column] = 1
+
+        # Query columns: a keyword repeated in positive_keywords counts repeatedly, as in keyword_relevance
+        positive_counts = np.zeros((len(vocabulary), len(queries)), dtype=np.float64)
+        negative_hits = np.zeros((len(vocabulary), len(queries)), dtype=np.float32)
+        for column, query in enumerate(queries):
+            for keyword in query.positive_keywords:
+                positive_counts[vocabulary[keyword], column] += 1
+            for keyword in query.negative_set:
+                negative_hits[vocabulary[keyword], column] = 1
+        columns = (np.array([query.location[0] for query in queries], dtype=np.float64),
+                   np.array([query.location[1] for query in queries], dtype=np.float64),
+                   np.array([query.lambda_factor for query in queries], dtype=np.float64),
+                   positive_counts, (positive_counts > 0).astype(np.float32),
+                   negative_hits if negative_hits.any() else None)
+
+        k_max = max(query.k for query in queries)
+        step = max(k_max, SCORE_BLOCK_PAIRS // len(queries))
+        blocks = [slice(start, min(start + step, len(ids))) for start in range(0, len(ids), step)]
+        if self._score_pool is None:
+            self._score_pool = ThreadPoolExecutor(max_workers=self.score_threads,
+                                                  thread_name_prefix='batch-score')
+        parts = list(self._score_pool.map(
+            lambda block: self._score_block(block, coords, weights, presence, columns, k_max), blocks))
+
+        rows = np.concatenate([part[0] for part in parts])
+        scores = np.concatenate([part[1] for part in parts])
+        results = {}
+        for column, query in enumerate(queries):
+            query_scores = scores[:, column]
+            # Best first; equal scores keep candidate order
+            order = np.lexsort((rows[:, column], -query_scores))[:query.k]
+            results[query.query_id] = [(float(query_scores[i]), ids[rows[i, column]]) for i in order.tolist()
+                                       if query_scores[i] > -np.inf]
+        return results, sum(part[2] for part in parts)
+
+    def _process_predicate_cluster(self, queries: List[SpatialQuery], stats=None) -> Dict[int, List[Tuple]]:
+        """
+        Process a cluster holding predicate queries. The cluster's leaves are collected
+        once; each query then runs its posting-list plan on the leaves its predicate can
+        match, restricted to the objects inside the cluster bounds.
+        """
+        timer = PhaseTimer(stats, self.hooks) if stats is not None else None
+        bounds, _, _ = self._get_unified_query_parameters(queries)
+        slices = self.teq_index.spatial_index.range_slices(bounds, stats=stats)
+        plans = [query.predicate if query.predicate is not None
+                 else Predicate.from_keywords(query.positive_keywords, query.negative_keywords)
+                 for query in queries]
+        if timer is not None:
+            stats.queries += len(queries)
+            timer.lap('range_query')
+
+        results = {}
+        candidates = heap_ops = 0
+        for query, plan in zip(queries, plans):
+            top_k_heap = []
+            x, y = query.location
+            for leaf, idx in slices:
+                if not plan.possible(leaf):
                     continue
-                
-                # Only include if it has at least one of the query's positive keywords
-                if any(kw in obj_keywords for kw in query.positive_set):
-                    spatial_score = 1 - self.compute_distance(query.location, obj['location']) / 100
-                    textual_score = sum(1 for kw in query.positive_keywords if kw in obj_keywords)
+                universe = np.arange(len(leaf.ids), dtype=np.int32) if idx is None else idx
+                positions = plan.evaluate(self._leaf_slice(leaf), universe)
+                if positions.size == 0:
+                    continue
+                if leaf.packed is not None:
+                    # Textual scores straight from the posting lists of the query keywords
+                    positions, textual_scores = leaf.packed.match(query.positive_keywords, (), positions, False)
+                    textual_scores = textual_scores.tolist()
+                else:
+                    textual_scores = None
+                    leaf_keywords = leaf.scan_keywords()
+                coords = leaf.scan_coords(positions)
+                dx = coords[:, 0] - x
+                dy = coords[:, 1] - y
+                spatial_scores = 1 - np.sqrt(dx * dx + dy * dy) / 100
+                candidates += positions.size
+                ids = leaf.ids
+                for i, (position, spatial_score) in enumerate(zip(positions.tolist(), spatial_scores.tolist())):
+                    if textual_scores is None:
+                        textual_score = self.keyword_relevance(leaf_keywords[position], query.positive_keywords)
+                    else:
+                        textual_score = textual_scores[i]
                     combined_score = query.lambda_factor * spatial_score + (1 - query.lambda_factor) * textual_score
-                    
-                    # Use a min-heap to keep track of top-k results efficiently
                     if len(top_k_heap) < query.k:
-                        heapq.heappush(top_k_heap, (combined_score, obj_id, obj['location'], obj['full_text']))
+                        heapq.heappush(top_k_heap, (combined_score, ids[position]))
+                        heap_ops += 1
                     elif combined_score > top_k_heap[0][0]:
-                        heapq.heappushpop(top_k_heap, (combined_score, obj_id, obj['location'], obj['full_text']))
-            
-            # Convert heap to sorted list of results
-            top_k_results = sorted(top_k_heap, key=lambda x: -x[0])
-            results[query.query_id] = top_k_results
-            
+                        heapq.heappushpop(top_k_heap, (combined_score, ids[position]))
+                        heap_ops += 1
+            results[query.query_id] = sorted(top_k_heap, key=lambda x: -x[0])
+
+        if timer is not None:
+            stats.candidates += candidates
+            stats.objects_scored += candidates
+            stats.heap_ops += heap_ops
+            timer.lap('scoring')
+
+        for query_id, top_k_results in results.items():
+            results[query_id] = self.teq_index.materialize(top_k_results)
+
+        if timer is not None:
+            stats.results += sum(len(rows) for rows in results.values())
+            timer.lap('materialize')
         return results
 
-    def process_batch_queries(self, queries: List[Dict], max_cluster_size: int = None) -> Dict[int, List[Tuple]]:
+    def process_batch_queries(self, queries: List[Dict], max_cluster_size: int = None,
+                              stats=None) -> Dict[int, List[Tuple]]:
         """
         Process multiple queries efficiently using optimized Grouped Query Batching (GQB)
         
@@ -383,53 +621,80 @@ class BatchPOWERQueryProcessor(POWERQueryProcessor):
                         'positive_keywords': list of keywords,
                         'negative_keywords': list of keywords,
                         'k': int,
-                        'lambda_factor': float
+                        'lambda_factor': float,
+                        'predicate': optional boolean keyword expression, e.g.
+                                     "(cafe OR bar) AND wifi AND NOT closed"; when given
+                                     it replaces the keyword lists
                     }
             max_cluster_size: Optional maximum number of queries per cluster.
                              Controls how queries are grouped for batch processing.
+            stats: Optional queries.stats.QueryStats accumulating counters and phase
+                   times over the whole batch
         
         Returns:
             Dictionary mapping query_id to results
         """
+        if self.metrics is None or not queries:
+            return self._process_batch_queries(queries, max_cluster_size, stats)
+        start = perf_counter_ns()
+        batch_stats = QueryStats()
+        results = self._process_batch_queries(queries, max_cluster_size, batch_stats)
+        self.metrics.observe_batch(len(queries), perf_counter_ns() - start, batch_stats)
+        if stats is not None:
+            stats.merge(batch_stats)
+        return results
+
+    @staticmethod
+    def _to_spatial_query(q: Dict, i: int) -> SpatialQuery:
+        predicate = q.get('predicate')
+        if predicate is not None:
+            # The predicate's non-negated keywords drive clustering and scoring
+            predicate = compile_predicate(predicate)
+            return SpatialQuery(query_id=q.get('query_id', i), location=q['location'],
+                                positive_keywords=predicate.positive_terms(), negative_keywords=[],
+                                k=q['k'], lambda_factor=q['lambda_factor'], predicate=predicate)
+        return SpatialQuery(
+            query_id=q.get('query_id', i),
+            location=q['location'],
+            positive_keywords=q['positive_keywords'],
+            negative_keywords=q['negative_keywords'],
+            k=q['k'],
+            lambda_factor=q['lambda_factor']
+        )
+
+    def _process_batch_queries(self, queries: List[Dict], max_cluster_size, stats) -> Dict[int, List[Tuple]]:
         # Early exit for empty queries
         if not queries:
             return {}
             
-        # Fast path for single query
-        if len(queries) == 1:
-            q = queries[0]
-            query_id = q.get('query_id', 0)
-            results = self.process_query(
-                q['location'],
-                q['positive_keywords'],
-                q['negative_keywords'],
-                q['k'],
-                q['lambda_factor']
-            )
-            return {query_id: results}
-        
         # Convert queries to SpatialQuery objects
-        spatial_queries = [
-            SpatialQuery(
-                query_id=q.get('query_id', i),
-                location=q['location'],
-                positive_keywords=q['positive_keywords'],
-                negative_keywords=q['negative_keywords'],
-                k=q['k'],
-                lambda_factor=q['lambda_factor']
-            )
-            for i, q in enumerate(queries)
-        ]
+        spatial_queries = [self._to_spatial_query(q, i) for i, q in enumerate(queries)]
+        
+        # Fast path for single query
+        if len(spatial_queries) == 1:
+            return self._process_cluster(spatial_queries, stats)
         
         # Group queries by both spatial proximity and keyword similarity
+        timer = PhaseTimer(stats, self.hooks) if stats is not None else None
         grouped_queries = self._group_queries(spatial_queries, max_cluster_size)
+        if timer is not None:
+            stats.clusters += len(grouped_queries)
+            timer.lap('grouping')
+        if self.metrics is not None:
+            self.metrics.observe_clusters(grouped_queries.values())
         
-        # Process each group with a unified query plan
+        # Visit clusters in Z-order of their centres so clusters sharing leaves run
+        # back to back, then drop the batch's leaf slices
+        groups = list(grouped_queries.values())
+        centres = np.array([np.mean([query.location for query in group], axis=0) for group in groups],
+                           dtype=np.float64).reshape(-1, 2)
+        order = np.argsort(morton_codes(centres, self.teq_index.spatial_index.bounds), kind='stable')
         all_results = {}
-        for _, group_queries in grouped_queries.items():
-            group_results = self._process_cluster(group_queries)
-            all_results.update(group_results)
-            
+        try:
+            for i in order.tolist():
+                all_results.update(self._process_cluster(groups[i], stats))
+        finally:
+            self.leaf_slices.clear()
         return all_results
 
 def create_batch_queries(locations: List[Tuple[float, float]], 
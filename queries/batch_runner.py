@@ -0,0 +1,191 @@
+import json
+import os
+import time
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from benchmark.workload import iter_query_log_from
+from models.morton import morton_codes
+
+# Record layout of binary result files, one record per result row
+RESULT_DTYPE = np.dtype([('query_id', '<i8'), ('rank', '<i4'), ('obj_id', '<i8'), ('score', '<f8')])
+OUTPUT_FORMATS = ('jsonl', 'binary')
+
+
+def load_binary_results(path: str) -> np.ndarray:
+    """Memory-map a binary result file as RESULT_DTYPE records"""
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=RESULT_DTYPE)
+    return np.memmap(path, dtype=RESULT_DTYPE, mode='r')
+
+
+class BatchJob:
+    """
+    Out-of-core batch run of a query file through a BatchPOWERQueryProcessor.
+
+    The query file (JSONL or the generated_queries.txt text format) is streamed in
+    chunks of chunk_size queries. Each chunk is sorted by the Z-order key of its query
+    locations and cut into batches of batch_size neighbouring queries, so every
+    process_batch_queries call clusters a small, spatially compact set. Results are
+    appended to the output file as soon as a batch is done, and memory stays bounded
+    by one chunk.
+
+    After every chunk the output is flushed to disk and a checkpoint (input offset,
+    output size, counters) is written next to it, atomically. A job that is interrupted
+    resumes from the last checkpoint: the output is truncated to the checkpointed size
+    and reading restarts at the checkpointed input offset.
+
+    Binary output stores query ids as int64, so each chunk's ids are checked before
+    any of its results are written; a non-integer id stops the job with a ValueError
+    and leaves the output at the last checkpoint.
+
+    Attributes
+    ----------
+    checkpoint_path : str
+        Checkpoint file, output_path + '.ckpt' by default.
+    Methods
+    -------
+    run(resume=True, max_chunks=None):
+        Processes the remaining chunks (at most max_chunks) and returns the checkpoint.
+    """
+
+    def __init__(self, processor, input_path: str, output_path: str, chunk_size: int = 100000,
+                 batch_size: int = 1000, max_cluster_size: Optional[int] = None, output_format: str = 'jsonl',
+                 n_neg: int = 0, checkpoint_path: Optional[str] = None):
+        """
+        Args:
+            processor: BatchPOWERQueryProcessor over the index
+            input_path: Query file
+            output_path: JSONL results ({"query_id", "results": [{score, obj_id, location, text}]})
+                         or binary RESULT_DTYPE records
+            chunk_size: Queries read, sorted and checkpointed together
+            batch_size: Queries per process_batch_queries call
+            n_neg: Trailing negative keywords per line of a text query file
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+        self.processor = processor
+        self.input_path = input_path
+        self.output_path = output_path
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_cluster_size = max_cluster_size
+        self.output_format = output_format
+        self.n_neg = n_neg
+        self.checkpoint_path = checkpoint_path or output_path + '.ckpt'
+
+    def _fresh_checkpoint(self) -> Dict:
+        return {'input': os.path.abspath(self.input_path), 'format': self.output_format,
+                'input_offset': 0, 'line_no': 0, 'output_offset': 0, 'queries': 0, 'results': 0,
+                'chunks': 0, 'elapsed_s': 0.0, 'complete': False}
+
+    def _load_checkpoint(self, resume: bool) -> Dict:
+        if resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+            if checkpoint['input'] != os.path.abspath(self.input_path) or checkpoint['format'] != self.output_format:
+                raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to another job; "
+                                 f"remove it or run without resume")
+            return checkpoint
+        return self._fresh_checkpoint()
+
+    def _save_checkpoint(self, checkpoint: Dict) -> None:
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _chunks(self, checkpoint: Dict) -> Iterator[Tuple[List[Dict], int, int]]:
+        # (queries, input offset after the chunk, line number after the chunk)
+        reader = iter_query_log_from(self.input_path, self.n_neg, checkpoint['input_offset'], checkpoint['line_no'])
+        while True:
+            chunk = list(islice(reader, self.chunk_size))
+            if not chunk:
+                return
+            _, offset, line_no = chunk[-1]
+            yield [query for query, _, _ in chunk], offset, line_no
+
+    def _check_ids(self, queries: List[Dict]) -> None:
+        # Binary records hold query_id as int64; refuse a chunk before any of it is written
+        if self.output_format != 'binary':
+            return
+        limits = np.iinfo(np.int64)
+        for query in queries:
+            query_id = query['query_id']
+            if isinstance(query_id, bool) or not isinstance(query_id, (int, np.integer)) \
+                    or not limits.min <= query_id <= limits.max:
+                raise ValueError(f"{self.input_path}: query_id {query_id!r} is not a 64-bit "
+                                 f"integer, which binary output requires; use output_format='jsonl'")
+
+    def _encode(self, results: Dict) -> bytes:
+        if self.output_format == 'jsonl':
+            lines = []
+            for query_id, rows in results.items():
+                rows = [{'score': score, 'obj_id': obj_id, 'location': list(location), 'text': text}
+                        for score, obj_id, location, text in rows]
+                lines.append(json.dumps({'query_id': query_id, 'results': rows}) + "\n")
+            return ''.join(lines).encode('utf-8')
+        records = np.empty(sum(len(rows) for rows in results.values()), dtype=RESULT_DTYPE)
+        i = 0
+        for query_id, rows in results.items():
+            for rank, row in enumerate(rows):
+                records[i] = (query_id, rank, row[1], row[0])
+                i += 1
+        return records.tobytes()
+
+    def run(self, resume: bool = True, max_chunks: Optional[int] = None) -> Dict:
+        """
+        Run (or resume) the job
+        Args:
+            resume: Continue from an existing checkpoint instead of starting over
+            max_chunks: Stop after this many chunks (the job can be resumed later)
+        Returns:
+            The checkpoint: counters, offsets and whether the whole file was processed
+        """
+        try:
+            return self._run(resume, max_chunks)
+        finally:
+            self.processor.close()  # Stop the scoring threads between runs
+
+    def _run(self, resume: bool, max_chunks: Optional[int]) -> Dict:
+        checkpoint = self._load_checkpoint(resume)
+        if checkpoint['complete']:
+            return checkpoint
+        bounds = self.processor.teq_index.spatial_index.bounds
+        mode = 'r+b' if os.path.exists(self.output_path) and checkpoint['output_offset'] else 'wb'
+        with open(self.output_path, mode) as out:
+            out.truncate(checkpoint['output_offset'])  # Drop output written after the checkpoint
+            out.seek(checkpoint['output_offset'])
+            done = 0
+            for queries, offset, line_no in self._chunks(checkpoint):
+                self._check_ids(queries)
+                start = time.perf_counter()
+                order = np.argsort(morton_codes(np.array([q['location'] for q in queries], dtype=np.float64),
+                                                bounds), kind='stable')
+                results = 0
+                for batch_start in range(0, len(order), self.batch_size):
+                    batch = [queries[i] for i in order[batch_start:batch_start + self.batch_size]]
+                    batch_results = self.processor.process_batch_queries(batch, self.max_cluster_size)
+                    out.write(self._encode(batch_results))
+                    results += sum(len(rows) for rows in batch_results.values())
+                out.flush()
+                os.fsync(out.fileno())
+
+                checkpoint.update(input_offset=offset, line_no=line_no, output_offset=out.tell(),
+                                  queries=checkpoint['queries'] + len(queries),
+                                  results=checkpoint['results'] + results, chunks=checkpoint['chunks'] + 1,
+                                  elapsed_s=checkpoint['elapsed_s'] + time.perf_counter() - start)
+                self._save_checkpoint(checkpoint)
+                done += 1
+                print(f"Chunk {checkpoint['chunks']}: {checkpoint['queries']:,} queries done "
+                      f"({len(queries) / (time.perf_counter() - start):,.0f} queries/s)")
+                if max_chunks is not None and done >= max_chunks:
+                    break
+            else:
+                checkpoint['complete'] = True
+                self._save_checkpoint(checkpoint)
+        return checkpoint
@@ -0,0 +1,260 @@
+from dataclasses import dataclass
+from itertools import count
+from math import hypot
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class SafeRegion:
+    """
+    Disc around a location inside which a continuous query's top-k cannot change.
+
+    Attributes:
+        center (tuple): Location the region was computed for.
+        radius (float): Any location closer than radius to center has the same results.
+    """
+    center: Tuple[float, float]
+    radius: float
+
+    def contains(self, location) -> bool:
+        return hypot(location[0] - self.center[0], location[1] - self.center[1]) < self.radius
+
+
+class ContinuousQuery:
+    """
+    A registered moving query and its cached state.
+
+    Attributes
+    ----------
+    query_id : hashable
+        Id given at registration.
+    positive_keywords, negative_keywords, k, lambda_factor, search_radius :
+        Query parameters, as for POWERQueryProcessor.process_query.
+    location : tuple
+        Location of the last update.
+    results : list
+        (-score, obj_id, location, full_text) rows at location, best first.
+    safe_region : SafeRegion
+        Where results stay valid without recomputation.
+    anchor : tuple
+        Centre of the cached candidate box, which extends search_radius + margin around it.
+    margin : float
+        How far the query may move from anchor before the candidates are fetched again.
+    hits, rescored, refetched : int
+        Updates answered from the safe region, re-scored from the cached candidates, and
+        answered with a fresh index search.
+    """
+
+    def __init__(self, query_id: Hashable, location, positive_keywords: List[str], negative_keywords: List[str],
+                 k: int, lambda_factor: float, search_radius: float, margin: float):
+        self.query_id = query_id
+        self.location = tuple(location)
+        self.positive_keywords = list(positive_keywords)
+        self.negative_keywords = list(negative_keywords)
+        self.positive_set = set(positive_keywords)
+        self.negative_set = set(negative_keywords)
+        self.k = k
+        self.lambda_factor = lambda_factor
+        self.search_radius = search_radius
+        self.margin = margin
+        self.anchor = self.location
+        self.results: List[Tuple] = []
+        self.safe_region = SafeRegion(self.location, 0.0)
+        self.hits = self.rescored = self.refetched = 0
+        # Cached candidates: every matching object inside the anchor's candidate box
+        self.ids: List = []
+        self.coords = np.empty((0, 2), dtype=np.float64)
+        self.textual = np.empty(0, dtype=np.float64)
+        self.chosen = np.empty(0, dtype=np.intp)  # Candidate positions of results
+
+    def candidate_box(self) -> Tuple[float, float, float, float]:
+        reach = self.search_radius + self.margin
+        x, y = self.anchor
+        return (x - reach, y - reach, x + reach, y + reach)
+
+    def matches(self, keywords) -> bool:
+        if self.positive_set.isdisjoint(keywords):
+            return False
+        return not (self.negative_set and not self.negative_set.isdisjoint(keywords))
+
+
+class ContinuousQueryProcessor:
+    """
+    Continuous top-k queries for moving clients.
+
+    A registered query keeps every object matching its keywords inside a candidate box
+    (search_radius + margin around an anchor location), with the object's textual score,
+    which does not depend on the location. Each evaluation also yields a safe region: a
+    disc in which the ranked top-k cannot change. The scores of results and competitors
+    move by at most lambda_factor * distance / 100, so the disc is bounded by the score gaps
+    between consecutive results and between the k-th result and every competitor
+    (one outside the search box also has to reach it), by how far each result is from
+    leaving the search box, and by the margin left before the search box leaves the
+    candidate box.
+
+    update(query_id, location) then only re-scores the k results inside the safe region,
+    re-scores all cached candidates while the search box stays inside the candidate box, and searches
+    the index again (re-anchoring) only beyond that. Objects added to the index are
+    matched against the candidate boxes through an insert hook; only the queries whose
+    box holds a new matching object fetch their candidates again and are re-scored at
+    their current location.
+
+    Results equal POWERQueryProcessor.process_query at the same location.
+
+    Methods
+    -------
+    register(location, positive_keywords, negative_keywords, k, lambda_factor=0.5, search_radius=10,
+             margin=None, query_id=None):
+        Registers a moving query and returns it with its results and safe region.
+    update(query_id, location):
+        Moves a query; returns (results, safe_region).
+    unregister(query_id), close():
+        Drop one query; drop all of them and detach from the index.
+    """
+
+    def __init__(self, teq_index, default_margin: float = 0.5):
+        """
+        Args:
+            teq_index: The TEQIndex to query
+            default_margin: Margin of queries registered without one, as a fraction of
+                            their search_radius
+        """
+        self.teq_index = teq_index
+        self.default_margin = default_margin
+        self.queries: Dict[Hashable, ContinuousQuery] = {}
+        self._ids = count()
+        teq_index.add_insert_hook(self._on_insert)
+
+    def register(self, location, positive_keywords, negative_keywords, k, lambda_factor=0.5, search_radius=10,
+                 margin: Optional[float] = None, query_id: Optional[Hashable] = None) -> ContinuousQuery:
+        if query_id is None:
+            query_id = next(self._ids)
+        if margin is None:
+            margin = self.default_margin * search_radius
+        query = ContinuousQuery(query_id, location, positive_keywords, negative_keywords, k, lambda_factor,
+                                search_radius, margin)
+        self.queries[query_id] = query
+        self._fetch(query)
+        self._evaluate(query)
+        return query
+
+    def update(self, query_id: Hashable, location) -> Tuple[List[Tuple], SafeRegion]:
+        query = self.queries[query_id]
+        query.location = tuple(location)
+        if query.safe_region.contains(location):
+            query.hits += 1
+            query.results = self._rescore_results(query)
+            return query.results, query.safe_region
+        x, y = location
+        if max(abs(x - query.anchor[0]), abs(y - query.anchor[1])) <= query.margin:
+            query.rescored += 1
+        else:
+            query.refetched += 1
+            query.anchor = query.location
+            self._fetch(query)
+        self._evaluate(query)
+        return query.results, query.safe_region
+
+    def unregister(self, query_id: Hashable) -> None:
+        self.queries.pop(query_id, None)
+
+    def close(self) -> None:
+        self.queries.clear()
+        self.teq_index.remove_insert_hook(self._on_insert)
+
+    def _fetch(self, query: ContinuousQuery) -> None:
+        # Matching objects in the candidate box and their textual scores
+        index = self.teq_index
+        if index._batch_buffer:
+            index._flush_buffer()
+        negative_sets = [query.negative_set] if query.negative_set else None
+        ids, coords, textual = [], [], []
+        for leaf, idx in index.spatial_index.range_slices(query.candidate_box(), negative_sets=negative_sets):
+            if leaf.packed is not None:
+                positions, scores = leaf.packed.match(query.positive_keywords, query.negative_set, idx)
+                textual.extend(scores.tolist())
+            else:
+                leaf_keywords = leaf.scan_keywords()
+                positions = [position for position in (range(len(leaf.ids)) if idx is None else idx.tolist())
+                             if query.matches(leaf_keywords[position])]
+                textual.extend(sum(leaf_keywords[position][word] for word in query.positive_keywords
+                                   if word in leaf_keywords[position]) for position in positions)
+            if len(positions):
+                leaf_ids = leaf.ids
+                ids.extend(leaf_ids[position] for position in np.asarray(positions).tolist())
+                coords.append(leaf.scan_coords(np.asarray(positions, dtype=np.intp)))
+        query.ids = ids
+        query.coords = np.concatenate(coords) if coords else np.empty((0, 2), dtype=np.float64)
+        query.textual = np.array(textual, dtype=np.float64)
+
+    def _on_insert(self, rows) -> None:
+        for query in self.queries.values():
+            x_min, y_min, x_max, y_max = query.candidate_box()
+            if any(x_min <= location[0] <= x_max and y_min <= location[1] <= y_max and query.matches(keywords)
+                   for _, location, keywords in rows):
+                # Refetch rather than append, so new objects are scored from the coordinates
+                # the index stores (quantized in compact leaves)
+                self._fetch(query)
+                self._evaluate(query)
+
+    def _scores(self, query: ContinuousQuery, positions=slice(None)) -> np.ndarray:
+        # Scores of cached candidates at query.location, with process_query's arithmetic
+        coords = query.coords[positions]
+        dx = coords[:, 0] - query.location[0]
+        dy = coords[:, 1] - query.location[1]
+        lam = query.lambda_factor
+        return lam * (1 - np.sqrt(dx * dx + dy * dy) / 100) + (1 - lam) * query.textual[positions]
+
+    def _rescore_results(self, query: ContinuousQuery) -> List[Tuple]:
+        # Inside the safe region the ranking holds but the scores follow the location
+        scores = self._scores(query, query.chosen).tolist()
+        return [(-score,) + tuple(row[1:]) for score, row in zip(scores, query.results)]
+
+    def _evaluate(self, query: ContinuousQuery) -> None:
+        # Top-k at query.location from the cached candidates, and its safe region
+        x, y = query.location
+        r, k, lam = query.search_radius, query.k, query.lambda_factor
+        coords = query.coords
+        dx = coords[:, 0] - x
+        dy = coords[:, 1] - y
+        scores = self._scores(query)
+        inside = ((coords[:, 0] >= x - r) & (coords[:, 0] <= x + r) &
+                  (coords[:, 1] >= y - r) & (coords[:, 1] <= y + r))
+        positions = np.flatnonzero(inside)
+        if positions.size > k:
+            # Keep everything tied with the k-th score, then rank exactly as process_query does
+            threshold = np.partition(scores[positions], positions.size - k)[positions.size - k]
+            positions = positions[scores[positions] >= threshold]
+        ranked = sorted(zip((-scores[positions]).tolist(), (query.ids[p] for p in positions.tolist()),
+                            positions.tolist()))[:k]
+        query.results = self.teq_index.materialize([(score, obj_id) for score, obj_id, _ in ranked])
+
+        limits = [query.margin - max(abs(x - query.anchor[0]), abs(y - query.anchor[1]))]
+        rate = 2 * lam / 100  # How fast the gap between two scores can close per unit moved
+        chosen = query.chosen = np.array([position for _, _, position in ranked], dtype=np.intp)
+        cheb = np.maximum(np.abs(dx), np.abs(dy))
+        if chosen.size:
+            limits.append(float((r - cheb[chosen]).min()))  # A result leaving the search box
+            ordered = -np.array([score for score, _, _ in ranked])
+            if rate > 0 and chosen.size > 1:
+                limits.append(float((ordered[:-1] - ordered[1:]).min()) / rate)
+        others = np.ones(len(query.ids), dtype=bool)
+        others[chosen] = False
+        if others.any():
+            entering = np.maximum(cheb[others] - r, 0.0)
+            if chosen.size < k:
+                limits.append(float(entering.min()))  # Any competitor reaching the box joins the top-k
+            elif rate > 0:
+                gaps = np.maximum(-ranked[-1][0] - scores[others], 0.0) / rate
+                limits.append(float(np.maximum(gaps, entering).min()))
+            else:
+                # Scores are fixed, so only a competitor that outranks the k-th result matters
+                last_score, last_id, _ = ranked[-1]
+                other_positions = np.flatnonzero(others)
+                outranks = np.array([(-score, query.ids[p]) < (last_score, last_id) for score, p in
+                                     zip(scores[other_positions].tolist(), other_positions.tolist())], dtype=bool)
+                if outranks.any():
+                    limits.append(float(entering[outranks].min()))
+        query.safe_region = SafeRegion(query.location, max(0.0, min(limits)))
@@ -0,0 +1,264 @@
+import heapq
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from math import floor, sqrt
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Join being run by a worker process (set by _init_worker)
+_WORKER_JOIN = None
+
+
+def _init_worker(join):
+    global _WORKER_JOIN
+    _WORKER_JOIN = join
+
+
+def _run_partition(group_numbers: List[int]) -> Dict:
+    results = {}
+    for outer_ids, rows in _WORKER_JOIN.iter_results(group_numbers):
+        results.update(zip(outer_ids, rows))
+    return results
+
+
+class SpatialKeywordJoin:
+    """
+    Top-k spatial-keyword join: for every outer object, the k best inner objects by the
+    POWER score (within search_radius, carrying a positive keyword and none of the
+    negative ones), as if process_query had been run from each outer location.
+
+    Outer objects are processed in spatially compact groups (the leaves of an outer
+    TEQIndex, or grid tiles of a point set). Each group walks the inner quadtree once,
+    best-first by a node-pair bound: the score an inner node could reach from the
+    nearest point of the group's bounding box. A node is pruned when it falls outside
+    the group's box grown by search_radius, when its keyword summary rules out the
+    keywords, or when its bound is below the k-th score of every object in the group.
+    Leaves are scored against the whole group with one distance matrix.
+
+    Attributes
+    ----------
+    inner : TEQIndex
+        Index searched for matches.
+    groups : list
+        (outer_ids, coords) per group of outer objects.
+    Methods
+    -------
+    iter_results(group_numbers=None):
+        Yields (outer_ids, rows) per group, rows holding each outer object's top-k.
+    run(workers=1):
+        Returns {outer_id: top-k rows}, splitting the groups across worker processes
+        (one outer partition per task) when workers > 1.
+    """
+
+    def __init__(self, outer, inner, positive_keywords: Sequence[str], negative_keywords: Sequence[str] = (),
+                 k: int = 10, lambda_factor: float = 0.5, search_radius: float = 10,
+                 outer_keywords: Optional[Sequence[str]] = None, group_size: int = 128,
+                 materialize: bool = True):
+        """
+        Args:
+            outer: TEQIndex, or iterable of (obj_id, (lat, lon)) points
+            inner: TEQIndex searched for each outer object
+            outer_keywords: Only join outer objects of a TEQIndex carrying one of these keywords
+            group_size: Maximum outer objects scored together against an inner leaf
+            materialize: Return (score, obj_id, location, full_text) rows instead of
+                         (score, obj_id) pairs
+        """
+        if inner._batch_buffer:
+            inner._flush_buffer()
+        self.inner = inner
+        self.positive_keywords = list(positive_keywords)
+        self.positive_set = set(positive_keywords)
+        self.negative_set = set(negative_keywords)
+        self.k = k
+        self.lambda_factor = lambda_factor
+        self.search_radius = search_radius
+        self.materialize = materialize
+        self.groups = self._outer_groups(outer, outer_keywords, group_size)
+        self._leaf_cache = {}
+
+    def _outer_groups(self, outer, outer_keywords, group_size) -> List[Tuple[List, np.ndarray]]:
+        if hasattr(outer, 'spatial_index'):
+            # An index: its quadtree leaves are already spatially compact
+            if outer._batch_buffer:
+                outer._flush_buffer()
+            wanted = set(outer_keywords) if outer_keywords else None
+            blocks = []
+            stack = [outer.spatial_index]
+            while stack:
+                node = stack.pop()
+                if node.children is not None:
+                    stack.extend(node.children)
+                    continue
+                positions = [i for i, keywords in enumerate(node.scan_keywords())
+                             if wanted is None or not wanted.isdisjoint(keywords)]
+                if positions:
+                    blocks.append(([node.ids[i] for i in positions], node.scan_coords(positions)))
+        else:
+            # A point set: bucket into tiles of search_radius
+            tiles = defaultdict(list)
+            size = self.search_radius or 1.0
+            for obj_id, (x, y) in outer:
+                tiles[(floor(x / size), floor(y / size))].append((obj_id, x, y))
+            blocks = []
+            for tile in sorted(tiles):
+                points = tiles[tile]
+                blocks.append(([p[0] for p in points], np.array([p[1:] for p in points], dtype=np.float64)))
+
+        groups = []
+        for ids, coords in blocks:
+            for start in range(0, len(ids), group_size):
+                groups.append((ids[start:start + group_size], coords[start:start + group_size]))
+        return groups
+
+    def _leaf_matches(self, leaf) -> Optional[Tuple]:
+        # Matching objects of an inner leaf with their textual scores, computed once per join
+        key = id(leaf)
+        if key not in self._leaf_cache:
+            positive_set, negative_set = self.positive_set, self.negative_set
+            positions, textual = [], []
+            for position, keywords in enumerate(leaf.scan_keywords()):
+                if positive_set.isdisjoint(keywords):
+                    continue
+                if negative_set and not negative_set.isdisjoint(keywords):
+                    continue
+                positions.append(position)
+                textual.append(sum(keywords[word] for word in self.positive_keywords if word in keywords))
+            if positions:
+                self._leaf_cache[key] = (leaf.scan_coords(positions), np.array(textual),
+                                         np.array([leaf.ids[i] for i in positions], dtype=object))
+            else:
+                self._leaf_cache[key] = None
+        return self._leaf_cache[key]
+
+    def _node_bound(self, node, box) -> Optional[float]:
+        # Best score any object below node can reach from any point of box
+        max_weights = node.max_weights
+        matched = [max_weights[word] for word in self.positive_keywords if word in max_weights]
+        if not matched:
+            return None
+        dx = max(node.bounds[0] - box[2], 0.0, box[0] - node.bounds[2])
+        dy = max(node.bounds[1] - box[3], 0.0, box[1] - node.bounds[3])
+        return self.lambda_factor * (1 - sqrt(dx * dx + dy * dy) / 100) + (1 - self.lambda_factor) * sum(matched)
+
+    def _join_group(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        k, lam, r = self.k, self.lambda_factor, self.search_radius
+        m = len(points)
+        box = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+        reach = (box[0] - r, box[1] - r, box[2] + r, box[3] + r)
+        negative_sets = [self.negative_set] if self.negative_set else None
+
+        best_scores = np.full((m, k), -np.inf)
+        best_ids = np.full((m, k), None, dtype=object)
+        threshold = -np.inf  # k-th score of the weakest outer object in the group
+        tie = count()
+        frontier = []
+        root = self.inner.spatial_index
+        bound = self._node_bound(root, box)
+        if bound is not None and root._bounds_intersect(reach):
+            frontier.append((-bound, next(tie), root))
+
+        while frontier:
+            neg_bound, _, node = heapq.heappop(frontier)
+            if -neg_bound < threshold:
+                break  # No remaining node pair can improve any outer object
+            if node.children is not None:
+                for child in node.children:
+                    if not child._bounds_intersect(reach):
+                        continue
+                    if negative_sets and child.excluded_by(negative_sets):
+                        continue
+                    bound = self._node_bound(child, box)
+                    if bound is None or bound < threshold:
+                        continue
+                    heapq.heappush(frontier, (-bound, next(tie), child))
+                continue
+
+            matches = self._leaf_matches(node)
+            if matches is None:
+                continue
+            coords, textual, ids = matches
+            near = ((coords[:, 0] >= reach[0]) & (coords[:, 0] <= reach[2]) &
+                    (coords[:, 1] >= reach[1]) & (coords[:, 1] <= reach[3]))
+            if not near.all():
+                coords, textual, ids = coords[near], textual[near], ids[near]
+                if not len(ids):
+                    continue
+
+            # Every outer point against every candidate, limited to each point's search box
+            dx = coords[None, :, 0] - points[:, 0, None]
+            dy = coords[None, :, 1] - points[:, 1, None]
+            scores = lam * (1 - np.sqrt(dx * dx + dy * dy) / 100) + (1 - lam) * textual[None, :]
+            scores[(np.abs(dx) > r) | (np.abs(dy) > r)] = -np.inf
+
+            all_scores = np.hstack([best_scores, scores])
+            all_ids = np.hstack([best_ids, np.broadcast_to(ids, scores.shape)])
+            top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(all_scores, top, axis=1)
+            best_ids = np.take_along_axis(all_ids, top, axis=1)
+            threshold = best_scores.min()
+        return best_scores, best_ids
+
+    def iter_results(self, group_numbers: Optional[Iterable[int]] = None) -> Iterator[Tuple[List, List]]:
+        """
+        Join groups one at a time
+        Args:
+            group_numbers: Indexes into self.groups (all groups when omitted)
+        Yields:
+            (outer_ids, rows) where rows[i] is the top-k of outer_ids[i], best first
+        """
+        if self.k <= 0:
+            return
+        for number in (range(len(self.groups)) if group_numbers is None else group_numbers):
+            outer_ids, points = self.groups[number]
+            best_scores, best_ids = self._join_group(points)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            rows = []
+            for scores, ids in zip(np.take_along_axis(best_scores, order, axis=1).tolist(),
+                                   np.take_along_axis(best_ids, order, axis=1).tolist()):
+                scored = [(score, obj_id) for score, obj_id in zip(scores, ids) if score != -np.inf]
+                rows.append(self.inner.materialize(scored) if self.materialize else scored)
+            yield outer_ids, rows
+
+    def run(self, workers: int = 1) -> Dict:
+        """
+        Join every outer object
+        Args:
+            workers: Processes to split the outer groups across (1 runs in this process)
+        Returns:
+            {outer_id: top-k rows}
+        """
+        if workers <= 1 or len(self.groups) <= 1:
+            return _collect(self.iter_results())
+        # Interleave groups so every partition gets a mix of dense and sparse regions
+        partitions = [list(range(i, len(self.groups), workers * 4)) for i in range(workers * 4)]
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        results = {}
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self,)) as pool:
+            for partial in pool.map(_run_partition, [p for p in partitions if p]):
+                results.update(partial)
+        return results
+
+
+def _collect(results: Iterator[Tuple[List, List]]) -> Dict:
+    joined = {}
+    for outer_ids, rows in results:
+        joined.update(zip(outer_ids, rows))
+    return joined
+
+
+def topk_join(outer, inner, positive_keywords: Sequence[str], negative_keywords: Sequence[str] = (),
+              k: int = 10, lambda_factor: float = 0.5, search_radius: float = 10, workers: int = 1,
+              **kwargs) -> Dict:
+    """
+    For each outer object, the top-k inner objects matching the keywords (see SpatialKeywordJoin)
+    Returns:
+        {outer_id: [(score, obj_id, location, full_text), ...]}
+    """
+    join = SpatialKeywordJoin(outer, inner, positive_keywords, negative_keywords, k, lambda_factor,
+                              search_radius, **kwargs)
+    return join.run(workers)
@@ -0,0 +1,347 @@
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Default histogram buckets (upper bounds; +Inf is implicit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+CLUSTER_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Base of the registry's instruments. Children are created per label-value tuple.
+
+    Updates take no locks: each child's fields are only ever incremented, so concurrent
+    writers at worst lose an increment, which is acceptable for monitoring.
+    """
+    TYPE = ''
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple, object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Child instrument for one combination of label values"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.TYPE}']
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}']
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+
+class _CounterChild(_Value):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild(_Value):
+    __slots__ = ('function',)
+
+    def __init__(self):
+        super().__init__()
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the gauge from function at scrape time instead of storing a value"""
+        self.function = function
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, optionally computed when scraped"""
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _render_child(self, values, child) -> List[str]:
+        value = child.function() if child.function is not None else child.value
+        if value is None:
+            return []
+        return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}']
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float, n: int = 1):
+        """Record value n times"""
+        self.counts[bisect_left(self.bounds, value)] += n
+        self.sum += value * n
+        self.count += n
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float, n: int = 1):
+        self.labels().observe(value, n)
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), list(child.counts)):
+            cumulative += count
+            labels = _format_labels(self.label_names, values, f'le="{_format_value(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.label_names, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(child.sum)}')
+        lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of named metrics rendered in the Prometheus text exposition format.
+
+    Methods
+    -------
+    counter(name, help_text, label_names=()), gauge(...), histogram(..., buckets):
+        Return the metric registered under name, creating it on first use.
+    render():
+        Returns every metric in the Prometheus text format.
+    serve(port=9108, host='127.0.0.1'):
+        Serves render() at http://host:port/metrics from a daemon thread.
+    write_snapshots(path, interval=15.0):
+        Rewrites path with render() every interval seconds from a daemon thread.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics.setdefault(name, cls(name, *args, **kwargs))
+        if not isinstance(metric, cls):
+            raise ValueError(f"Metric '{name}' is already registered as a {metric.TYPE}")
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help_text, label_names)
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help_text, label_names)
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, label_names, buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9108, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """
+        Expose the metrics over HTTP
+        Args:
+            port: Port to listen on (0 picks a free one, see server.server_address)
+            host: Interface to bind; localhost by default
+        Returns:
+            The running server; call shutdown() to stop it
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes out of the console
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='uask-metrics', daemon=True).start()
+        return server
+
+    def write_snapshot(self, path: str) -> None:
+        """Write the current metrics to path, replacing it atomically"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def write_snapshots(self, path: str, interval: float = 15.0) -> threading.Event:
+        """
+        Periodically write the metrics to path
+        Returns:
+            Event; set it to stop the writer (a final snapshot is written on stop)
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.write_snapshot(path)
+            self.write_snapshot(path)
+
+        threading.Thread(target=run, name='uask-metrics-snapshot', daemon=True).start()
+        return stop
+
+
+class EngineMetrics:
+    """
+    The query engine's metrics, recorded by POWERQueryProcessor, BatchPOWERQueryProcessor
+    and read from TEQIndex when passed to a processor as ``metrics``.
+
+    Attributes
+    ----------
+    registry : MetricsRegistry
+        Registry holding the metrics below; expose it with serve() or write_snapshots().
+    queries : Counter
+        uask_queries_total{mode}, queries processed per mode ('single' or 'batch').
+    latency : Histogram
+        uask_query_latency_seconds{mode}; batch queries record the batch time divided
+        by the number of queries in it.
+    candidates, nodes_visited : Histogram
+        Candidate objects and quadtree nodes visited per query.
+    batch_duration, batch_size, cluster_size : Histogram
+        Wall time and size of process_batch_queries calls, and the sizes of the clusters
+        formed by _group_queries.
+    leaf_slice_lookups : Counter
+        uask_batch_leaf_slice_lookups_total{result}: leaves a batch cluster found in the
+        batch's leaf-slice cache ('hit') or sliced for it ('miss').
+    """
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        r = self.registry
+        self.queries = r.counter('uask_queries_total', 'Queries processed', ('mode',))
+        self.latency = r.histogram('uask_query_latency_seconds', 'Query latency (amortized per query in batches)',
+                                   ('mode',), LATENCY_BUCKETS)
+        self.candidates = r.histogram('uask_query_candidates', 'Candidate objects per query',
+                                      ('mode',), COUNT_BUCKETS)
+        self.nodes_visited = r.histogram('uask_query_nodes_visited', 'Quadtree nodes visited per query',
+                                         ('mode',), COUNT_BUCKETS)
+        self.batch_duration = r.histogram('uask_batch_duration_seconds', 'Wall time of a query batch')
+        self.batch_size = r.histogram('uask_batch_size', 'Queries per batch', buckets=COUNT_BUCKETS)
+        self.cluster_size = r.histogram('uask_cluster_size', 'Queries per cluster formed by batch grouping',
+                                        buckets=CLUSTER_BUCKETS)
+        self.leaf_slice_lookups = r.counter('uask_batch_leaf_slice_lookups_total',
+                                            'Leaves looked up in the batch leaf-slice cache', ('result',))
+        self.index_objects = r.gauge('uask_index_objects', 'Objects in the index')
+        self.index_text_bytes = r.gauge('uask_index_text_bytes', 'Encoded bytes in the full-text store')
+        self.index_load_seconds = r.gauge('uask_index_load_seconds', 'Time taken by TEQIndex.load_index')
+
+    def observe_query(self, mode: str, elapsed_ns: int, stats) -> None:
+        """Record one query of the given mode with its QueryStats"""
+        self.queries.labels(mode).inc()
+        self.latency.labels(mode).observe(elapsed_ns / 1e9)
+        self.candidates.labels(mode).observe(stats.candidates)
+        self.nodes_visited.labels(mode).observe(stats.nodes_visited)
+
+    def observe_batch(self, n_queries: int, elapsed_ns: int, stats) -> None:
+        """Record a batch of n_queries with the QueryStats accumulated over it"""
+        if not n_queries:
+            return
+        self.queries.labels('batch').inc(n_queries)
+        self.latency.labels('batch').observe(elapsed_ns / 1e9 / n_queries, n_queries)
+        self.candidates.labels('batch').observe(stats.candidates / n_queries, n_queries)
+        self.nodes_visited.labels('batch').observe(stats.nodes_visited / n_queries, n_queries)
+        self.batch_duration.observe(elapsed_ns / 1e9)
+        self.batch_size.observe(n_queries)
+        self.leaf_slice_lookups.labels('hit').inc(stats.cache_hits)
+        self.leaf_slice_lookups.labels('miss').inc(stats.cache_misses)
+
+    def observe_clusters(self, clusters) -> None:
+        """Record the sizes of the query clusters of one batch"""
+        for cluster in clusters:
+            self.cluster_size.observe(len(cluster))
+
+    def track_index(self, teq_index) -> None:
+        """Report the index size and load time, read whenever the metrics are rendered"""
+        self.index_objects.set_function(lambda: len(teq_index.objects))
+        self.index_text_bytes.set_function(lambda: teq_index.texts.nbytes)
+        self.index_load_seconds.set_function(lambda: teq_index.load_seconds)
+
+    def serve(self, port: int = 9108, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        return self.registry.serve(port, host)
+
+    def write_snapshots(self, path: str, interval: float = 15.0) -> threading.Event:
+        return self.registry.write_snapshots(path, interval)
@@ -1,5 +1,53 @@
 import heapq
+import sys
+from dataclasses import dataclass
+from itertools import count
 from math import sqrt
+from time import perf_counter_ns
+from typing import Optional
+
+import numpy as np
+
+from queries.predicate import compile_predicate
+from queries.stats import PhaseTimer, QueryStats
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    """
+    Work limits of an approximate query. Unset limits are unbounded.
+
+    Attributes:
+        max_nodes (int): Quadtree nodes the best-first search may expand.
+        max_scored (int): Candidate objects that may be scored.
+        deadline_ms (float): Wall-clock time the search may take.
+    """
+    max_nodes: Optional[int] = None
+    max_scored: Optional[int] = None
+    deadline_ms: Optional[float] = None
+
+    def describe(self) -> str:
+        limits = [f"{name}={value}" for name, value in
+                  (('nodes', self.max_nodes), ('scored', self.max_scored), ('deadline_ms', self.deadline_ms))
+                  if value is not None]
+        return ','.join(limits) or 'unbounded'
+
+
+class ApproximateResults(list):
+    """
+    Result rows of a budgeted query.
+
+    Attributes:
+        approximate (bool): True when the budget stopped the search while unexplored regions
+            could still hold better objects; False when the results are provably exact.
+        exhausted (str or None): Limit that stopped the search ('max_nodes', 'max_scored'
+            or 'deadline_ms').
+    """
+
+    def __init__(self, rows, exhausted: Optional[str] = None):
+        super().__init__(rows)
+        self.exhausted = exhausted
+        self.approximate = exhausted is not None
 
 
 class POWERQueryProcessor:
@@ -11,37 +59,258 @@ class POWERQueryProcessor:
         An index object that provides candidate objects based on location and keywords.
     Methods:
     --------
-    __init__(teq_index):
-        Initializes the query processor with the given index.
+    __init__(teq_index, metrics=None):
+        Initializes the query processor with the given index. Queries are recorded in
+        metrics (a queries.metrics.EngineMetrics) when one is given.
+    add_hook(hook):
+        Registers hook(phase, stats, elapsed_ns), called as each phase of an instrumented query ends.
     compute_distance(loc1, loc2):
         Computes the Euclidean distance between two locations.
     count_keyword_matches(keywords, positive_keywords):
         Counts the number of positive keywords that match the given keywords.
-    process_query(location, positive_keywords, negative_keywords, k, lambda_factor=0.5):
+    keyword_relevance(keywords, positive_keywords):
+        Sums the stored weights of the positive keywords that match the given keywords.
+    process_query(location, positive_keywords, negative_keywords, k, lambda_factor=0.5, search_radius=10):
         Processes the query by combining spatial and textual scores and returns the top-k results.
+        The quadtree is searched best-first, pruning nodes whose score upper bound (from their
+        distance and per-keyword maximum weights) cannot reach the current k-th score, and
+        skipping nodes whose objects all carry one of the negative keywords.
+        Pass a QueryStats as stats to collect node, candidate and phase counters.
+    process_query_with_stats(...):
+        Same as process_query, returning (results, QueryStats).
+    process_query_approximate(location, positive_keywords, negative_keywords, k, budget, ...):
+        Runs the same best-first search but stops once a QueryBudget (nodes expanded,
+        candidates scored or a deadline) is spent, returning ApproximateResults.
+    process_predicate_query(location, predicate, k, lambda_factor=0.5, search_radius=10):
+        Top-k query filtered by a boolean keyword predicate such as
+        "(cafe OR bar) AND wifi AND NOT closed", evaluated on leaf posting lists.
     """
 
-    def __init__(self, teq_index):
+    def __init__(self, teq_index, metrics=None):
         self.teq_index = teq_index
-    
+        self.hooks = []
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.track_index(teq_index)
+
+    def add_hook(self, hook):
+        """Register a profiling hook called as hook(phase, stats, elapsed_ns)."""
+        self.hooks.append(hook)
+
     def compute_distance(self, loc1, loc2):
         """Compute Euclidean distance between two locations."""
         return sqrt((loc1[0] - loc2[0]) ** 2 + (loc1[1] - loc2[1]) ** 2)
-    
+
     def count_keyword_matches(self, keywords, positive_keywords):
         """Count the number of positive keywords that match the given keywords."""
         return sum(1 for word in positive_keywords if word in keywords)
-    
-    def process_query(self, location, positive_keywords, negative_keywords, k, lambda_factor=0.5):
+
+    def keyword_relevance(self, keywords, positive_keywords):
+        """Sum the weights of the positive keywords found in the keyword -> weight mapping."""
+        return sum(keywords[word] for word in positive_keywords if word in keywords)
+
+    def _score_bound(self, node, x, y, positive_keywords, lambda_factor, predicate=None):
+        """
+        Upper bound on the score of any object below node, or None when no object
+        below it carries a positive keyword (or can satisfy predicate, when given).
+        """
+        max_weights = node.max_weights
+        matched = [max_weights[word] for word in positive_keywords if word in max_weights]
+        if predicate is not None:
+            if node.common_keywords is None or not predicate.possible(node):
+                return None
+        elif not matched:
+            return None
+        spatial_bound = 1 - node.min_distance(x, y) / 100
+        return lambda_factor * spatial_bound + (1 - lambda_factor) * sum(matched)
+
+    def process_query(self, location, positive_keywords, negative_keywords, k, lambda_factor=0.5,
+                      search_radius=10, stats=None):
         """Process the query by combining spatial and textual scores and return the top-k results."""
-        candidates = self.teq_index.get_candidates(location, positive_keywords, negative_keywords)
-        
-        heap = []
-        for obj_id in candidates:
-            obj = self.teq_index.objects[obj_id]
-            spatial_score = 1 - self.compute_distance(location, obj['location']) / 100
-            textual_score = self.count_keyword_matches(obj['keywords'], positive_keywords)
-            score = lambda_factor * spatial_score + (1 - lambda_factor) * textual_score
-            heapq.heappush(heap, (-score, obj_id, obj['location'], obj['full_text']))
-        
-        return [heapq.heappop(heap) for _ in range(min(k, len(heap)))]
+        return self._run('single', stats, location, positive_keywords, negative_keywords, k, lambda_factor,
+                         search_radius)
+
+    def _run(self, mode, stats, *args, **kwargs):
+        # Run _process_query, recording it in the metrics (if any) under mode
+        if self.metrics is None:
+            return self._process_query(*args, stats=stats, **kwargs)
+        start = perf_counter_ns()
+        query_stats = QueryStats()
+        results = self._process_query(*args, stats=query_stats, **kwargs)
+        self.metrics.observe_query(mode, perf_counter_ns() - start, query_stats)
+        if stats is not None:
+            stats.merge(query_stats)
+        return results
+
+    def process_query_approximate(self, location, positive_keywords, negative_keywords, k, budget: QueryBudget,
+                                  lambda_factor=0.5, search_radius=10, stats=None):
+        """
+        Top-k query with bounded work. The best-first order spends the budget on the nodes
+        with the highest score bounds first, so the first results found are the likeliest
+        to be in the exact top-k.
+        Returns:
+            ApproximateResults; ``approximate`` is False when the search finished within budget
+        """
+        return self._run('approximate', stats, location, positive_keywords, negative_keywords, k, lambda_factor,
+                         search_radius, budget=budget)
+
+    def process_predicate_query(self, location, predicate, k, lambda_factor=0.5, search_radius=10, stats=None):
+        """
+        Top-k query whose keyword filter is a boolean predicate.
+        Args:
+            predicate: Expression such as "(cafe OR bar) AND wifi AND NOT closed" (see
+                       queries.predicate.compile_predicate) or a compiled Predicate
+        The textual score sums the weights of the predicate's non-negated keywords.
+        """
+        predicate = compile_predicate(predicate)
+        return self._run('predicate', stats, location, predicate.positive_terms(), [], k, lambda_factor,
+                         search_radius, predicate=predicate)
+
+    def _process_query(self, location, positive_keywords, negative_keywords, k, lambda_factor=0.5,
+                       search_radius=10, stats=None, budget=None, predicate=None):
+        if k <= 0:
+            return [] if budget is None else ApproximateResults([])
+        timer = PhaseTimer(stats, self.hooks) if stats is not None else None
+        index = self.teq_index
+        # Ensure buffer is flushed before querying
+        if index._batch_buffer:
+            index._flush_buffer()
+
+        x, y = location
+        bounds = (x - search_radius, y - search_radius,
+                  x + search_radius, y + search_radius)
+        positive_set = set(positive_keywords)
+        negative_set = set(negative_keywords)
+        negative_sets = [negative_set] if negative_set else None
+
+        # Rank on (score, obj_id) only; full texts are fetched for the final k rows
+        top_scores = []  # min-heap of the k best scores seen so far
+        ranked = []      # (-score, obj_id) of every object that was in the top-k when scored
+        tie = count()
+        root = index.spatial_index
+        frontier = []
+        root_bound = self._score_bound(root, x, y, positive_keywords, lambda_factor, predicate)
+        if root_bound is not None and root._bounds_intersect(bounds):
+            frontier.append((-root_bound, next(tie), root))
+
+        # Work limits; unbounded unless a budget sets them
+        max_nodes = max_scored = sys.maxsize
+        deadline = None
+        if budget is not None:
+            if budget.max_nodes is not None:
+                max_nodes = budget.max_nodes
+            if budget.max_scored is not None:
+                max_scored = budget.max_scored
+            if budget.deadline_ms is not None:
+                deadline = perf_counter_ns() + int(budget.deadline_ms * 1e6)
+        exhausted = None
+
+        # Counters stay local and are written to stats once at the end
+        visited = pruned = leaves = examined = candidates = heap_ops = 0
+        while frontier:
+            neg_bound, _, node = heapq.heappop(frontier)
+            if len(top_scores) == k and -neg_bound < top_scores[0]:
+                pruned += len(frontier) + 1
+                break  # No remaining node can beat the current k-th score
+            if visited >= max_nodes:
+                exhausted = 'max_nodes'
+            elif deadline is not None and perf_counter_ns() >= deadline:
+                exhausted = 'deadline_ms'
+            if exhausted:
+                pruned += len(frontier) + 1
+                break  # Budget spent while this node could still improve the top-k
+            visited += 1
+
+            if node.children is not None:
+                for child in node.children:
+                    if not child._bounds_intersect(bounds):
+                        pruned += 1
+                        continue
+                    if negative_sets and child.excluded_by(negative_sets):
+                        pruned += 1
+                        continue  # Every object below carries a negative keyword
+                    bound = self._score_bound(child, x, y, positive_keywords, lambda_factor, predicate)
+                    if bound is None or (len(top_scores) == k and bound < top_scores[0]):
+                        pruned += 1
+                        continue
+                    heapq.heappush(frontier, (-bound, next(tie), child))
+                    heap_ops += 1
+                continue
+
+            idx = node.leaf_positions(bounds)
+            leaves += 1
+            examined += len(node.ids) if idx is None else idx.size
+            if predicate is not None:
+                # Posting-list plan over the positions inside the box
+                idx = predicate.leaf_matches(node, idx)
+            textual_scores = leaf_keywords = None
+            if node.packed is not None:
+                # Packed leaves filter and score from the query keywords' posting lists only
+                idx, textual_scores = node.packed.match(positive_keywords, negative_set, idx, predicate is None)
+                textual_scores = textual_scores.tolist()
+            else:
+                leaf_keywords = node.scan_keywords()
+            if idx is None:
+                positions = range(len(node.ids))
+            else:
+                positions = idx.tolist()
+            coords = node.scan_coords(idx)
+            dx = coords[:, 0] - x
+            dy = coords[:, 1] - y
+            spatial_scores = 1 - np.sqrt(dx * dx + dy * dy) / 100
+
+            ids = node.ids
+            for i, (position, spatial_score) in enumerate(zip(positions, spatial_scores.tolist())):
+                if leaf_keywords is not None:
+                    keywords = leaf_keywords[position]
+                    if predicate is None:
+                        if positive_set.isdisjoint(keywords):
+                            continue
+                        if negative_set and not negative_set.isdisjoint(keywords):
+                            continue
+                if candidates >= max_scored:
+                    exhausted = 'max_scored'
+                    break
+                candidates += 1
+                if textual_scores is None:
+                    textual_score = self.keyword_relevance(keywords, positive_keywords)
+                else:
+                    textual_score = textual_scores[i]
+                score = lambda_factor * spatial_score + (1 - lambda_factor) * textual_score
+                if len(top_scores) < k:
+                    heapq.heappush(top_scores, score)
+                elif score >= top_scores[0]:
+                    heapq.heappushpop(top_scores, score)
+                else:
+                    continue
+                heap_ops += 1
+                ranked.append((-score, ids[position]))
+            if exhausted:
+                pruned += len(frontier)
+                break
+
+        if timer is None:
+            results = index.materialize(heapq.nsmallest(k, ranked))
+            return results if budget is None else ApproximateResults(results, exhausted)
+
+        timer.lap('search')
+        results = index.materialize(heapq.nsmallest(k, ranked))
+        stats.nodes_visited += visited
+        stats.nodes_pruned += pruned
+        stats.leaves_scanned += leaves
+        stats.objects_examined += examined
+        stats.candidates += candidates
+        stats.objects_scored += candidates
+        stats.heap_ops += heap_ops
+        stats.results += len(results)
+        stats.queries += 1
+        timer.lap('materialize')
+        return results if budget is None else ApproximateResults(results, exhausted)
+
+    def process_query_with_stats(self, location, positive_keywords, negative_keywords, k, lambda_factor=0.5,
+                                 search_radius=10):
+        """Run process_query with a fresh QueryStats and return (results, stats)."""
+        stats = QueryStats()
+        results = self.process_query(location, positive_keywords, negative_keywords, k, lambda_factor,
+                                     search_radius, stats=stats)
+        return results, stats
@@ -0,0 +1,286 @@
+import re
+from functools import reduce
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+EMPTY = np.empty(0, dtype=np.int32)
+
+_TOKEN = re.compile(r'\(|\)|"[^"]*"|[^\s()]+')
+OPERATORS = ('AND', 'OR', 'NOT')
+
+
+def _intersect(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Sorted-array intersection: binary-search the smaller list in the larger one
+    if a.size > b.size:
+        a, b = b, a
+    if a.size == 0:
+        return EMPTY
+    found = np.searchsorted(b, a)
+    found[found == b.size] = 0
+    return a[b[found] == a]
+
+
+def _difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Positions of sorted a that are not in sorted b
+    if a.size == 0 or b.size == 0:
+        return a
+    found = np.searchsorted(b, a)
+    found[found == b.size] = 0
+    return a[b[found] != a]
+
+
+class Predicate:
+    """
+    Boolean keyword predicate compiled into a posting-list plan.
+
+    A plan is evaluated per quadtree leaf against the leaf's keyword posting lists
+    (sorted object positions per keyword). The positions inside the search box are
+    passed in as the universe, so spatial filtering happens before any keyword work,
+    and AND nodes intersect their operands rarest first, stopping as soon as the
+    running result is empty. Subtrees are pruned with the node keyword summaries:
+    ``possible`` is False when no object below a node can satisfy the predicate.
+
+    Methods
+    -------
+    possible(node), certain(node):
+        Whether some (every) object below a non-empty node may (must) satisfy the predicate.
+    estimate(postings):
+        Upper bound on the number of positions the predicate can match in a leaf.
+    evaluate(postings, universe):
+        Sorted positions of universe satisfying the predicate.
+    matches(keywords):
+        Evaluates the predicate on one object's keywords.
+    positive_terms():
+        Keywords that appear without negation; they make up the textual score.
+    leaf_matches(leaf, idx):
+        Positions of a leaf's objects satisfying the predicate, restricted to idx
+        (None for the whole leaf).
+    """
+    __slots__ = ()
+
+    def leaf_matches(self, leaf, idx: Optional[np.ndarray] = None) -> np.ndarray:
+        universe = np.arange(len(leaf.ids), dtype=np.int32) if idx is None else idx
+        return self.evaluate(leaf.keyword_postings(), universe)
+
+    def positive_terms(self) -> List[str]:
+        terms = []
+        self._collect_terms(terms, False)
+        return list(dict.fromkeys(terms))
+
+    def _collect_terms(self, terms: List[str], negated: bool) -> None:
+        raise NotImplementedError
+
+    @classmethod
+    def from_keywords(cls, positive_keywords: Iterable[str], negative_keywords: Iterable[str] = ()) -> 'Predicate':
+        """The predicate of a classic query: any positive keyword and none of the negative ones"""
+        positive = Or([Term(keyword) for keyword in positive_keywords])
+        negative = [Term(keyword) for keyword in negative_keywords]
+        return And([positive, Not(Or(negative))]) if negative else positive
+
+
+class Term(Predicate):
+    __slots__ = ('keyword',)
+
+    def __init__(self, keyword: str):
+        self.keyword = keyword
+
+    def possible(self, node) -> bool:
+        return self.keyword in node.max_weights
+
+    def certain(self, node) -> bool:
+        return bool(node.common_keywords) and self.keyword in node.common_keywords
+
+    def estimate(self, postings: Dict[str, np.ndarray]) -> int:
+        posting = postings.get(self.keyword)
+        return 0 if posting is None else posting.size
+
+    def evaluate(self, postings, universe: np.ndarray) -> np.ndarray:
+        posting = postings.get(self.keyword)
+        return EMPTY if posting is None else _intersect(posting, universe)
+
+    def matches(self, keywords) -> bool:
+        return self.keyword in keywords
+
+    def _collect_terms(self, terms, negated):
+        if not negated:
+            terms.append(self.keyword)
+
+    def __repr__(self):
+        return self.keyword if _TOKEN.fullmatch(self.keyword) and self.keyword not in OPERATORS \
+            else f'"{self.keyword}"'
+
+
+class Not(Predicate):
+    __slots__ = ('child',)
+
+    def __init__(self, child: Predicate):
+        self.child = child
+
+    def possible(self, node) -> bool:
+        return not self.child.certain(node)
+
+    def certain(self, node) -> bool:
+        return not self.child.possible(node)
+
+    def estimate(self, postings) -> float:
+        return float('inf')  # Unknown until the universe is known; AND runs negations last
+
+    def evaluate(self, postings, universe):
+        return _difference(universe, self.child.evaluate(postings, universe))
+
+    def matches(self, keywords) -> bool:
+        return not self.child.matches(keywords)
+
+    def _collect_terms(self, terms, negated):
+        self.child._collect_terms(terms, not negated)
+
+    def __repr__(self):
+        return f'NOT {self.child!r}'
+
+
+class And(Predicate):
+    __slots__ = ('children',)
+
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+
+    def possible(self, node) -> bool:
+        return all(child.possible(node) for child in self.children)
+
+    def certain(self, node) -> bool:
+        return all(child.certain(node) for child in self.children)
+
+    def estimate(self, postings) -> int:
+        return min((child.estimate(postings) for child in self.children), default=0)
+
+    def evaluate(self, postings, universe):
+        # Rarest operands first, each evaluated inside the running result, so negations
+        # run last as differences against the smallest set
+        result = universe
+        for child in sorted(self.children, key=lambda child: child.estimate(postings)):
+            if result.size == 0:
+                break
+            result = child.evaluate(postings, result)
+        return result
+
+    def matches(self, keywords) -> bool:
+        return all(child.matches(keywords) for child in self.children)
+
+    def _collect_terms(self, terms, negated):
+        for child in self.children:
+            child._collect_terms(terms, negated)
+
+    def __repr__(self):
+        return '(' + ' AND '.join(map(repr, self.children)) + ')'
+
+
+class Or(Predicate):
+    __slots__ = ('children',)
+
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+
+    def possible(self, node) -> bool:
+        return any(child.possible(node) for child in self.children)
+
+    def certain(self, node) -> bool:
+        return any(child.certain(node) for child in self.children)
+
+    def estimate(self, postings) -> int:
+        return sum(child.estimate(postings) for child in self.children)
+
+    def evaluate(self, postings, universe):
+        parts = [part for part in (child.evaluate(postings, universe) for child in self.children) if part.size]
+        if not parts:
+            return EMPTY
+        return reduce(np.union1d, parts) if len(parts) > 1 else parts[0]
+
+    def matches(self, keywords) -> bool:
+        return any(child.matches(keywords) for child in self.children)
+
+    def _collect_terms(self, terms, negated):
+        for child in self.children:
+            child._collect_terms(terms, negated)
+
+    def __repr__(self):
+        return '(' + ' OR '.join(map(repr, self.children)) + ')'
+
+
+class _Parser:
+    # expr := and ('OR' and)* ; and := unary ('AND'? unary)* ; unary := 'NOT' unary | '(' expr ')' | term
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = _TOKEN.findall(text)
+        self.pos = 0
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"Invalid predicate {self.text!r}: {message}")
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.peek()
+        if token is None:
+            raise self.error("unexpected end of expression")
+        self.pos += 1
+        return token
+
+    def parse(self) -> Predicate:
+        if not self.tokens:
+            raise self.error("empty expression")
+        predicate = self.parse_or()
+        if self.peek() is not None:
+            raise self.error(f"unexpected {self.peek()!r}")
+        return predicate
+
+    def parse_or(self) -> Predicate:
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take()
+            children.append(self.parse_and())
+        return _flatten(Or, children)
+
+    def parse_and(self) -> Predicate:
+        children = [self.parse_unary()]
+        while self.peek() not in (None, ')', 'OR'):
+            if self.peek() == 'AND':
+                self.take()
+            children.append(self.parse_unary())
+        return _flatten(And, children)
+
+    def parse_unary(self) -> Predicate:
+        token = self.take()
+        if token == 'NOT':
+            return Not(self.parse_unary())
+        if token == '(':
+            predicate = self.parse_or()
+            if self.take() != ')':
+                raise self.error("missing ')'")
+            return predicate
+        if token in (')', 'AND', 'OR'):
+            raise self.error(f"unexpected {token!r}")
+        return Term(token[1:-1] if token.startswith('"') else token)
+
+
+def _flatten(cls, children: List[Predicate]) -> Predicate:
+    if len(children) == 1:
+        return children[0]
+    flat = []
+    for child in children:
+        flat.extend(child.children if isinstance(child, cls) else [child])
+    return cls(flat)
+
+
+def compile_predicate(predicate: Union[str, Predicate]) -> Predicate:
+    """
+    Parse a keyword predicate such as ``(cafe OR bar) AND wifi AND NOT closed``.
+
+    Operators are the upper-case words AND, OR and NOT (AND binds tighter than OR, and
+    adjacent terms are ANDed); keywords containing spaces or parentheses are double-quoted.
+    A Predicate is returned unchanged.
+    """
+    if isinstance(predicate, Predicate):
+        return predicate
+    return _Parser(predicate).parse()
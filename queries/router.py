@@ -0,0 +1,439 @@
+import heapq
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from benchmark.workload import iter_query_log
+from index.shards import load_manifest
+from index.teq_index import TEQIndex
+from queries.batch_query import BatchPOWERQueryProcessor
+
+
+def _serve(processor: BatchPOWERQueryProcessor, method: str, args: Tuple):
+    if method == 'query':
+        return processor.process_query(*args)
+    if method == 'batch':
+        return processor.process_batch_queries(*args)
+    if method == 'info':
+        return {'objects': len(processor.teq_index.objects), 'load_seconds': processor.teq_index.load_seconds}
+    raise ValueError(f"Unknown shard request '{method}'")
+
+
+class LocalShard:
+    """A shard loaded into the router's own process"""
+
+    def __init__(self, directory: str, use_mmap: bool = True, **processor_kwargs):
+        self.processor = BatchPOWERQueryProcessor(TEQIndex.load_index(directory, use_mmap), **processor_kwargs)
+
+    def submit(self, method: str, *args) -> Callable:
+        result = _serve(self.processor, method, args)
+        return lambda: result
+
+    def close(self) -> None:
+        self.processor.close()
+        self.processor = None
+
+
+def _shard_worker(conn, directory: str, use_mmap: bool, processor_kwargs: Dict) -> None:
+    try:
+        processor = BatchPOWERQueryProcessor(TEQIndex.load_index(directory, use_mmap), **processor_kwargs)
+    except Exception as e:
+        conn.send((False, e))
+        return
+    conn.send((True, None))
+    while True:
+        request = conn.recv()
+        if request is None:
+            processor.close()
+            break
+        try:
+            conn.send((True, _serve(processor, *request)))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class ProcessShard:
+    """
+    A shard served by its own local process over a pipe. submit sends the request
+    and returns without waiting, so requests to several shards run in parallel.
+    """
+
+    def __init__(self, directory: str, use_mmap: bool = True, **processor_kwargs):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_shard_worker, daemon=True,
+                                       args=(child_conn, directory, use_mmap, processor_kwargs))
+        self.process.start()
+        child_conn.close()
+        self._receive()  # Wait until the shard is loaded
+
+    def _receive(self):
+        ok, value = self.conn.recv()
+        if not ok:
+            raise value
+        return value
+
+    def submit(self, method: str, *args) -> Callable:
+        self.conn.send((method, args))
+        return self._receive
+
+    def close(self) -> None:
+        if self.process.is_alive():
+            self.conn.send(None)
+            self.process.join(timeout=5)
+        self.conn.close()
+
+
+SHARD_MODES = {'local': LocalShard, 'process': ProcessShard}
+UNREADY_POLICIES = ('wait', 'reject')
+
+
+class RegionNotReady(RuntimeError):
+    """
+    Raised by a router with on_unready='reject' when a query needs shards that are not
+    loaded yet. For a batch, results holds the answers of the queries whose shards were
+    all loaded and query_ids the queries that were rejected.
+    """
+
+    def __init__(self, shards: Sequence[str], results: Optional[Dict] = None,
+                 query_ids: Optional[List] = None):
+        super().__init__(f"Shards not loaded yet: {', '.join(shards)}")
+        self.shards = list(shards)
+        self.results = results
+        self.query_ids = query_ids or []
+
+
+class ShardRouter:
+    """
+    Scatter-gather query router over a sharded index built by index.shards.build_shards.
+
+    Each query is sent only to the shards whose objects (the extent recorded in the
+    manifest) intersect its search box, and the shards' partial top-k results are
+    merged into the global top-k. Shards are opened on first use, so only the regions
+    a workload touches are ever loaded, and a single shard can be rebuilt on disk and
+    reopened with reload_shard while the others keep serving.
+
+    A restarting service can start answering before the whole index is in memory:
+    open_async (or warm_up) loads the shards on a background thread, hottest regions
+    first, ranked by how often a recent query log touches them. Queries whose shards are
+    already loaded are answered at once; the others wait for their shards
+    (on_unready='wait') or raise RegionNotReady (on_unready='reject'). A rejected query
+    starts a background load of the shards it needed that are neither loaded nor
+    loading (never opened, or failed before), so a router used without warm_up, and a
+    shard whose load failed, still come up.
+
+    Attributes
+    ----------
+    directory : str
+        Root directory of the sharded index.
+    manifest : dict
+        The shards.json manifest.
+    mode : str
+        'local' loads shards into this process; 'process' serves each shard from its
+        own local process.
+    on_unready : str
+        'wait' queues a query until its shards are loaded (loading them if nobody is);
+        'reject' raises RegionNotReady instead, after starting a background load of
+        the missing shards.
+    errors : dict
+        Shard name -> exception of the last failed load.
+    Methods
+    -------
+    open_async(directory, query_log=None, n_neg=0, max_log_queries=100000, **kwargs):
+        Returns a router at once and warms it up in the background.
+    warm_up(hot_queries=None, background=True), wait_ready(timeout=None):
+        Load every shard, those hit most by hot_queries first; wait for the warm-up.
+    hot_shards(queries):
+        Shard names ordered by how many of queries reach them.
+    status(), ready(bounds):
+        Per-shard readiness ('ready', 'loading', 'failed' or 'cold'); whether every
+        shard a search box needs is loaded.
+    shards_for(bounds):
+        Names of the shards whose objects may fall inside bounds.
+    process_query(location, positive_keywords, negative_keywords, k, lambda_factor=0.5, search_radius=10):
+        Same results as POWERQueryProcessor.process_query over the union of the shards.
+    process_batch_queries(queries, max_cluster_size=None):
+        Routes every query of a batch and merges per query. Each shard clusters its own
+        sub-batch, so results are per-shard clustering results and can differ from one
+        BatchPOWERQueryProcessor over the union of the shards.
+    load(names=None), reload_shard(name), close():
+        Open shards ahead of use, reopen one shard after a rebuild, stop all shards.
+    info():
+        Object count and load time of every open shard.
+    """
+
+    def __init__(self, directory: str, mode: str = 'local', use_mmap: bool = True, on_unready: str = 'wait',
+                 **processor_kwargs):
+        """
+        Args:
+            directory: Root directory of the sharded index
+            mode: 'local' or 'process'
+            use_mmap: Memory-map the shards' text stores
+            on_unready: 'wait' or 'reject', for queries that need shards not loaded yet
+            processor_kwargs: Passed to each shard's BatchPOWERQueryProcessor
+        """
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode '{mode}', expected one of {sorted(SHARD_MODES)}")
+        if on_unready not in UNREADY_POLICIES:
+            raise ValueError(f"Unknown unready policy '{on_unready}', expected one of {UNREADY_POLICIES}")
+        self.directory = directory
+        self.mode = mode
+        self.use_mmap = use_mmap
+        self.on_unready = on_unready
+        self.processor_kwargs = processor_kwargs
+        self.manifest = load_manifest(directory)
+        self.shards: Dict[str, object] = {}
+        self.errors: Dict[str, Exception] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Event] = {}
+        self._warmer: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loaders: Dict[str, threading.Thread] = {}  # Background loads started by rejected queries
+
+    @classmethod
+    def open_async(cls, directory: str, query_log: Optional[str] = None, n_neg: int = 0,
+                   max_log_queries: int = 100000, **kwargs) -> 'ShardRouter':
+        """
+        Open a sharded index without waiting for it to load
+        Args:
+            query_log: Recent queries (see benchmark.workload.iter_query_log); the regions they
+                       hit most are loaded first. Only the first max_log_queries are read.
+            kwargs: Passed to ShardRouter
+        Returns:
+            The router, with its warm-up running in the background
+        """
+        router = cls(directory, **kwargs)
+        hot_queries = islice(iter_query_log(query_log, n_neg), max_log_queries) if query_log else None
+        router.warm_up(hot_queries)
+        return router
+
+    def _shard(self, name: str):
+        shard = self.shards.get(name)
+        if shard is not None:
+            return shard
+        with self._lock:
+            if name in self.shards:
+                return self.shards[name]
+            event = self._loading.get(name)
+            owner = event is None
+            if owner:
+                event = self._loading[name] = threading.Event()
+        if not owner:
+            event.wait()  # Another thread is loading this shard
+            if name not in self.shards and name in self.errors:
+                raise self.errors[name]
+            return self._shard(name)
+        try:
+            self.shards[name] = SHARD_MODES[self.mode](os.path.join(self.directory, name), self.use_mmap,
+                                                       **self.processor_kwargs)
+            self.errors.pop(name, None)
+        except Exception as e:
+            self.errors[name] = e
+            raise
+        finally:
+            with self._lock:
+                del self._loading[name]
+            event.set()
+        return self.shards[name]
+
+    def hot_shards(self, queries: Iterable[Dict]) -> List[str]:
+        """Names of the shards reached by queries, most often reached first"""
+        hits = Counter()
+        for query in queries:
+            radius = query.get('search_radius', max(10, query.get('lambda_factor', 0.5) * 100))
+            hits.update(self.shards_for(self._search_box(query['location'], radius)))
+        return [name for name, _ in hits.most_common()]
+
+    def _warm(self, hot_queries: Optional[Iterable[Dict]]) -> None:
+        order = self.hot_shards(hot_queries) if hot_queries is not None else []
+        order += [entry['name'] for entry in self.manifest['shards']
+                  if entry.get('extent') is not None and entry['name'] not in order]
+        for name in order:
+            if self._stop.is_set():
+                return
+            self._try_load(name)
+
+    def _try_load(self, name: str) -> None:
+        try:
+            self._shard(name)
+        except Exception:
+            pass  # Kept in self.errors; a query that needs the shard retries the load
+
+    def warm_up(self, hot_queries: Optional[Iterable[Dict]] = None, background: bool = True) -> None:
+        """
+        Load every non-empty shard, hottest first
+        Args:
+            hot_queries: Query dicts whose shards are loaded first, most often hit first;
+                         a lazy iterator (e.g. over a query log) is consumed on the warm-up thread
+            background: Return at once and load on a daemon thread
+        """
+        if not background:
+            self._warm(hot_queries)
+            return
+        if self._warmer is not None and self._warmer.is_alive():
+            return
+        self._stop.clear()
+        self._warmer = threading.Thread(target=self._warm, args=(hot_queries,), name='shard-warm-up', daemon=True)
+        self._warmer.start()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the warm-up and background loads; True if every non-empty shard is loaded"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            threads = list(self._loaders.values())
+        for thread in ([self._warmer] if self._warmer is not None else []) + threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return all(entry['name'] in self.shards for entry in self.manifest['shards']
+                   if entry.get('extent') is not None)
+
+    def status(self) -> Dict[str, str]:
+        """'ready', 'loading', 'failed' or 'cold' for every shard in the manifest"""
+        status = {}
+        for entry in self.manifest['shards']:
+            name = entry['name']
+            if name in self.shards:
+                status[name] = 'ready'
+            elif name in self._loading or (name in self._loaders and self._loaders[name].is_alive()):
+                status[name] = 'loading'
+            elif name in self.errors:
+                status[name] = 'failed'
+            else:
+                status[name] = 'cold'
+        return status
+
+    def ready(self, bounds) -> bool:
+        """Whether every shard a query over bounds needs is loaded"""
+        return all(name in self.shards for name in self.shards_for(bounds))
+
+    def _unready(self, names: Iterable[str]) -> List[str]:
+        if self.on_unready == 'wait':
+            return []
+        missing = [name for name in names if name not in self.shards]
+        if missing:
+            self._load_in_background(missing)
+        return missing
+
+    def _load_in_background(self, names: Iterable[str]) -> None:
+        # One loader thread per shard that is neither loaded nor being loaded
+        with self._lock:
+            for name in names:
+                loader = self._loaders.get(name)
+                if name in self._loading or (loader is not None and loader.is_alive()):
+                    continue
+                loader = threading.Thread(target=self._try_load, args=(name,), name=f'shard-load-{name}',
+                                          daemon=True)
+                self._loaders[name] = loader
+                loader.start()
+
+    def load(self, names: Optional[Sequence[str]] = None) -> None:
+        for name in (names if names is not None else [entry['name'] for entry in self.manifest['shards']]):
+            self._shard(name)
+
+    def reload_shard(self, name: str) -> None:
+        """Reopen a shard (and re-read the manifest) after it was rebuilt on disk"""
+        shard = self.shards.pop(name, None)
+        if shard is not None:
+            shard.close()
+        self.manifest = load_manifest(self.directory)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._warmer is not None:
+            self._warmer.join()
+        with self._lock:
+            loaders = list(self._loaders.values())
+            self._loaders.clear()
+        for loader in loaders:
+            loader.join()
+        for shard in self.shards.values():
+            shard.close()
+        self.shards.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def shards_for(self, bounds) -> List[str]:
+        x_min, y_min, x_max, y_max = bounds
+        names = []
+        for entry in self.manifest['shards']:
+            extent = entry.get('extent')
+            if extent is None:
+                continue  # Empty shard
+            if extent[0] <= x_max and extent[2] >= x_min and extent[1] <= y_max and extent[3] >= y_min:
+                names.append(entry['name'])
+        return names
+
+    @staticmethod
+    def _search_box(location, radius: float) -> Tuple[float, float, float, float]:
+        return (location[0] - radius, location[1] - radius, location[0] + radius, location[1] + radius)
+
+    def _scatter(self, requests: Dict[str, Tuple]) -> Dict[str, object]:
+        # Send to every shard first, then collect, so process shards work concurrently
+        pending = {name: self._shard(name).submit(*request) for name, request in requests.items()}
+        return {name: receive() for name, receive in pending.items()}
+
+    def process_query(self, location, positive_keywords, negative_keywords, k, lambda_factor=0.5,
+                      search_radius=10) -> List[Tuple]:
+        """
+        Top-k query over all shards
+        Returns:
+            (-score, obj_id, location, full_text) rows, best first, as process_query
+        """
+        request = ('query', location, positive_keywords, negative_keywords, k, lambda_factor, search_radius)
+        names = self.shards_for(self._search_box(location, search_radius))
+        missing = self._unready(names)
+        if missing:
+            raise RegionNotReady(missing)
+        partials = self._scatter({name: request for name in names})
+        return heapq.nsmallest(k, (row for rows in partials.values() for row in rows), key=lambda row: row[:2])
+
+    def process_batch_queries(self, queries: List[Dict], max_cluster_size: int = None) -> Dict[int, List[Tuple]]:
+        """
+        Process a batch of query dicts (see BatchPOWERQueryProcessor.process_batch_queries).
+        Each shard runs the sub-batch of queries that reach it, batched as usual.
+        With on_unready='reject', the queries that need shards not loaded yet are left
+        out and RegionNotReady carries the results of the others.
+        Returns:
+            Dictionary mapping query_id to (score, obj_id, location, full_text) rows, best first
+        """
+        sub_batches: Dict[str, List[Dict]] = {}
+        missing, rejected = set(), []
+        for i, query in enumerate(queries):
+            query = dict(query, query_id=query.get('query_id', i))
+            # Clustered batch queries search lambda_factor * 100 around each location
+            radius = max(10, query['lambda_factor'] * 100)
+            names = self.shards_for(self._search_box(query['location'], radius))
+            unready = self._unready(names)
+            if unready:
+                missing.update(unready)
+                rejected.append(query['query_id'])
+                continue
+            for name in names:
+                sub_batches.setdefault(name, []).append(query)
+
+        partials = self._scatter({name: ('batch', batch, max_cluster_size)
+                                  for name, batch in sub_batches.items()})
+        results = {query.get('query_id', i): [] for i, query in enumerate(queries)}
+        for shard_results in partials.values():
+            for query_id, rows in shard_results.items():
+                results[query_id].extend(rows)
+        for query_id in rejected:
+            del results[query_id]
+        k_of = {query.get('query_id', i): query['k'] for i, query in enumerate(queries)}
+        results = {query_id: heapq.nsmallest(k_of[query_id], rows, key=lambda row: (-row[0], row[1]))
+                   for query_id, rows in results.items()}
+        if rejected:
+            raise RegionNotReady(sorted(missing), results, rejected)
+        return results
+
+    def info(self) -> Dict[str, Dict]:
+        """Object count and load time of every open shard"""
+        return self._scatter({name: ('info',) for name in list(self.shards)})
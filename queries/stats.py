@@ -0,0 +1,98 @@
+from dataclasses import asdict, dataclass, field
+from time import perf_counter_ns
+from typing import Callable, Dict, List
+
+
+@dataclass
+class QueryStats:
+    """
+    Execution counters of one query (or one batch) collected when a stats object is passed
+    to the index or a query processor. Nothing is counted when no stats object is given.
+
+    Attributes:
+        nodes_visited (int): Quadtree nodes visited by range or best-first traversals.
+        nodes_pruned (int): Nodes skipped by bounds, keyword summaries or Bloom filters.
+        leaves_scanned (int): Leaves whose objects were examined.
+        objects_examined (int): Objects inside the search box that were looked at.
+        candidates (int): Objects passing the keyword filters.
+        objects_scored (int): Score computations (per query, so a batch cluster counts
+            every candidate once for every query it is scored against).
+        heap_ops (int): Pushes and push-pops on frontier and top-k heaps.
+        results (int): Result rows returned.
+        queries (int): Queries covered by these counters.
+        clusters (int): Query clusters formed by the batch processor.
+        cache_hits (int): Leaves a batch cluster found in the batch's leaf-slice cache.
+        cache_misses (int): Leaves sliced for the batch cache (object records looked up).
+        phase_ns (dict): Nanoseconds spent per phase ('grouping', 'range_query',
+            'prefilter', 'search', 'scoring', 'materialize').
+    """
+    nodes_visited: int = 0
+    nodes_pruned: int = 0
+    leaves_scanned: int = 0
+    objects_examined: int = 0
+    candidates: int = 0
+    objects_scored: int = 0
+    heap_ops: int = 0
+    results: int = 0
+    queries: int = 0
+    clusters: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    phase_ns: Dict[str, int] = field(default_factory=dict)
+
+    COUNTERS = ('nodes_visited', 'nodes_pruned', 'leaves_scanned', 'objects_examined', 'candidates',
+                'objects_scored', 'heap_ops', 'results', 'queries', 'clusters', 'cache_hits', 'cache_misses')
+
+    def merge(self, other: 'QueryStats') -> 'QueryStats':
+        """Add another stats object's counters and phase times into this one"""
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for phase, ns in other.phase_ns.items():
+            self.phase_ns[phase] = self.phase_ns.get(phase, 0) + ns
+        return self
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def aggregate(cls, stats: List['QueryStats']) -> Dict[str, float]:
+        """Mean of every counter and phase time (in ms) per query over a list of stats"""
+        total = cls()
+        for item in stats:
+            total.merge(item)
+        queries = max(total.queries, 1)
+        summary = {name: getattr(total, name) / queries for name in cls.COUNTERS if name != 'queries'}
+        summary.update({f'{phase}_ms': ns / 1e6 / queries for phase, ns in total.phase_ns.items()})
+        summary['queries'] = total.queries
+        return summary
+
+
+# hook(phase, stats, elapsed_ns), called when a phase of an instrumented query ends
+PhaseHook = Callable[[str, QueryStats, int], None]
+
+
+class PhaseTimer:
+    """
+    Records phase boundaries into a QueryStats and forwards them to hooks.
+
+    Usage:
+        timer = PhaseTimer(stats, hooks)
+        ...                      # first phase
+        timer.lap('range_query')
+        ...                      # next phase
+        timer.lap('scoring')
+    """
+    __slots__ = ('stats', 'hooks', 'last')
+
+    def __init__(self, stats: QueryStats, hooks: List[PhaseHook] = ()):
+        self.stats = stats
+        self.hooks = hooks
+        self.last = perf_counter_ns()
+
+    def lap(self, phase: str) -> None:
+        now = perf_counter_ns()
+        elapsed = now - self.last
+        self.stats.phase_ns[phase] = self.stats.phase_ns.get(phase, 0) + elapsed
+        for hook in self.hooks:
+            hook(phase, self.stats, elapsed)
+        self.last = perf_counter_ns()
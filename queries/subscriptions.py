@@ -0,0 +1,244 @@
+from bisect import insort
+from collections import defaultdict
+from itertools import count
+from math import floor, hypot, sqrt
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from models.compact import QUANT_MAX
+from queries.power import POWERQueryProcessor
+
+FLOAT32_EPS = float(np.finfo(np.float32).eps)  # Twice the relative rounding error of a float32 weight
+
+
+class Subscription:
+    """
+    A standing top-k query.
+
+    Attributes
+    ----------
+    subscription_id : hashable
+        Id given at subscription.
+    location, positive_keywords, negative_keywords, k, lambda_factor, search_radius :
+        Query parameters, as for POWERQueryProcessor.process_query.
+    callback : callable
+        callback(subscription, entered, evicted), called when inserted objects enter the
+        top-k; entered and evicted are (-score, obj_id, location, full_text) rows.
+    results : list
+        Current top-k rows, best first, as process_query returns them.
+    notifications : int
+        How many times callback was called.
+    """
+
+    def __init__(self, subscription_id: Hashable, location, positive_keywords: List[str],
+                 negative_keywords: List[str], k: int, lambda_factor: float, search_radius: float,
+                 callback: Callable):
+        self.subscription_id = subscription_id
+        self.location = tuple(location)
+        self.positive_keywords = list(positive_keywords)
+        self.negative_keywords = list(negative_keywords)
+        self.positive_set = set(positive_keywords)
+        self.negative_set = set(negative_keywords)
+        self.k = k
+        self.lambda_factor = lambda_factor
+        self.search_radius = search_radius
+        self.callback = callback
+        self.results: List[Tuple] = []
+        self.notifications = 0
+
+    def box(self) -> Tuple[float, float, float, float]:
+        x, y = self.location
+        r = self.search_radius
+        return (x - r, y - r, x + r, y + r)
+
+    def matches(self, keywords) -> bool:
+        if self.positive_set.isdisjoint(keywords):
+            return False
+        return not (self.negative_set and not self.negative_set.isdisjoint(keywords))
+
+    def score(self, location, keywords) -> Optional[float]:
+        """Score of an object for this query, or None when it is outside the search box"""
+        x, y = self.location
+        r = self.search_radius
+        if not (x - r <= location[0] <= x + r and y - r <= location[1] <= y + r):
+            return None
+        # Same arithmetic as POWERQueryProcessor, so scores (and ties) agree bit for bit
+        dx = location[0] - x
+        dy = location[1] - y
+        spatial = 1 - sqrt(dx * dx + dy * dy) / 100
+        textual = sum(keywords[word] for word in self.positive_keywords if word in keywords)
+        return self.lambda_factor * spatial + (1 - self.lambda_factor) * textual
+
+    def packed_error(self, keywords, distance_error: float) -> float:
+        """
+        Bound on how far packing an object's leaf can move its score
+        Args:
+            distance_error: Bound on how far packing moves a location
+        """
+        error = self.lambda_factor * distance_error / 100
+        weights = [keywords[word] for word in self.positive_keywords if word in keywords]
+        if any(np.float32(weight) != weight for weight in weights):
+            error += (1 - self.lambda_factor) * FLOAT32_EPS * sum(abs(weight) for weight in weights)
+        return error
+
+
+class SubscriptionManager:
+    """
+    Standing queries matched against the objects added to an index.
+
+    The registered queries are themselves indexed: by a uniform grid of cell_size cells
+    over their search boxes, and by positive keyword. Every object inserted through
+    TEQIndex.add_object or add_batch (delivered by an insert hook) is tested only
+    against the subscriptions whose box shares its cell and that have one of its
+    keywords as a positive keyword. Since objects are only ever added, the new top-k of
+    an affected subscription is the top-k of its previous results and the new objects,
+    which is merged in place; the callback then receives the rows that entered and
+    left the top-k. On a compact index, where packing moves scores slightly, a
+    subscription that a new object may enter is re-run instead, which still only
+    touches the subscriptions that object reaches.
+
+    Results equal POWERQueryProcessor.process_query after every insert.
+
+    Methods
+    -------
+    subscribe(location, positive_keywords, negative_keywords, k, callback, lambda_factor=0.5,
+              search_radius=10, subscription_id=None):
+        Registers a standing query, computes its top-k and returns the Subscription.
+    unsubscribe(subscription_id):
+        Drops a subscription.
+    affected(location, keywords):
+        Subscriptions an object with these keywords inserted at location could enter.
+    close():
+        Drops every subscription and detaches from the index.
+    """
+
+    def __init__(self, teq_index, cell_size: float = 5.0, processor: Optional[POWERQueryProcessor] = None):
+        """
+        Args:
+            teq_index: The TEQIndex whose inserts are matched
+            cell_size: Side of the grid cells the subscriptions' boxes are indexed by
+            processor: POWERQueryProcessor for initial results (one over teq_index by default)
+        """
+        self.teq_index = teq_index
+        self.cell_size = cell_size
+        self.processor = processor or POWERQueryProcessor(teq_index)
+        self.subscriptions: Dict[Hashable, Subscription] = {}
+        self.cells: Dict[Tuple[int, int], Set[Hashable]] = defaultdict(set)
+        self.by_keyword: Dict[str, Set[Hashable]] = defaultdict(set)
+        self.objects_seen = self.checked = self.notified = 0
+        self._ids = count()
+        teq_index.add_insert_hook(self._on_insert)
+
+    def subscribe(self, location, positive_keywords, negative_keywords, k, callback: Callable,
+                  lambda_factor=0.5, search_radius=10, subscription_id: Optional[Hashable] = None) -> Subscription:
+        if subscription_id is None:
+            subscription_id = next(self._ids)
+        if subscription_id in self.subscriptions:
+            raise ValueError(f"Subscription '{subscription_id}' already exists")
+        subscription = Subscription(subscription_id, location, positive_keywords, negative_keywords, k,
+                                    lambda_factor, search_radius, callback)
+        subscription.results = self._run(subscription)
+        self.subscriptions[subscription_id] = subscription
+        for cell in self._cells(subscription.box()):
+            self.cells[cell].add(subscription_id)
+        for word in subscription.positive_set:
+            self.by_keyword[word].add(subscription_id)
+        return subscription
+
+    def unsubscribe(self, subscription_id: Hashable) -> None:
+        subscription = self.subscriptions.pop(subscription_id, None)
+        if subscription is None:
+            return
+        for cell in self._cells(subscription.box()):
+            self._discard(self.cells, cell, subscription_id)
+        for word in subscription.positive_set:
+            self._discard(self.by_keyword, word, subscription_id)
+
+    def close(self) -> None:
+        self.subscriptions.clear()
+        self.cells.clear()
+        self.by_keyword.clear()
+        self.teq_index.remove_insert_hook(self._on_insert)
+
+    def affected(self, location, keywords) -> List[Subscription]:
+        in_cell = self.cells.get(self._cell(location[0], location[1]))
+        if not in_cell:
+            return []
+        by_keyword = set()
+        for word in keywords:
+            by_keyword.update(self.by_keyword.get(word, ()))
+        ids = in_cell & by_keyword
+        return [self.subscriptions[subscription_id] for subscription_id in ids
+                if self.subscriptions[subscription_id].matches(keywords)]
+
+    def _run(self, subscription: Subscription) -> List[Tuple]:
+        return self.processor.process_query(subscription.location, subscription.positive_keywords,
+                                            subscription.negative_keywords, subscription.k,
+                                            subscription.lambda_factor, subscription.search_radius)
+
+    def _packed_distance_error(self) -> float:
+        # Packed coordinates are fixed point over the index bounds (see PackedLeaf.encode) and
+        # move by at most half a step per axis; a whole step also covers the float rounding
+        bounds = self.teq_index.metadata['bounds']
+        steps = [max(bounds[axis + 2] - bounds[axis], 1e-12) / QUANT_MAX for axis in (0, 1)]
+        return hypot(*steps)
+
+    def _on_insert(self, rows) -> None:
+        compact = bool(self.teq_index.metadata.get('compact'))
+        distance_error = self._packed_distance_error() if compact else 0.0
+        # Subscription id -> (-score, obj_id) of the new objects that reach its top-k
+        candidates: Dict[Hashable, List[Tuple[float, Hashable]]] = defaultdict(list)
+        for obj_id, location, keywords in rows:
+            self.objects_seen += 1
+            for subscription in self.affected(location, keywords):
+                self.checked += 1
+                score = subscription.score(location, keywords)
+                if score is None or subscription.k <= 0:
+                    continue
+                results = subscription.results
+                if len(results) == subscription.k:
+                    error = subscription.packed_error(keywords, distance_error) if compact else 0.0
+                    if (-score - error, obj_id) > results[-1][:2]:
+                        continue
+                candidates[subscription.subscription_id].append((-score, obj_id))
+
+        for subscription_id, new in candidates.items():
+            subscription = self.subscriptions[subscription_id]
+            previous = subscription.results
+            if compact:
+                results = self._run(subscription)
+            else:
+                ranked = [(row[0], row[1]) for row in previous]
+                for key in new:
+                    insort(ranked, key)
+                del ranked[subscription.k:]
+                known = {row[1]: row for row in previous}
+                fresh = self.teq_index.materialize([key for key in ranked if key[1] not in known])
+                fresh = {row[1]: row for row in fresh}
+                results = [known.get(obj_id) or fresh[obj_id] for _, obj_id in ranked]
+            before = {row[1] for row in previous}
+            after = {row[1] for row in results}
+            subscription.results = results
+            entered = [row for row in results if row[1] not in before]
+            if entered:
+                evicted = [row for row in previous if row[1] not in after]
+                subscription.notifications += 1
+                self.notified += 1
+                subscription.callback(subscription, entered, evicted)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return (floor(x / self.cell_size), floor(y / self.cell_size))
+
+    def _cells(self, box) -> List[Tuple[int, int]]:
+        i_min, j_min = self._cell(box[0], box[1])
+        i_max, j_max = self._cell(box[2], box[3])
+        return [(i, j) for i in range(i_min, i_max + 1) for j in range(j_min, j_max + 1)]
+
+    @staticmethod
+    def _discard(table: Dict, key, subscription_id: Hashable) -> None:
+        ids = table.get(key)
+        if ids is not None:
+            ids.discard(subscription_id)
+            if not ids:
+                del table[key]
@@ -24,7 +24,8 @@ types of spatial-keyword queries. Given the U-Ask paper cited below:
     url="https://github.com/VjayRam/SpatialComputing-Project",
     authors=["Vijay Ram Enaganti", "Manoj Manjunatha","Anirudh Nittur Venkatesh"],
     author_email=["venag001@ucr.edu","mmanj008@ucr.edu","anitt003@ucr.edu"],
-    packages=["benchmark","index","queries"],
+    packages=["benchmark","index","models","queries","utils"],
     install_requires=[],
     include_package_data=True,
+    entry_points={"console_scripts": ["uask=utils.cli:main"]},
 )
\ No newline at end of file
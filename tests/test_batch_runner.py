@@ -0,0 +1,94 @@
+import json
+import random
+import threading
+
+import pytest
+
+from benchmark.workload import write_query_log
+from index.teq_index import TEQIndex
+from queries.batch_query import BatchPOWERQueryProcessor
+from queries.batch_runner import BatchJob, load_binary_results
+
+BOUNDS = (-90.0, -180.0, 90.0, 180.0)
+VOCABULARY = ['cafe', 'bar', 'wifi', 'closed', 'park', 'food']
+
+
+@pytest.fixture(scope='module')
+def processor():
+    rnd = random.Random(2)
+    teq_index = TEQIndex(BOUNDS, capacity=64)
+    records = []
+    for i in range(3000):
+        location = (rnd.gauss(10, 5), rnd.gauss(20, 5))
+        words = rnd.sample(VOCABULARY, rnd.randint(1, 3))
+        records.append((i, location, words, ' '.join(words)))
+    teq_index.add_batch(records)
+    return BatchPOWERQueryProcessor(teq_index)
+
+
+def write_queries(path, n=250, seed=4, query_id=None):
+    rnd = random.Random(seed)
+    queries = [{'location': [rnd.gauss(10, 5), rnd.gauss(20, 5)],
+                'positive_keywords': rnd.sample(VOCABULARY[:3], rnd.randint(1, 2)),
+                'negative_keywords': rnd.sample(['closed'], rnd.randint(0, 1)),
+                'k': rnd.choice([1, 5, 10]), 'lambda_factor': rnd.choice([0.1, 0.5])}
+               for _ in range(n)]
+    if query_id is not None:
+        queries[-1]['query_id'] = query_id
+    write_query_log(queries, path)
+
+
+@pytest.mark.parametrize('output_format', ['jsonl', 'binary'])
+def test_resumed_job_output_is_byte_identical(tmp_path, processor, output_format):
+    queries = str(tmp_path / 'queries.jsonl')
+    write_queries(queries)
+    job_kwargs = dict(chunk_size=60, batch_size=25, output_format=output_format)
+
+    whole = BatchJob(processor, queries, str(tmp_path / 'whole.out'), **job_kwargs).run()
+    assert whole['complete'] and whole['queries'] == 250
+
+    job = BatchJob(processor, queries, str(tmp_path / 'resumed.out'), **job_kwargs)
+    first = job.run(max_chunks=1)
+    assert not first['complete'] and first['chunks'] == 1 and first['queries'] == 60
+    # Output written after the checkpoint (a crash mid-chunk) is dropped on resume
+    with open(tmp_path / 'resumed.out', 'ab') as f:
+        f.write(b'partial chunk')
+    resumed = BatchJob(processor, queries, str(tmp_path / 'resumed.out'), **job_kwargs).run()
+    assert resumed['complete'] and resumed['chunks'] == 5
+    assert resumed['queries'] == whole['queries'] and resumed['results'] == whole['results']
+
+    assert (tmp_path / 'resumed.out').read_bytes() == (tmp_path / 'whole.out').read_bytes()
+    if output_format == 'binary':
+        records = load_binary_results(str(tmp_path / 'whole.out'))
+        assert len(records) == whole['results']
+        assert sorted(set(records['query_id'].tolist())) == list(range(250))
+    else:
+        lines = (tmp_path / 'whole.out').read_text().splitlines()
+        assert sorted(json.loads(line)['query_id'] for line in lines) == list(range(250))
+
+
+def test_binary_job_refuses_string_ids(tmp_path, processor):
+    queries = str(tmp_path / 'queries.jsonl')
+    write_queries(queries, query_id='q-last')
+    job = BatchJob(processor, queries, str(tmp_path / 'out.bin'), chunk_size=100, output_format='binary')
+    with pytest.raises(ValueError, match='q-last'):
+        job.run()
+    # The job stops at the chunk holding the bad id, with the output at the last checkpoint
+    with open(job.checkpoint_path) as f:
+        checkpoint = json.load(f)
+    assert checkpoint['chunks'] == 2 and not checkpoint['complete']
+    assert (tmp_path / 'out.bin').stat().st_size == checkpoint['output_offset']
+
+    jsonl = BatchJob(processor, queries, str(tmp_path / 'out.jsonl'), chunk_size=100).run()
+    assert jsonl['complete'] and jsonl['queries'] == 250
+
+
+def test_job_shuts_down_scoring_threads(tmp_path, processor, monkeypatch):
+    monkeypatch.setattr('queries.batch_query.MIN_THREADED_PAIRS', 0)  # Score every cluster threaded
+    queries = str(tmp_path / 'queries.jsonl')
+    write_queries(queries, n=50)
+    threaded = BatchPOWERQueryProcessor(processor.teq_index, score_threads=2)
+    checkpoint = BatchJob(threaded, queries, str(tmp_path / 'out.jsonl'), chunk_size=20).run()
+    assert checkpoint['complete']
+    assert threaded._score_pool is None
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('batch-score')]
@@ -0,0 +1,156 @@
+import random
+
+import numpy as np
+import pytest
+
+from index.teq_index import TEQIndex
+from models.compact import PackedLeaf, quantize, varint_decode, varint_encode
+from queries.power import POWERQueryProcessor
+
+BOUNDS = (-90.0, -180.0, 90.0, 180.0)
+VOCABULARY = ['cafe', 'bar', 'wifi', 'closed', 'park', 'food', 'hotel', 'shop']
+WEIGHTS = (0.25, 0.5, 1.0, 2.0)  # Exact in float32, so packed scores equal plain ones
+
+
+def random_leaf(rng, n, with_empty=True, unit_weights=False):
+    coords = np.column_stack([rng.uniform(-90, 90, n), rng.uniform(-180, 180, n)])
+    keywords = []
+    for i in range(n):
+        if with_empty and i % 7 == 0:
+            keywords.append({})  # Object without keywords
+            continue
+        words = rng.choice(VOCABULARY, size=int(rng.integers(1, 4)), replace=False).tolist()
+        keywords.append({word: 1.0 if unit_weights else float(rng.choice(WEIGHTS)) for word in words})
+    return coords, keywords
+
+
+@pytest.mark.parametrize('values', [
+    [],
+    [0],
+    [0, 1, 127, 128, 255, 16383, 16384, 2**21 - 1, 2**21, 2**35 + 17],
+    [2**63, 2**64 - 1, 0, 300],
+])
+def test_varint_round_trip(values):
+    encoded = varint_encode(np.array(values, dtype=np.uint64))
+    assert varint_decode(encoded).tolist() == values
+
+
+def test_varint_byte_lengths():
+    assert len(varint_encode(np.array([127], dtype=np.uint64))) == 1
+    assert len(varint_encode(np.array([128], dtype=np.uint64))) == 2
+    assert len(varint_encode(np.array([2**64 - 1], dtype=np.uint64))) == 10
+
+
+def test_quantize_error_is_within_half_a_step():
+    rng = np.random.default_rng(0)
+    coords = np.column_stack([rng.uniform(-90, 90, 1000), rng.uniform(-180, 180, 1000)])
+    coords[0] = BOUNDS[:2]
+    coords[1] = BOUNDS[2:]
+    leaf = PackedLeaf.encode(coords, [{}] * len(coords), BOUNDS)
+    assert leaf.qcoords.dtype == np.uint32
+    assert np.all(np.abs(leaf.coords() - coords) <= leaf.step / 2 + 1e-12)
+    assert leaf.qcoords[0].tolist() == [0, 0]
+    assert leaf.qcoords[1].tolist() == [2**32 - 1, 2**32 - 1]
+    # Out-of-bounds values clip to the frame instead of wrapping
+    assert quantize(np.array([[-1000.0, 1000.0]]), leaf.origin, leaf.step).tolist() == [[0, 2**32 - 1]]
+
+
+def test_empty_leaf():
+    leaf = PackedLeaf.encode(np.empty((0, 2)), [], BOUNDS)
+    assert len(leaf) == 0
+    assert leaf.coords().shape == (0, 2)
+    assert leaf.keywords() == []
+    positions, textual = leaf.match(['cafe'], ['bar'])
+    assert positions.size == 0 and textual.size == 0
+
+
+@pytest.mark.parametrize('unit_weights', [False, True])
+def test_keywords_round_trip(unit_weights):
+    rng = np.random.default_rng(1)
+    # Enough objects that position deltas need multi-byte varints in the shared blob
+    coords, keywords = random_leaf(rng, 600, unit_weights=unit_weights)
+    leaf = PackedLeaf.encode(coords, keywords, BOUNDS)
+    assert (leaf.weights is None) == unit_weights
+    assert leaf.keywords() == keywords
+    postings = leaf.postings()
+    for word in VOCABULARY:
+        expected = [i for i, object_keywords in enumerate(keywords) if word in object_keywords]
+        assert postings.get(word, np.empty(0)).tolist() == expected
+
+
+def test_keywords_round_trip_single_keyword_objects():
+    keywords = [{'cafe': 2.0}, {}, {'bar': 0.5}, {'cafe': 1.0}]
+    leaf = PackedLeaf.encode(np.zeros((4, 2)), keywords, BOUNDS)
+    assert leaf.keywords() == keywords
+
+
+def brute_force_match(keywords, positive, negative, idx, any_positive):
+    positions, textual = [], []
+    for i, object_keywords in enumerate(keywords):
+        if idx is not None and i not in idx:
+            continue
+        if any_positive and not any(word in object_keywords for word in positive):
+            continue
+        if any(word in object_keywords for word in negative):
+            continue
+        positions.append(i)
+        textual.append(sum(object_keywords[word] for word in positive if word in object_keywords))
+    return positions, textual
+
+
+@pytest.mark.parametrize('any_positive', [True, False])
+@pytest.mark.parametrize('use_idx', [False, True])
+def test_match_equals_brute_force(any_positive, use_idx):
+    rng = np.random.default_rng(2)
+    coords, keywords = random_leaf(rng, 300)
+    leaf = PackedLeaf.encode(coords, keywords, BOUNDS)
+    idx = np.sort(rng.choice(300, 120, replace=False)) if use_idx else None
+    for positive, negative in [(['cafe'], []), (['cafe', 'wifi'], ['closed']), (['missing'], ['bar']),
+                               (['hotel', 'shop', 'food'], ['park', 'missing'])]:
+        positions, textual = leaf.match(positive, negative, idx, any_positive)
+        expected_positions, expected_textual = brute_force_match(
+            keywords, positive, negative, None if idx is None else set(idx.tolist()), any_positive)
+        assert positions.tolist() == expected_positions
+        assert textual.tolist() == expected_textual
+
+
+def build_index(compact, n=4000, seed=3):
+    rnd = random.Random(seed)
+    teq_index = TEQIndex(BOUNDS, capacity=64, compact=compact)
+    records = []
+    for i in range(n):
+        if i % 2:
+            location = (rnd.gauss(10, 1), rnd.gauss(20, 1))
+        else:
+            location = (rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+        words = rnd.sample(VOCABULARY, rnd.randint(1, 3))
+        records.append((i, location, words, ' '.join(words), [rnd.choice(WEIGHTS) for _ in words]))
+    teq_index.add_batch(records)
+    return teq_index
+
+
+def test_compact_top_k_equals_plain():
+    plain, compact = POWERQueryProcessor(build_index(False)), POWERQueryProcessor(build_index(True))
+    assert any(leaf.packed is not None for leaf, _ in compact.teq_index.spatial_index.range_slices(BOUNDS))
+    rnd = random.Random(4)
+    for i in range(200):
+        location = (rnd.gauss(10, 1), rnd.gauss(20, 1)) if i % 2 else (rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+        positive = rnd.sample(VOCABULARY, 2)
+        negative = rnd.sample([word for word in VOCABULARY if word not in positive], 1) if i % 3 else []
+        args = (location, positive, negative, rnd.choice([1, 5, 10]), rnd.choice([0.0, 0.5, 0.9]),
+                rnd.choice([2.0, 10.0, 50.0]))
+        assert [row[1] for row in compact.process_query(*args)] == [row[1] for row in plain.process_query(*args)]
+
+
+def test_add_object_keeps_compact_index_packed():
+    teq_index = build_index(True, n=1000)
+    processor = POWERQueryProcessor(teq_index)
+    rnd = random.Random(9)
+    for obj_id in range(1000, 1300):  # Enough inserts into one cluster to split leaves
+        teq_index.add_object(obj_id, (rnd.gauss(10, 1), rnd.gauss(20, 1)), ['gym'], 'gym', [1.0])
+    assert all(leaf.packed is not None for leaf, _ in teq_index.spatial_index.range_slices(BOUNDS))
+    before = processor.process_query((10.0, 20.0), ['gym'], [], 20, 0.5, 5.0)
+    assert len(before) == 20
+    # Packing after a later batch leaves the new objects' scores as they were
+    teq_index.add_batch([(2000, (-50.0, -100.0), ['bar'], 'bar')])
+    assert processor.process_query((10.0, 20.0), ['gym'], [], 20, 0.5, 5.0) == before
@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from index.teq_index import TEQIndex
+from queries.continuous import ContinuousQueryProcessor
+from queries.power import POWERQueryProcessor
+
+BOUNDS = (-90.0, -180.0, 90.0, 180.0)
+VOCABULARY = ['cafe', 'bar', 'wifi', 'closed', 'park', 'food']
+WEIGHTS = (0.25, 0.5, 1.0, 2.0)  # Exact in float32, so packed scores equal plain ones
+
+
+def random_record(rnd, obj_id):
+    location = (rnd.gauss(10, 3), rnd.gauss(20, 3))
+    words = rnd.sample(VOCABULARY, rnd.randint(1, 3))
+    return obj_id, location, words, ' '.join(words), [rnd.choice(WEIGHTS) for _ in words]
+
+
+def build_index(compact, n=3000, seed=1):
+    rnd = random.Random(seed)
+    teq_index = TEQIndex(BOUNDS, capacity=64, compact=compact)
+    teq_index.add_batch([random_record(rnd, i) for i in range(n)])
+    return teq_index
+
+
+def register_queries(processor, rnd, n=12):
+    return [processor.register((rnd.gauss(10, 2), rnd.gauss(20, 2)), rnd.sample(VOCABULARY[:3], rnd.randint(1, 2)),
+                               rnd.sample(['closed'], rnd.randint(0, 1)), rnd.choice([1, 5, 10]),
+                               rnd.choice([0.0, 0.3, 0.8]), rnd.choice([2, 5]))
+            for _ in range(n)]
+
+
+def expected(power, query, location=None):
+    return power.process_query(location or query.location, query.positive_keywords, query.negative_keywords,
+                               query.k, query.lambda_factor, query.search_radius)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_updates_equal_process_query(compact):
+    rnd = random.Random(7)
+    teq_index = build_index(compact)
+    power = POWERQueryProcessor(teq_index)
+    processor = ContinuousQueryProcessor(teq_index)
+    queries = register_queries(processor, rnd)
+    for query in queries:
+        assert query.results == expected(power, query)
+
+    next_id = 3000
+    for step in range(300):
+        query = rnd.choice(queries)
+        if step % 50 == 49:
+            # New objects while queries are registered, one at a time and in a batch
+            batch = [random_record(rnd, next_id + i) for i in range(20)]
+            teq_index.add_batch(batch)
+            teq_index.add_object(*random_record(rnd, next_id + 20))
+            next_id += 21
+            for other in queries:
+                assert other.results == expected(power, other)
+        jump = 3.0 if rnd.random() < 0.1 else 0.2
+        location = (query.location[0] + rnd.uniform(-jump, jump), query.location[1] + rnd.uniform(-jump, jump))
+        results, safe_region = processor.update(query.query_id, location)
+        assert results == expected(power, query, location)
+        assert safe_region is query.safe_region
+    processor.close()
+    assert not teq_index.insert_hooks
+
+
+def test_counters_follow_safe_region_and_margin():
+    rnd = random.Random(3)
+    teq_index = build_index(False)
+    processor = ContinuousQueryProcessor(teq_index)
+    queries = register_queries(processor, rnd)
+    counts = {'hits': 0, 'rescored': 0, 'refetched': 0}
+    for _ in range(400):
+        query = rnd.choice(queries)
+        jump = rnd.choice([0.01, 0.5, 4.0])
+        location = (query.location[0] + rnd.uniform(-jump, jump), query.location[1] + rnd.uniform(-jump, jump))
+        if query.safe_region.contains(location):
+            kind = 'hits'
+        elif max(abs(location[0] - query.anchor[0]), abs(location[1] - query.anchor[1])) <= query.margin:
+            kind = 'rescored'
+        else:
+            kind = 'refetched'
+        before = (query.hits, query.rescored, query.refetched)
+        processor.update(query.query_id, location)
+        after = (query.hits, query.rescored, query.refetched)
+        assert [b - a for a, b in zip(before, after)] == [kind == name for name in counts]
+        counts[kind] += 1
+        if kind == 'refetched':
+            assert query.anchor == location
+    assert all(counts.values())
+    assert counts == {name: sum(getattr(query, name) for query in queries) for name in counts}
+
+
+def test_insert_refetches_only_the_queries_it_reaches():
+    teq_index = build_index(False)
+    power = POWERQueryProcessor(teq_index)
+    processor = ContinuousQueryProcessor(teq_index)
+    near = processor.register((10.0, 20.0), ['cafe'], [], 3, 0.5, 2)
+    far = processor.register((-50.0, -100.0), ['cafe'], [], 3, 0.5, 2)
+    near_ids, far_results = list(near.ids), far.results
+    assert far_results == []
+
+    # A best possible object right at the query location enters the top-k at once
+    teq_index.add_object(99999, (10.0, 20.0), ['cafe'], 'cafe', [2.0])
+    assert near.results[0][1] == 99999 and near.results == expected(power, near)
+    assert sorted(near.ids, key=str) == sorted(near_ids + [99999], key=str)
+    assert far.results == far_results
+
+    # Objects that do not match the query's keywords leave it alone
+    teq_index.add_batch([(100000, (10.0, 20.0), ['bar'], 'bar', [2.0])])
+    assert 100000 not in near.ids
+    assert near.results == expected(power, near)
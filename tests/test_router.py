@@ -0,0 +1,199 @@
+import os
+import random
+
+import pytest
+
+from benchmark.workload import write_query_log
+from index.shards import build_shards, grid_regions, load_manifest, rebuild_shard
+from index.teq_index import TEQIndex
+from queries.power import POWERQueryProcessor
+from queries.router import SHARD_MODES, LocalShard, RegionNotReady, ShardRouter
+
+BOUNDS = (0.0, 0.0, 100.0, 100.0)
+VOCABULARY = ['cafe', 'bar', 'wifi', 'closed', 'park', 'food']
+WEIGHTS = (0.25, 0.5, 1.0, 2.0)
+
+
+def random_records(n=1500, seed=5, bounds=BOUNDS):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(n):
+        location = (rnd.uniform(bounds[0], bounds[2]), rnd.uniform(bounds[1], bounds[3]))
+        words = rnd.sample(VOCABULARY, rnd.randint(1, 3))
+        records.append((i, location, words, ' '.join(words), [rnd.choice(WEIGHTS) for _ in words]))
+    return records
+
+
+def single_index(records, bounds=BOUNDS):
+    teq_index = TEQIndex(bounds, capacity=32)
+    teq_index.add_batch(records)
+    return POWERQueryProcessor(teq_index)
+
+
+def random_queries(n=60, seed=11):
+    rnd = random.Random(seed)
+    return [((rnd.uniform(0, 100), rnd.uniform(0, 100)), rnd.sample(VOCABULARY, rnd.randint(1, 2)),
+             rnd.sample(['closed'], rnd.randint(0, 1)), rnd.choice([1, 5, 10]), rnd.choice([0.0, 0.3, 0.8]),
+             rnd.choice([5, 15, 30]))
+            for _ in range(n)]
+
+
+@pytest.mark.parametrize('mode', ['local', 'process'])
+def test_router_equals_single_index(tmp_path, mode):
+    records = random_records()
+    build_shards(records, grid_regions(BOUNDS, 3, 3), str(tmp_path), capacity=32)
+    reference = single_index(records)
+    with ShardRouter(str(tmp_path), mode=mode) as router:
+        for query in random_queries():
+            assert router.process_query(*query) == reference.process_query(*query)
+
+
+@pytest.mark.parametrize('mode', ['local', 'process'])
+def test_cross_shard_tie_breaks_on_obj_id(tmp_path, mode):
+    bounds = (0.0, 0.0, 10.0, 10.0)
+    # Equal scores for a query at (5, 5); the lower id is in the second shard
+    records = [(9, (4.0, 5.0), ['cafe'], 'cafe'), (1, (6.0, 5.0), ['cafe'], 'cafe')]
+    build_shards(records, grid_regions(bounds, 2, 1), str(tmp_path))
+    reference = single_index(records, bounds)
+    with ShardRouter(str(tmp_path), mode=mode) as router:
+        for k in (1, 2):
+            expected = reference.process_query((5.0, 5.0), ['cafe'], [], k)
+            assert router.process_query((5.0, 5.0), ['cafe'], [], k) == expected
+        assert expected[0][1] == 1
+
+
+def test_batch_ties_break_on_obj_id(tmp_path):
+    bounds = (0.0, 0.0, 10.0, 10.0)
+    records = [(9, (4.0, 5.0), ['cafe'], 'cafe'), (1, (6.0, 5.0), ['cafe'], 'cafe')]
+    build_shards(records, grid_regions(bounds, 2, 1), str(tmp_path))
+    query = {'location': (5.0, 5.0), 'positive_keywords': ['cafe'], 'negative_keywords': [], 'k': 1,
+             'lambda_factor': 0.5}
+    with ShardRouter(str(tmp_path)) as router:
+        results = router.process_batch_queries([query])
+    assert [row[1] for row in results[0]] == [1]
+
+
+def test_rebuild_and_reload_shard(tmp_path):
+    records = random_records()
+    directory = str(tmp_path)
+    build_shards(records, grid_regions(BOUNDS, 2, 2), directory, capacity=32)
+    query = ((25.0, 25.0), ['cafe', 'bar'], [], 10, 0.5, 30)
+    with ShardRouter(directory) as router:
+        assert router.process_query(*query) == single_index(records).process_query(*query)
+
+        # Shard 0 holds (0, 0)-(50, 50); rebuild it with half of its objects
+        changed = [(obj_id, location, words, text, weights)
+                   for obj_id, location, words, text, weights in records if obj_id % 2]
+        entry = rebuild_shard(directory, 'shard_000', changed)
+        in_first = [record[1][0] <= 50 and record[1][1] <= 50 for record in records]
+        rebuilt = [record for record, first in zip(records, in_first) if record[0] % 2 or not first]
+        assert entry['objects'] == sum(1 for record, first in zip(records, in_first) if record[0] % 2 and first)
+
+        # Until reload_shard the router keeps serving the shard it has open
+        assert router.process_query(*query) == single_index(records).process_query(*query)
+        router.reload_shard('shard_000')
+        assert 'shard_000' not in router.shards
+        assert router.manifest['shards'][0]['objects'] == entry['objects']
+        assert router.process_query(*query) == single_index(rebuilt).process_query(*query)
+
+
+def test_empty_shards_are_never_routed_to(tmp_path):
+    # Every object in the left half, so the right-hand shards are empty
+    records = random_records(bounds=(0.0, 0.0, 100.0, 40.0))
+    build_shards(records, grid_regions(BOUNDS, 2, 2), str(tmp_path), capacity=32)
+    manifest = load_manifest(str(tmp_path))
+    empty = [entry['name'] for entry in manifest['shards'] if entry['extent'] is None]
+    assert empty == ['shard_001', 'shard_003']
+    reference = single_index(records)
+    with ShardRouter(str(tmp_path)) as router:
+        assert router.shards_for(BOUNDS) == ['shard_000', 'shard_002']
+        assert router.process_query((75.0, 75.0), ['cafe'], [], 5, 0.5, 10) == []
+        for query in random_queries():
+            assert router.process_query(*query) == reference.process_query(*query)
+        router.warm_up(background=False)
+        assert router.wait_ready()
+        assert not set(empty) & set(router.shards)
+
+
+def batch_query(location, lambda_factor=0.1, query_id=None):
+    query = {'location': location, 'positive_keywords': ['cafe'], 'negative_keywords': [], 'k': 5,
+             'lambda_factor': lambda_factor}
+    if query_id is not None:
+        query['query_id'] = query_id
+    return query
+
+
+def test_reject_single_query_then_load_in_background(tmp_path):
+    records = random_records()
+    build_shards(records, grid_regions(BOUNDS, 2, 2), str(tmp_path), capacity=32)
+    query = ((25.0, 25.0), ['cafe'], [], 5, 0.5, 10)
+    with ShardRouter(str(tmp_path), on_unready='reject') as router:
+        with pytest.raises(RegionNotReady) as rejected:
+            router.process_query(*query)
+        assert rejected.value.shards == ['shard_000']
+        # The rejection started a load of the missing shard and nothing else
+        assert router.wait_ready(timeout=30) is False
+        assert router.status() == {'shard_000': 'ready', 'shard_001': 'cold', 'shard_002': 'cold',
+                                   'shard_003': 'cold'}
+        assert router.process_query(*query) == single_index(records).process_query(*query)
+
+
+def test_reject_batch_keeps_answered_queries(tmp_path):
+    records = random_records()
+    build_shards(records, grid_regions(BOUNDS, 2, 1), str(tmp_path), capacity=32)
+    # Batch queries search max(10, lambda_factor * 100) around their location
+    queries = [batch_query((20.0, 50.0), query_id='near'), batch_query((80.0, 50.0), query_id='far'),
+               batch_query((25.0, 30.0))]
+    with ShardRouter(str(tmp_path), on_unready='reject') as router:
+        router.load(['shard_000'])
+        with pytest.raises(RegionNotReady) as rejected:
+            router.process_batch_queries(queries)
+        assert rejected.value.shards == ['shard_001']
+        assert rejected.value.query_ids == ['far']
+        assert sorted(rejected.value.results, key=str) == [2, 'near']
+        router.wait_ready(timeout=30)
+        results = router.process_batch_queries(queries)
+    assert results['near'] == rejected.value.results['near'] and results[2] == rejected.value.results[2]
+    assert len(results['far']) == 5
+
+
+def test_failed_shard_is_retried_by_a_later_query(tmp_path):
+    records = random_records()
+    build_shards(records, grid_regions(BOUNDS, 2, 1), str(tmp_path), capacity=32)
+    moved = str(tmp_path / 'moved')
+    os.rename(str(tmp_path / 'shard_000'), moved)
+    query = ((25.0, 50.0), ['cafe'], [], 5, 0.5, 10)
+    with ShardRouter(str(tmp_path), on_unready='reject') as router:
+        with pytest.raises(RegionNotReady):
+            router.process_query(*query)
+        assert router.wait_ready(timeout=30) is False
+        assert router.status()['shard_000'] == 'failed'
+        assert 'shard_000' in router.errors
+
+        os.rename(moved, str(tmp_path / 'shard_000'))
+        with pytest.raises(RegionNotReady):
+            router.process_query(*query)  # Still not loaded, but the failed shard is loaded again
+        router.wait_ready(timeout=30)
+        assert router.status()['shard_000'] == 'ready' and 'shard_000' not in router.errors
+        assert router.process_query(*query) == single_index(records).process_query(*query)
+
+
+def test_open_async_loads_hottest_shards_first(tmp_path, monkeypatch):
+    records = random_records()
+    build_shards(records, grid_regions(BOUNDS, 2, 2), str(tmp_path), capacity=32)
+    loaded = []
+
+    class RecordingShard(LocalShard):
+        def __init__(self, directory, *args, **kwargs):
+            loaded.append(os.path.basename(directory))
+            super().__init__(directory, *args, **kwargs)
+
+    monkeypatch.setitem(SHARD_MODES, 'local', RecordingShard)
+    # shard_003 (upper right) is hit most, then shard_001; the other two never
+    log = [batch_query((75.0, 75.0)) for _ in range(5)] + [batch_query((25.0, 75.0)) for _ in range(2)]
+    write_query_log(log, str(tmp_path / 'queries.jsonl'))
+    router = ShardRouter.open_async(str(tmp_path), query_log=str(tmp_path / 'queries.jsonl'),
+                                    on_unready='reject')
+    with router:
+        assert router.wait_ready(timeout=30)
+    assert loaded == ['shard_003', 'shard_001', 'shard_000', 'shard_002']
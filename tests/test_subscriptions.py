@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+from index.teq_index import TEQIndex
+from queries.power import POWERQueryProcessor
+from queries.subscriptions import SubscriptionManager
+
+BOUNDS = (-90.0, -180.0, 90.0, 180.0)
+VOCABULARY = ['cafe', 'bar', 'wifi', 'closed', 'park', 'food']
+WEIGHTS = (0.25, 0.5, 1.0, 2.0)  # Exact in float32, so packed scores equal plain ones
+
+
+def random_record(rnd, obj_id):
+    location = (rnd.gauss(10, 3), rnd.gauss(20, 3))
+    words = rnd.sample(VOCABULARY, rnd.randint(1, 3))
+    return obj_id, location, words, ' '.join(words), [rnd.choice(WEIGHTS) for _ in words]
+
+
+def build_index(compact, n=2000, seed=1):
+    rnd = random.Random(seed)
+    teq_index = TEQIndex(BOUNDS, capacity=64, compact=compact)
+    teq_index.add_batch([random_record(rnd, i) for i in range(n)])
+    return teq_index
+
+
+def expected(power, subscription):
+    return power.process_query(subscription.location, subscription.positive_keywords,
+                               subscription.negative_keywords, subscription.k, subscription.lambda_factor,
+                               subscription.search_radius)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_results_and_callbacks_follow_inserts(compact):
+    rnd = random.Random(5)
+    teq_index = build_index(compact)
+    power = POWERQueryProcessor(teq_index)
+    manager = SubscriptionManager(teq_index)
+    calls = []
+
+    def callback(subscription, entered, evicted):
+        calls.append((subscription.subscription_id, entered, evicted))
+
+    subscriptions = [manager.subscribe((rnd.gauss(10, 2), rnd.gauss(20, 2)),
+                                       rnd.sample(VOCABULARY[:3], rnd.randint(1, 2)),
+                                       rnd.sample(['closed'], rnd.randint(0, 1)), rnd.choice([1, 5, 10]), callback,
+                                       rnd.choice([0.0, 0.3, 0.8]), rnd.choice([2, 5]))
+                     for _ in range(15)]
+    next_id = 2000
+    for step in range(40):
+        previous = {subscription.subscription_id: list(subscription.results) for subscription in subscriptions}
+        calls.clear()
+        if step % 2:
+            teq_index.add_batch([random_record(rnd, next_id + i) for i in range(10)])
+            next_id += 10
+        else:
+            teq_index.add_object(*random_record(rnd, next_id))
+            next_id += 1
+        notified = {}
+        for subscription_id, entered, evicted in calls:
+            assert subscription_id not in notified  # One call per insert
+            notified[subscription_id] = (entered, evicted)
+        for subscription in subscriptions:
+            assert subscription.results == expected(power, subscription)
+            before = previous[subscription.subscription_id]
+            entered = [row for row in subscription.results if row[1] not in {old[1] for old in before}]
+            evicted = [row for row in before if row[1] not in {new[1] for new in subscription.results}]
+            if entered:
+                assert notified[subscription.subscription_id] == (entered, evicted)
+            else:
+                assert subscription.subscription_id not in notified
+    assert manager.notified == sum(subscription.notifications for subscription in subscriptions) > 0
+    assert manager.objects_seen == 20 * 10 + 20
+    assert manager.checked < manager.objects_seen * len(subscriptions)
+
+
+def test_compact_index_re_runs_affected_subscriptions(monkeypatch):
+    teq_index = build_index(True)
+    power = POWERQueryProcessor(teq_index)
+    manager = SubscriptionManager(teq_index)
+    near = manager.subscribe((10.0, 20.0), ['cafe'], [], 3, lambda *args: None, 0.5, 2)
+    far = manager.subscribe((-50.0, -100.0), ['cafe'], [], 3, lambda *args: None, 0.5, 2)
+    runs = []
+    run = manager._run
+    monkeypatch.setattr(manager, '_run', lambda subscription: runs.append(subscription) or run(subscription))
+
+    teq_index.add_object(99999, (10.0, 20.0), ['cafe'], 'cafe', [2.0])
+    assert runs == [near]
+    assert near.results[0][1] == 99999 and near.results == expected(power, near)
+    assert far.results == [] and far.notifications == 0
+
+
+def test_unsubscribe_drops_index_entries():
+    teq_index = build_index(False, n=100)
+    manager = SubscriptionManager(teq_index, cell_size=1.0)
+    keep = manager.subscribe((10.0, 20.0), ['cafe'], [], 3, lambda *args: None, search_radius=2)
+    drop = manager.subscribe((10.5, 20.5), ['cafe', 'wifi'], [], 3, lambda *args: None, search_radius=3,
+                             subscription_id='drop')
+    assert drop.subscription_id == 'drop'
+    cells, keywords = dict((cell, set(ids)) for cell, ids in manager.cells.items()), set(manager.by_keyword)
+    assert keywords == {'cafe', 'wifi'}
+
+    manager.unsubscribe('drop')
+    assert 'drop' not in manager.subscriptions
+    assert all('drop' not in ids for ids in manager.cells.values())
+    assert all('drop' not in ids for ids in manager.by_keyword.values())
+    assert set(manager.by_keyword) == {'cafe'}  # Emptied entries are removed
+    assert {cell for cell, ids in cells.items() if keep.subscription_id in ids} == set(manager.cells)
+    assert manager.affected((11.0, 21.0), {'cafe': 1.0}) == [keep]
+    manager.unsubscribe('drop')  # Unknown ids are ignored
+
+    manager.close()
+    assert not manager.cells and not manager.by_keyword and not teq_index.insert_hooks
+
+
+def test_duplicate_subscription_id_is_refused():
+    teq_index = build_index(False, n=100)
+    manager = SubscriptionManager(teq_index)
+    manager.subscribe((10.0, 20.0), ['cafe'], [], 3, lambda *args: None, subscription_id='mine')
+    with pytest.raises(ValueError, match="'mine' already exists"):
+        manager.subscribe((0.0, 0.0), ['bar'], [], 1, lambda *args: None, subscription_id='mine')
+    assert manager.subscriptions['mine'].positive_keywords == ['cafe']
+    assert manager.by_keyword == {'cafe': {'mine'}}
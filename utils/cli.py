@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Heavy modules (numpy, scipy, pandas, matplotlib) are imported inside the commands
+# that need them, so `uask --help` and attached queries start without them.
+
+DEFAULT_SOCKET = os.environ.get('UASK_SOCKET', os.path.join(tempfile.gettempdir(), 'uask.sock'))
+
+# Import-time budget (milliseconds, fresh interpreter) of the modules each command needs
+IMPORT_BUDGET_MS = {
+    'cli': ('utils.cli', 50),
+    'query': ('index.teq_index, queries.power', 300),
+    'batch': ('index.teq_index, queries.batch_query, benchmark.workload', 1000),
+    'job': ('index.teq_index, queries.batch_query, queries.batch_runner', 1000),
+    'bench': ('benchmark.suite', 400),
+}
+
+
+def _row(score, obj_id, location, text) -> dict:
+    return {'score': score, 'obj_id': obj_id, 'location': list(location), 'text': text}
+
+
+def _query_rows(rows) -> list:
+    # process_query ranks by negated score
+    return [_row(-row[0], *row[1:]) for row in rows]
+
+
+def _print_rows(rows, as_json: bool) -> None:
+    if as_json:
+        print(json.dumps(rows))
+        return
+    for rank, row in enumerate(rows, 1):
+        lat, lon = row['location']
+        text = str(row['text']).replace('\n', ' ')
+        print(f"{rank:>3}  {row['score']:.4f}  {row['obj_id']!s:<12} ({lat:.5f}, {lon:.5f})  {text[:60]}")
+
+
+class _Handler:
+    # Answers JSON requests against an open index; shared by `serve` and local commands
+    def __init__(self, processor):
+        self.processor = processor
+
+    def __call__(self, request: dict):
+        method = request.get('method')
+        if method == 'query':
+            return self.query(**request['args'])
+        if method == 'batch':
+            return self.batch(**request['args'])
+        if method == 'info':
+            index = self.processor.teq_index
+            return {'objects': len(index.objects), 'load_seconds': index.load_seconds, 'pid': os.getpid()}
+        raise ValueError(f"Unknown request '{method}'")
+
+    def query(self, location, positive_keywords=(), negative_keywords=(), k=10, lambda_factor=0.5,
+              search_radius=10, predicate=None):
+        location = tuple(location)
+        if predicate:
+            rows = self.processor.process_predicate_query(location, predicate, k, lambda_factor, search_radius)
+        else:
+            rows = self.processor.process_query(location, list(positive_keywords), list(negative_keywords), k,
+                                                lambda_factor, search_radius)
+        return _query_rows(rows)
+
+    def batch(self, queries, max_cluster_size=None):
+        for query in queries:
+            query['location'] = tuple(query['location'])
+        results = self.processor.process_batch_queries(queries, max_cluster_size)
+        return {str(query_id): [_row(*row) for row in rows] for query_id, rows in results.items()}
+
+
+def _request(address: str, request: dict):
+    """Send one request to a `uask serve` process and return its result"""
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            response = json.loads(f.readline())
+    if not response['ok']:
+        raise RuntimeError(f"uask serve at {address}: {response['error']}")
+    return response['result']
+
+
+def _open_index(path: str, batch: bool = False, **processor_kwargs) -> _Handler:
+    from contextlib import redirect_stdout
+    from index.teq_index import TEQIndex
+    with redirect_stdout(sys.stderr):  # Keep stdout for results
+        teq_index = TEQIndex.load_index(path, use_mmap=True)
+    if batch:
+        from queries.batch_query import BatchPOWERQueryProcessor
+        return _Handler(BatchPOWERQueryProcessor(teq_index, **processor_kwargs))
+    from queries.power import POWERQueryProcessor
+    return _Handler(POWERQueryProcessor(teq_index))
+
+
+def _run(args, request: dict, batch: bool = False):
+    # Against a warm `uask serve` process when attached, else open the index here
+    if args.attach:
+        return _request(args.attach, request)
+    if not args.index:
+        raise SystemExit("uask: give an index directory or --attach to a running `uask serve`")
+    return _open_index(args.index, batch)(request)
+
+
+def cmd_query(args) -> int:
+    request = {'method': 'query', 'args': {
+        'location': args.at, 'positive_keywords': args.keywords, 'negative_keywords': args.exclude,
+        'k': args.k, 'lambda_factor': args.lambda_factor, 'search_radius': args.radius,
+        'predicate': args.predicate}}
+    start = time.perf_counter()
+    rows = _run(args, request)
+    _print_rows(rows, args.json)
+    if not args.json:
+        print(f"{len(rows)} results in {(time.perf_counter() - start) * 1e3:.1f} ms", file=sys.stderr)
+    return 0
+
+
+def cmd_batch(args) -> int:
+    from benchmark.workload import iter_query_log
+    queries = list(iter_query_log(args.queries, args.n_neg))
+    start = time.perf_counter()
+    results = _run(args, {'method': 'batch', 'args': {'queries': queries,
+                                                      'max_cluster_size': args.cluster_size}}, batch=True)
+    elapsed = time.perf_counter() - start
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        for query_id, rows in results.items():
+            out.write(json.dumps({'query_id': query_id, 'results': rows}) + "\n")
+    finally:
+        if args.out:
+            out.close()
+    print(f"{len(queries)} queries in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_job(args) -> int:
+    from queries.batch_runner import BatchJob
+    handler = _open_index(args.index, batch=True, score_threads=args.score_threads)
+    job = BatchJob(handler.processor, args.queries, args.out, chunk_size=args.chunk_size,
+                   batch_size=args.batch_size, max_cluster_size=args.cluster_size, output_format=args.format,
+                   n_neg=args.n_neg)
+    with handler.processor:
+        checkpoint = job.run(resume=not args.restart, max_chunks=args.max_chunks)
+    state = 'complete' if checkpoint['complete'] else 'stopped, resume with the same command'
+    print(f"{checkpoint['queries']:,} queries, {checkpoint['results']:,} results in "
+          f"{checkpoint['elapsed_s']:.1f}s ({state})", file=sys.stderr)
+    return 0
+
+
+def cmd_build(args) -> int:
+    from index.teq_index import TEQIndex
+    from utils.dataloader import load_dataset
+    from utils.run_query import batch_process_data
+    data = load_dataset(args.csv)
+    bounds = (data['Latitude'].min(), data['Longitude'].min(), data['Latitude'].max(), data['Longitude'].max())
+    teq = TEQIndex(bounds, capacity=args.capacity, expected_objects=len(data),
+                   compress_text=args.compress_text, bloom_bits=args.bloom_bits, backend=args.backend,
+                   compact=args.compact)
+    start = time.perf_counter()
+    for batch in batch_process_data(data):
+        teq.add_batch(batch)
+    print(f"Indexed {len(data):,} records in {time.perf_counter() - start:.2f}s")
+    teq.save_index(args.out)
+    return 0
+
+
+def cmd_bench(args) -> int:
+    from benchmark.suite import main as suite_main
+    return suite_main(args.suite_args)
+
+
+def _socket_in_use(address: str) -> bool:
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(address)
+        except OSError:
+            return False  # Nothing there, or a stale socket left by a server that died
+    return True
+
+
+def cmd_serve(args) -> int:
+    import socketserver
+    if os.path.exists(args.socket) and _socket_in_use(args.socket):
+        raise SystemExit(f"uask: a server is already listening on {args.socket}")
+    handler = _open_index(args.index, batch=True)
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    response = {'ok': True, 'result': handler(json.loads(line))}
+                except Exception as e:
+                    response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+                self.wfile.write(json.dumps(response).encode() + b'\n')
+
+    if os.path.exists(args.socket):
+        if _socket_in_use(args.socket):  # Checked again: another server may have started meanwhile
+            raise SystemExit(f"uask: a server is already listening on {args.socket}")
+        os.unlink(args.socket)
+    # Create the socket owner-only from the start rather than chmod it after the bind
+    umask = os.umask(0o177)  # Socket created 0600
+    try:
+        server = socketserver.UnixStreamServer(args.socket, RequestHandler)
+    finally:
+        os.umask(umask)
+    with server:
+        print(f"Serving {args.index} on {args.socket} (pid {os.getpid()})", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+    return 0
+
+
+def measure_import_ms(modules: str) -> float:
+    """Import time of comma-separated modules in a fresh interpreter, in milliseconds"""
+    import subprocess
+    code = ("import time; start = time.perf_counter(); import {}; "
+            "print((time.perf_counter() - start) * 1e3)").format(modules)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def cmd_import_time(args) -> int:
+    over = 0
+    for command, (modules, budget) in IMPORT_BUDGET_MS.items():
+        elapsed = min(measure_import_ms(modules) for _ in range(args.repeats))
+        status = 'ok' if elapsed <= budget else 'OVER'
+        over += elapsed > budget
+        print(f"{command:<8}{elapsed:9.1f} ms  budget {budget:>5} ms  {status:<5}{modules}")
+    return 1 if over else 0
+
+
+def _location(value: str):
+    try:
+        lat, lon = (float(v) for v in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected LAT,LON, got {value!r}")
+    return [lat, lon]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='uask', description="U-ASK spatial-keyword index")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Build and save an index from a CSV dataset")
+    build.add_argument('csv')
+    build.add_argument('out', help="Directory to save the index to")
+    build.add_argument('--capacity', type=int)
+    build.add_argument('--bloom-bits', type=int, default=0)
+    build.add_argument('--compress-text', action='store_true')
+    build.add_argument('--backend', default='quadtree',
+                       help="Spatial backend: quadtree, morton, rtree, or auto to pick one from the data")
+    build.add_argument('--compact', action='store_true',
+                       help="Pack leaves: quantized coordinates and compressed keyword postings (quadtree only)")
+    build.set_defaults(func=cmd_build)
+
+    for name, func, help_text in (('query', cmd_query, "Run one top-k query"),
+                                  ('batch', cmd_batch, "Run a query file through the batch processor")):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument('index', nargs='?', help="Saved index directory (not needed with --attach)")
+        sub.add_argument('--attach', nargs='?', const=DEFAULT_SOCKET, metavar='SOCKET',
+                         help=f"Use the index held open by `uask serve` (default {DEFAULT_SOCKET})")
+        sub.set_defaults(func=func)
+        if name == 'query':
+            sub.add_argument('--at', type=_location, required=True, metavar='LAT,LON')
+            sub.add_argument('--keywords', '-w', nargs='*', default=[])
+            sub.add_argument('--exclude', '-x', nargs='*', default=[])
+            sub.add_argument('--predicate', '-p', help="Boolean keyword expression replacing -w/-x")
+            sub.add_argument('-k', type=int, default=10)
+            sub.add_argument('--lambda', dest='lambda_factor', type=float, default=0.5)
+            sub.add_argument('--radius', type=float, default=10)
+            sub.add_argument('--json', action='store_true')
+        else:
+            sub.add_argument('queries', help="Query file: JSONL or the generated_queries.txt format")
+            sub.add_argument('--n-neg', type=int, default=0,
+                             help="Trailing negative keywords per line of a text query file")
+            sub.add_argument('--cluster-size', type=int)
+            sub.add_argument('--out', help="Write JSONL results here instead of stdout")
+
+    job = commands.add_parser('job', help="Stream a large query file through the batch processor, "
+                                           "checkpointing so an interrupted job resumes")
+    job.add_argument('index')
+    job.add_argument('queries', help="Query file: JSONL or the generated_queries.txt format")
+    job.add_argument('out', help="Results file; its checkpoint is written to OUT.ckpt")
+    job.add_argument('--format', choices=('jsonl', 'binary'), default='jsonl')
+    job.add_argument('--chunk-size', type=int, default=100000)
+    job.add_argument('--batch-size', type=int, default=1000)
+    job.add_argument('--cluster-size', type=int)
+    job.add_argument('--n-neg', type=int, default=0)
+    job.add_argument('--score-threads', type=int, default=1,
+                     help="Threads scoring large clusters with NumPy kernels (1 disables threaded scoring)")
+    job.add_argument('--max-chunks', type=int, help="Stop after this many chunks")
+    job.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+    job.set_defaults(func=cmd_job)
+
+    bench = commands.add_parser('bench', help="Run the benchmark suite (arguments go to benchmark.suite)")
+    bench.add_argument('suite_args', nargs=argparse.REMAINDER)
+    bench.set_defaults(func=cmd_bench)
+
+    serve = commands.add_parser('serve', help="Hold an index open for attached queries")
+    serve.add_argument('index')
+    serve.add_argument('--socket', default=DEFAULT_SOCKET)
+    serve.set_defaults(func=cmd_serve)
+
+    import_time = commands.add_parser('import-time', help="Check import times against their budgets")
+    import_time.add_argument('--repeats', type=int, default=3)
+    import_time.set_defaults(func=cmd_import_time)
+    return parser
+
+
+def main(argv=None) -> int:
+    """
+    Entry point of the `uask` command, e.g.
+
+        uask serve saved_indexes/final &
+        uask query --attach --at 34.05,-118.24 -w cafe wifi -x closed -k 5
+        uask batch saved_indexes/final benchmark/data/generated_queries.txt --n-neg 2 --out results.jsonl
+    """
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
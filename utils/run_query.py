@@ -1,4 +1,5 @@
 from index.teq_index import TEQIndex
+from index.memory import format_memory_report
 from queries.power import POWERQueryProcessor
 from utils.dataloader import load_dataset
 import time
@@ -16,6 +17,7 @@ def batch_process_data(data, batch_size: int = 100000) -> List[Tuple]:
     - Location: (Latitude, Longitude) coordinates
     - Keywords: Associated keywords/tags
     - FullText: Complete text description
+    - Weights: Per-keyword weights, aligned with Keywords
     
     The records are sorted by location coordinates to optimize spatial indexing performance.
 
@@ -33,7 +35,8 @@ def batch_process_data(data, batch_size: int = 100000) -> List[Tuple]:
             row['ObjectID'],
             (row['Latitude'], row['Longitude']),
             row['Keywords'],
-            row['FullText']
+            row['FullText'],
+            row['Weights'] if 'Weights' in row else None
         ))
     
     # Sort records by location for more efficient spatial indexing
@@ -75,7 +78,7 @@ def query_runner_without_save(csv_name,location:Tuple[float,float],positive_keyw
     bounds = (min_lat, min_lon, max_lat, max_lon)
         
     # Initialize index with calculated bounds
-    teq = TEQIndex(bounds)
+    teq = TEQIndex(bounds, expected_objects=total_records)
         
     # Process data in batches
     batch_size = 100000  # Adjust based on available memory
@@ -90,8 +93,8 @@ def query_runner_without_save(csv_name,location:Tuple[float,float],positive_keyw
         batch_start = time.time()
             
             # Insert batch
-        for obj_id, location, keywords, full_text in batch:
-            teq.add_object(obj_id, location, keywords, full_text)
+        for obj_id, location, keywords, full_text, weights in batch:
+            teq.add_object(obj_id, location, keywords, full_text, weights)
             
         batch_time = time.time() - batch_start
         records_per_sec = len(batch) / batch_time
@@ -224,8 +227,8 @@ def run_build_index(csv_name, save_dir="saved_indexes", force_rebuild=True):
     max_lon = data['Longitude'].max()
     bounds = (min_lat, min_lon, max_lat, max_lon)
     
-    # Initialize index
-    teq = TEQIndex(bounds)
+    # Initialize index, sizing leaves for the dataset
+    teq = TEQIndex(bounds, expected_objects=total_records)
     
     # Process data in batches
     batch_size = 200000  # 200K records per batch
@@ -240,8 +243,8 @@ def run_build_index(csv_name, save_dir="saved_indexes", force_rebuild=True):
         batch_start = time.time()
         
         # Insert batch
-        for obj_id, location, keywords, full_text in batch:
-            teq.add_object(obj_id, location, keywords, full_text)
+        for obj_id, location, keywords, full_text, weights in batch:
+            teq.add_object(obj_id, location, keywords, full_text, weights)
         
         batch_time = time.time() - batch_start
         records_per_sec = len(batch) / batch_time
@@ -270,6 +273,7 @@ def run_build_index(csv_name, save_dir="saved_indexes", force_rebuild=True):
     print(f"Total index build time: {total_index_time:.2f}s")
     print(f"Average speed: {total_records/total_index_time:,.0f} records/sec")
     print(f"Total records processed: {total_records:,}")
+    print(format_memory_report(teq.memory_report()))
     
     return teq
 